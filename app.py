@@ -1,27 +1,99 @@
 from flask import (
     Flask, render_template, request, send_file, redirect,
-    make_response, url_for, flash
+    make_response, url_for, flash, jsonify, Response, g
 )
 from datetime import datetime
-import zoneinfo
+import math
+import os
+import re
 import sqlite3
-import uuid
+import time
+import zoneinfo
+from functools import partial
 from io import BytesIO
+from itertools import zip_longest
 
-from database import export_to_excel_transposed, init_db, save_history
-from pdf_utils import generate_pdf_bytes, generate_label_pdf
-from data import DIAMETERS_SET_1, DIAMETERS_SET_2, DIAMETERS_SET_3, DIAMETERS_BY_SET
+from database import (
+    HISTORY_FILTERS, STATS_FILTERS, CardNotFoundError, DuplicateCardError, InvalidStatusError,
+    add_stone, card_exists, card_stone_filter, change_position, changes_since, count_cards, create_card, init_db, keyset_page,
+    partitions, soft_delete_cards, soft_delete_stone, stone_filter, stone_stats, update_statuses
+)
+from archive import ArchiveRangeError, archive_years
+from card_import import CardImportError, import_frame, read_upload, rows_from_cards
+from db_pool import close_all, connection
+from exports import ExportFormatUnavailable, iter_csv
+from pdf_cache import content_digest, pdf_cache
+from render_pool import (
+    RenderBusy, RenderTimeout, render_batch_pdf, render_card_excel, render_card_pdf,
+    remove_file, render_data_export, render_excel_export, render_executor, render_label_pdf
+)
+from data import DIAMETERS_SET_3, DIAMETERS_BY_SET, STATUSES, ZESTAWY
+from diameters import catalog_payload, match_payload, snap_diameter
+from maintenance import start_background as start_compaction
+from numbering import next_satznummer, peek_satznummer
+from metrics import (
+    REQUEST_LATENCY, finish_profile, flush as flush_metrics, prometheus_text, should_profile,
+    sql_span, start_profile
+)
 
 app = Flask(__name__)
 app.secret_key = "zmien_na_bezpieczny_secret"
 
-# init DB (idempotent)
-init_db()
+# --- Inicjalizacja (poza importem modułu) ---
+# Import app.py nie dotyka bazy ani ciężkich bibliotek (fpdf, PIL, openpyxl,
+# pyarrow ładują się dopiero w zadaniach render_pool/exports). Migracje
+# uruchamia create_app() - przy gunicorn --preload raz, w procesie master.
+_db_ready = False
+
+def ensure_db():
+    global _db_ready
+    if not _db_ready:
+        init_db()
+        _db_ready = True
+
+def create_app():
+    ensure_db()
+    # połączenia otwarte przez migracje nie mogą przejść do workerów przez fork
+    close_all()
+    return app
+
+@app.before_request
+def _lazy_init_db():
+    # uruchomienie bez fabryki ("gunicorn app:app", "flask run"): migracje przy pierwszym żądaniu
+    ensure_db()
+    # kompaktowanie bazy w tle (maintenance.py) - w workerze, nie w procesie master
+    start_compaction()
+
+# --- Pomiary żądań (metrics.py) ---
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+    # cProfile dla jednego żądania: nagłówek X-Profile: <PROFILE_TOKEN> albo próbkowanie
+    g.profiler = start_profile() if should_profile(request.headers.get("X-Profile")) else None
+
+@app.after_request
+def _record_request(response):
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        path = finish_profile(profiler, request.endpoint or "unmatched")
+        response.headers["X-Profile-File"] = os.path.basename(path)
+    start = g.pop("request_start", None)
+    if start is not None:
+        # odpowiedzi strumieniowe (CSV, eksporty): czas do rozpoczęcia wysyłania
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        REQUEST_LATENCY.observe(time.perf_counter() - start, route, request.method, str(response.status_code))
+    flush_metrics()
+    return response
+
+@app.route("/metrics")
+def metrics():
+    return Response(prometheus_text(), mimetype="text/plain; version=0.0.4")
 
 TRANSLATIONS = {
     "pl": {
         "title": "Generator SATZ-KARTE",
         "satz_label": "Numer karty setu :",
+        "satz_taken": "Karta o tym numerze już istnieje",
         "operator_label": "Operator:",
         "select_set_label": "Wybierz zestaw średnic:",
         "machine_label": "Numer maszyny:",
@@ -38,6 +110,7 @@ TRANSLATIONS = {
     "de": {
         "title": "Satzkarte Generator",
         "satz_label": "Satzkartennummer:",
+        "satz_taken": "Eine Karte mit dieser Nummer existiert bereits",
         "operator_label": "Bearbeiter:",
         "select_set_label": "Wählen Sie den Durchmessersatz:",
         "machine_label": "Maschinennummer:",
@@ -65,10 +138,18 @@ def set_lang(lang_code):
     resp.set_cookie("lang", lang_code, max_age=60*60*24*365)
     return resp
 
-ZESTAWY = {"1": "Untersatz", "2": "Mittelsatz", "3": "Grundsatz"}
+# --- Kamienie z formularza (code0/diameter0, code1/diameter1, ...) ---
+_STONE_FIELD = re.compile(r"(?:code|diameter)(\d+)$")
 
-def generate_unique_satznummer():
-    return str(uuid.uuid4())[:8]
+def form_stones(form):
+    # -> [(kod, średnica jako tekst)] w kolejności wierszy tabeli; numeracja pól
+    # ma luki po usuniętych wierszach, a addStoneRow może powtórzyć numer
+    indices = sorted({int(match.group(1)) for match in map(_STONE_FIELD.match, form.keys()) if match})
+    stones = []
+    for i in indices:
+        pairs = zip_longest(form.getlist(f"code{i}"), form.getlist(f"diameter{i}"), fillvalue="")
+        stones += [(code.strip(), diameter.strip()) for code, diameter in pairs if code.strip() or diameter.strip()]
+    return stones
 
 @app.route("/", methods=["GET", "POST"])
 def index():
@@ -76,7 +157,7 @@ def index():
     t = TRANSLATIONS[lang]
 
     if request.method == "POST":
-        satznummer = request.form.get("satznummer") or generate_unique_satznummer()
+        satznummer = request.form.get("satznummer", "").strip() or next_satznummer()
         machine_number = request.form.get("machine_number", "")
         selected_set = request.form.get("diameter_set", "3")
         stone_type = request.form.get("stone_type", "ND")
@@ -84,111 +165,139 @@ def index():
 
         codes = []
         diameters = []
-        i = 0
-        while True:
-            code = request.form.get(f"code{i}")
-            diameter = request.form.get(f"diameter{i}")
-            if code is None and diameter is None:
-                break
-            if code:
-                codes.append(code.strip())
-            if diameter:
-                try:
-                    diameters.append(float(diameter))
-                except (ValueError, TypeError):
-                    diameters.append(0.0)
-            else:
-                diameters.append(0.0)
-            i += 1
+        for code, diameter in form_stones(request.form):
+            codes.append(code)
+            try:
+                value = float(diameter)
+            except ValueError:
+                value = 0.0
+            # "nan"/"inf" jak nieprawidłowy wpis; pomiar/skan w tolerancji ->
+            # rozmiar z katalogu (0.705 -> 0.7049)
+            diameters.append(snap_diameter(value) if math.isfinite(value) else 0.0)
 
         set_name = ZESTAWY.get(selected_set, "")
 
-        # PDF pozostaje w domyślnym języku generowania (np. niemieckim)
-        pdf_bytes = generate_pdf_bytes(
-            codes=codes,
-            satznummer=satznummer,
-            diameters=diameters,
-            machine_number=machine_number,
-            stone_count=len([c for c in codes if c]),
-            stone_type=stone_type,
-            set_name=set_name,
-            operator=operator,
-        )
+        # przy zapchanej puli renderowania odmawiamy przed zapisem karty,
+        # żeby ponowienie formularza nie trafiło na "karta już istnieje"
+        render_executor.check_capacity()
 
+        # najpierw zapis karty: PDF wydajemy tylko dla karty, która jest w bazie
         try:
             local_time = datetime.now(zoneinfo.ZoneInfo("Europe/Warsaw")).strftime("%Y-%m-%d %H:%M:%S")
-            save_history(satznummer, machine_number, selected_set, local_time)
-        except Exception:
-            pass
+            create_card(satznummer, machine_number, selected_set, operator,
+                        list(zip(codes, diameters)), data=local_time)
+        except DuplicateCardError as e:
+            return str(e), 409
+        except sqlite3.Error:
+            app.logger.exception("Zapis karty %s nie powiódł się", satznummer)
+            return "Błąd zapisu karty w bazie danych", 503
 
+        # PDF pozostaje w domyślnym języku generowania (np. niemieckim)
         try:
-            conn = sqlite3.connect("satzkarten.db")
-            cursor = conn.cursor()
-            for code, dia in zip(codes, diameters):
-                cursor.execute(
-                    "INSERT INTO details (satznummer, code, diameter, status) VALUES (?, ?, ?, ?)",
-                    (satznummer, code, dia, "Nowy")
-                )
-            conn.commit()
-            conn.close()
+            pdf_bytes = render_executor.run(
+                render_card_pdf,
+                codes=codes,
+                satznummer=satznummer,
+                diameters=diameters,
+                machine_number=machine_number,
+                stone_count=len([c for c in codes if c]),
+                stone_type=stone_type,
+                set_name=set_name,
+                operator=operator,
+            )
         except Exception:
-            pass
+            # karta jest już w bazie (ponowienie formularza dałoby 409), więc
+            # zamiast błędu odsyłamy do historii, skąd PDF można pobrać ponownie
+            app.logger.exception("Renderowanie PDF karty %s nie powiodło się", satznummer)
+            flash(f"Karta {satznummer} została zapisana, ale nie udało się wygenerować PDF - "
+                  f"pobierz go ponownie z historii", "warning")
+            return redirect(url_for("history", satznummer=satznummer))
 
-        if isinstance(pdf_bytes, BytesIO):
-            pdf_bytes.seek(0)
-            return send_file(pdf_bytes, as_attachment=True, download_name=f"Satzkarte_{satznummer}.pdf", mimetype="application/pdf")
-        else:
-            return send_file(BytesIO(pdf_bytes), as_attachment=True, download_name=f"Satzkarte_{satznummer}.pdf", mimetype="application/pdf")
+        return send_file(BytesIO(pdf_bytes), as_attachment=True, download_name=f"Satzkarte_{satznummer}.pdf", mimetype="application/pdf")
 
-    generated_satznummer = generate_unique_satznummer()
+    # tylko podgląd: numer zużywa dopiero zapis karty
+    generated_satznummer = peek_satznummer()
     return render_template(
         "index.html",
         diams=DIAMETERS_SET_3,
         generated_satznummer=generated_satznummer,
         lang=lang,
-        t=t,
-        set1=DIAMETERS_SET_1,
-        set2=DIAMETERS_SET_2,
-        set3=DIAMETERS_SET_3
+        t=t
     )
 
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = 500
+
+def _int_arg(name, default=None):
+    try:
+        return int(request.args.get(name, ""))
+    except ValueError:
+        return default
+
+def _page_links(rows, id_index, has_newer, has_older, before_key, after_key):
+    # linki zachowują wszystkie pozostałe parametry (filtry, kursor drugiej listy)
+    args = {k: v for k, v in request.args.items() if v and k not in (before_key, after_key)}
+    links = {"prev": None, "next": None}
+    if rows and has_newer:
+        links["prev"] = url_for("history", **args, **{after_key: rows[0][id_index]})
+    if rows and has_older:
+        links["next"] = url_for("history", **args, **{before_key: rows[-1][id_index]})
+    return links
+
+def _count_rows(conn, query, params):
+    with sql_span(query, params):
+        return conn.execute(query, params).fetchone()[0]
+
 @app.route("/history")
 def history():
     lang = get_lang()
     t = TRANSLATIONS[lang]
 
-    satznummer = request.args.get("satznummer", "")
-    machine = request.args.get("machine", "")
-    zestaw = request.args.get("zestaw", "")
-    date_from = request.args.get("date_from", "")
-    date_to = request.args.get("date_to", "")
-    code = request.args.get("code", "")
-    diameter = request.args.get("diameter", "")
-
-    conn = sqlite3.connect("satzkarten.db")
-    cursor = conn.cursor()
-
-    query_h = "SELECT * FROM history WHERE 1=1"
-    params_h = []
-    if satznummer:
-        query_h += " AND satznummer LIKE ?"
-        params_h.append(f"%{satznummer}%")
-    if machine:
-        query_h += " AND machine LIKE ?"
-        params_h.append(f"%{machine}%")
-    if zestaw:
-        query_h += " AND zestaw = ?"
-        params_h.append(zestaw)
-    if date_from:
-        query_h += " AND date(data) >= date(?)"
-        params_h.append(date_from)
-    if date_to:
-        query_h += " AND date(data) <= date(?)"
-        params_h.append(date_to)
-
-    query_h += " ORDER BY id DESC"
-    cursor.execute(query_h, params_h)
-    raw_history = cursor.fetchall()
+    filters = {name: request.args.get(name, "") for name in HISTORY_FILTERS}
+    per_page = min(max(_int_arg("per_page", HISTORY_PAGE_SIZE), 1), HISTORY_MAX_PAGE_SIZE)
+    with_count = request.args.get("count") == "1"
+
+    totals = None
+    with connection() as conn, partitions(conn, filters) as schemas:
+        # bez filtra dat tylko baza bieżąca; roczniki archiwum wg date_from/date_to
+        # (archived = 1: wiersz z archiwum, tylko do odczytu)
+        arms_h, arms_d = [], []
+        for db in schemas:
+            archived = int(db != "main")
+            where_h, params_h = card_stone_filter(filters, db=db)
+            arms_h.append((
+                f"SELECT h.id, h.satznummer, h.machine, h.zestaw, h.data, {archived} AS archived "
+                f"FROM {db}.history h WHERE 1=1{where_h}",
+                params_h
+            ))
+            where_d, params_d = stone_filter(filters, db=db)
+            arms_d.append((
+                f"""
+                SELECT d.satznummer, d.code, d.diameter, d.id, d.status, {archived} AS archived
+                FROM {db}.details d
+                JOIN {db}.history h ON d.satznummer = h.satznummer
+                WHERE 1=1{where_d}
+                """,
+                params_d
+            ))
+
+        # pozycja dziennika przed odczytem: zmiany z tej chwili strona dostanie
+        # z /history/changes najwyżej drugi raz (nałożenie zmiany jest idempotentne)
+        position = change_position(conn)
+        raw_history, h_newer, h_older = keyset_page(
+            conn, arms_h, "h.id", per_page,
+            before=_int_arg("h_before"), after=_int_arg("h_after")
+        )
+        details_rows, d_newer, d_older = keyset_page(
+            conn, arms_d, "d.id", per_page,
+            before=_int_arg("d_before"), after=_int_arg("d_after")
+        )
+        if with_count:
+            # liczenie wszystkich pasujących wierszy tylko na żądanie (?count=1)
+            totals = {"history": 0, "details": 0}
+            for (query_h, params_h), (query_d, params_d) in zip(arms_h, arms_d):
+                totals["history"] += _count_rows(conn, f"SELECT COUNT(*) FROM ({query_h})", params_h)
+                totals["details"] += _count_rows(conn, f"SELECT COUNT(*) FROM ({query_d})", params_d)
 
     history_rows = [
         {
@@ -197,141 +306,519 @@ def history():
             "machine": row[2],
             "zestaw_num": str(row[3]),
             "zestaw_name": ZESTAWY.get(str(row[3]), row[3]),
-            "data": row[4]
+            "data": row[4],
+            "archived": bool(row[5])
         }
         for row in raw_history
     ]
 
-    query_d = """
-        SELECT d.satznummer, d.code, d.diameter, d.id, d.status
-        FROM details d
-        JOIN history h ON d.satznummer = h.satznummer
-        WHERE 1=1
-    """
-    params_d = []
-    if satznummer:
-        query_d += " AND d.satznummer LIKE ?"
-        params_d.append(f"%{satznummer}%")
-    if machine:
-        query_d += " AND h.machine LIKE ?"
-        params_d.append(f"%{machine}%")
-    if zestaw:
-        query_d += " AND h.zestaw = ?"
-        params_d.append(zestaw)
-    if date_from:
-        query_d += " AND date(h.data) >= date(?)"
-        params_d.append(date_from)
-    if date_to:
-        query_d += " AND date(h.data) <= date(?)"
-        params_d.append(date_to)
-    if code:
-        query_d += " AND d.code LIKE ?"
-        params_d.append(f"%{code}%")
-    if diameter:
-        query_d += " AND d.diameter = ?"
-        params_d.append(diameter)
-
-    query_d += " ORDER BY d.id DESC"
-    cursor.execute(query_d, params_d)
-    details_rows = cursor.fetchall()
-
-    conn.close()
+    count_args = {k: v for k, v in request.args.items() if v}
+    count_args["count"] = "1"
 
     return render_template(
         "history.html",
         history=history_rows,
         details=details_rows,
-        filters={
-            "satznummer": satznummer, "machine": machine,
-            "zestaw": zestaw, "date_from": date_from, "date_to": date_to,
-            "code": code, "diameter": diameter
-        },
+        filters=filters,
+        per_page=per_page,
+        history_pages=_page_links(raw_history, 0, h_newer, h_older, "h_before", "h_after"),
+        details_pages=_page_links(details_rows, 3, d_newer, d_older, "d_before", "d_after"),
+        totals=totals,
+        count_url=url_for("history", **count_args),
+        active_filters={k: v for k, v in filters.items() if v},
+        change_position=position,
+        archive_years=archive_years(),
         diameters_by_set=DIAMETERS_BY_SET,
         lang=lang,
         t=t
     )
 
+# --- Podgląd /history na żywo (dziennik zmian) ---
+@app.route("/history/changes")
+def history_changes():
+    # /history/changes?since=<pozycja> -> zmiany od tej pozycji (JSON, od razu).
+    # Synchroniczny worker nie trzyma strumienia SSE; strumień obsługuje asgi.py,
+    # a strona bez niego odpytuje tę trasę co kilka sekund
+    since = _int_arg("since")
+    if since is None:
+        return jsonify(error="Parametr since musi być liczbą"), 400
+    response = jsonify(changes_since(since))
+    response.cache_control.no_store = True
+    return response
+
 @app.route("/export_card/<satznummer>")
 def export_card(satznummer):
-    excel_bytes = export_to_excel_transposed(satznummer=satznummer)
-    excel_bytes.seek(0)
+    excel_bytes = render_executor.run(render_card_excel, satznummer)
     return send_file(
-        excel_bytes,
+        BytesIO(excel_bytes),
         as_attachment=True,
         download_name=f"export_karta_{satznummer}.xlsx",
         mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
 
+EXPORT_STREAM_CHUNK = 64 * 1024
+
+class _TempFileStream:
+    # treść odpowiedzi z pliku tymczasowego puli renderowania, porcjami; serwer
+    # WSGI woła close() zawsze - także gdy klient rozłączy się przed pierwszą
+    # porcją (generator z try/finally nie ruszyłby wtedy wcale i plik zostawał)
+    def __init__(self, path):
+        self.path = path
+        try:
+            self.file = open(path, "rb")
+        except BaseException:
+            remove_file(path)
+            raise
+
+    def __iter__(self):
+        return iter(partial(self.file.read, EXPORT_STREAM_CHUNK), b"")
+
+    def close(self):
+        self.file.close()
+        remove_file(self.path)
+
+def _file_response(path, mimetype, download_name):
+    stream = _TempFileStream(path)
+    response = Response(stream, mimetype=mimetype, direct_passthrough=True)
+    response.headers["Content-Length"] = str(os.fstat(stream.file.fileno()).st_size)
+    response.headers["Content-Disposition"] = f"attachment; filename={download_name}"
+    return response
+
+@app.route("/export")
+def export_filtered():
+    # eksport wielu kart wg filtrów /history, wysyłany strumieniowo z pliku
+    filters = {name: request.args.get(name, "") for name in HISTORY_FILTERS}
+    # po timeoucie plik zapisany przez pulę usuwa remove_file
+    path = render_executor.run(render_excel_export, filters, on_abandoned=remove_file)
+    return _file_response(path, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                          "export_karty.xlsx")
+
+@app.route("/export.csv")
+def export_csv():
+    # CSV generowany w locie porcjami - nic nie jest budowane w pamięci w całości
+    filters = {name: request.args.get(name, "") for name in HISTORY_FILTERS}
+    response = Response(iter_csv(filters), mimetype="text/csv")
+    response.headers["Content-Disposition"] = "attachment; filename=kamienie.csv"
+    return response
+
+DATA_EXPORT_MIMETYPES = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file",
+}
+
+@app.route("/export.<any(parquet, arrow):fmt>")
+def export_columnar(fmt):
+    filters = {name: request.args.get(name, "") for name in HISTORY_FILTERS}
+    try:
+        # jak /export: plik z zadania dokończonego po timeoucie usuwa remove_file
+        path = render_executor.run(render_data_export, fmt, filters, on_abandoned=remove_file)
+    except ExportFormatUnavailable as e:
+        return str(e), 501
+    return _file_response(path, DATA_EXPORT_MIMETYPES[fmt], f"kamienie.{fmt}")
+
 @app.route("/download_pdf/<satznummer>")
 def download_pdf(satznummer):
     lang = get_lang()
-    conn = sqlite3.connect("satzkarten.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT machine, zestaw, data FROM history WHERE satznummer = ?", (satznummer,))
-    history_row = cursor.fetchone()
-    if not history_row:
-        conn.close()
-        return "Nie znaleziono karty", 404
-
-    machine, zestaw, _ = history_row
-    cursor.execute("SELECT code, diameter FROM details WHERE satznummer = ?", (satznummer,))
-    details = cursor.fetchall()
-    conn.close()
-
-    codes = [row[0] for row in details]
-    diameters = [row[1] for row in details]
-    set_name = ZESTAWY.get(str(zestaw), "")
-    pdf_bytes = generate_pdf_bytes(
-        codes=codes,
-        satznummer=satznummer,
-        diameters=diameters,
-        machine_number=machine,
-        stone_count=len(codes),
-        stone_type="ND",
-        set_name=set_name,
-        operator="",
+    # karta z bazy bieżącej albo z rocznika archiwum (katalog archived_cards)
+    with connection() as conn, partitions(conn, satznummers=[satznummer]) as schemas:
+        for db in schemas:
+            history_row = conn.execute(
+                f"SELECT machine, zestaw, operator FROM {db}.history WHERE satznummer = ? AND deleted_at IS NULL",
+                (satznummer,)
+            ).fetchone()
+            if history_row:
+                break
+        else:
+            return "Nie znaleziono karty", 404
+        details = conn.execute(
+            f"SELECT code, diameter, status FROM {db}.details WHERE satznummer = ? AND deleted_at IS NULL ORDER BY id",
+            (satznummer,)
+        ).fetchall()
+
+    # ETag = skrót treści karty: przeglądarka z aktualną kopią dostaje 304 bez renderowania
+    digest = content_digest(satznummer, history_row, details)
+    if request.if_none_match.contains(digest):
+        response = make_response("", 304)
+        response.set_etag(digest)
+        return response
+
+    data = pdf_cache.get(satznummer, digest)
+    if data is None:
+        machine, zestaw, operator = history_row
+        codes = [row[0] for row in details]
+        diameters = [row[1] for row in details]
+        set_name = ZESTAWY.get(str(zestaw), "")
+        data = render_executor.run(
+            render_card_pdf,
+            codes=codes,
+            satznummer=satznummer,
+            diameters=diameters,
+            machine_number=machine,
+            stone_count=len(codes),
+            stone_type="ND",
+            set_name=set_name,
+            operator=operator or "",
+        )
+        pdf_cache.put(satznummer, digest, data)
+
+    response = send_file(BytesIO(data), as_attachment=True, download_name=f"Satzkarte_{satznummer}.pdf",
+                         mimetype="application/pdf", etag=digest, max_age=0)
+    response.cache_control.no_cache = True
+    return response
+
+# --- Usuwanie (miękkie: deleted_at; wiersze fizycznie usuwa maintenance.py) ---
+def _back_to_history():
+    # powrót na tę samą stronę historii (filtry, kursor), a nie na pierwszą
+    return redirect(request.referrer or url_for("history"))
+
+def _invalidate_cards(satznummers):
+    pdf_cache.invalidate_many(satznummers)
+
+class CardListRequestError(Exception):
+    pass
+
+def _card_list_payload():
+    # -> (obiekt JSON albo {} dla formularza, lista satznummer z JSON lub formularza);
+    # JSON innego kształtu niż {"satznummers": ["...", ...], ...} -> 400
+    payload = request.get_json(silent=True)
+    if payload is None:
+        payload = {}
+    if not isinstance(payload, dict):
+        raise CardListRequestError("Oczekiwano obiektu JSON")
+    satznummers = payload.get("satznummers")
+    if not satznummers:
+        return payload, request.form.getlist("satznummer")
+    if not isinstance(satznummers, list) or not all(
+        isinstance(s, (str, int)) and not isinstance(s, bool) for s in satznummers
+    ):
+        raise CardListRequestError("satznummers musi być listą numerów kart")
+    return payload, satznummers
+
+@app.errorhandler(CardListRequestError)
+def card_list_request_error(e):
+    return (jsonify(error=str(e)), 400) if request.is_json else (str(e), 400)
+
+def _wants_json():
+    # fetch z /history (Accept: application/json): wiersz usuwa strona, bez przeładowania
+    return request.accept_mimetypes.best == "application/json"
 
-    )
-    if isinstance(pdf_bytes, BytesIO):
-        pdf_bytes.seek(0)
-        return send_file(pdf_bytes, as_attachment=True, download_name=f"Satzkarte_{satznummer}.pdf", mimetype="application/pdf")
-    else:
-        return send_file(BytesIO(pdf_bytes), as_attachment=True, download_name=f"Satzkarte_{satznummer}.pdf", mimetype="application/pdf")
 @app.route("/delete/<satznummer>", methods=["POST"])
 def delete_card(satznummer):
-    conn = sqlite3.connect("satzkarten.db")
-    cursor = conn.cursor()
-    # usuń szczegóły powiązane z kartą
-    cursor.execute("DELETE FROM details WHERE satznummer = ?", (satznummer,))
-    # usuń wpis w historii
-    cursor.execute("DELETE FROM history WHERE satznummer = ?", (satznummer,))
-    conn.commit()
-    conn.close()
-    # po usunięciu wróć do strony historii
-    return redirect(url_for("history"))
+    deleted = soft_delete_cards(satznummers=[satznummer])
+    _invalidate_cards(deleted)
+    if _wants_json():
+        return jsonify(deleted=len(deleted), cards=deleted)
+    return _back_to_history()
+
 @app.route("/delete_stone/<int:stone_id>", methods=["POST"])
 def delete_stone(stone_id):
-    conn = sqlite3.connect("satzkarten.db")
-    cursor = conn.cursor()
-    # usuń kamień po jego ID
-    cursor.execute("DELETE FROM details WHERE id = ?", (stone_id,))
-    conn.commit()
-    conn.close()
-    # po usunięciu wróć do historii
-    return redirect(url_for("history"))
+    satznummer = soft_delete_stone(stone_id)
+    if satznummer:
+        pdf_cache.invalidate(satznummer)
+    if _wants_json():
+        return jsonify(deleted=1 if satznummer else 0, cards=[satznummer] if satznummer else [])
+    return _back_to_history()
+
+@app.route("/delete_cards", methods=["POST"])
+def delete_cards():
+    # zaznaczone karty (formularz/JSON {"satznummers": [...]}) albo wszystkie
+    # pasujące do filtrów /history (JSON {"filters": {...}} lub pola formularza);
+    # bez listy i bez filtra nic nie jest usuwane
+    payload, satznummers = _card_list_payload()
+    satznummers = [str(s) for s in satznummers if s] or None
+    source = payload.get("filters") if isinstance(payload.get("filters"), dict) else request.form
+    filters = {name: str(source.get(name) or "") for name in HISTORY_FILTERS}
+    if satznummers is None and not any(filters.values()):
+        message = "Nie wybrano kart ani filtra"
+        return (jsonify(error=message), 400) if request.is_json else (message, 400)
+
+    deleted = soft_delete_cards(satznummers=satznummers, filters=filters)
+    _invalidate_cards(deleted)
+    if request.is_json:
+        return jsonify(deleted=len(deleted), cards=deleted)
+    return _back_to_history()
+
+# --- Zmiana statusu / dodanie kamienia (historia) ---
+STATUS_BATCH_MAX = 1000
+
+class StatusRequestError(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def parse_status_changes(payload):
+    # {"changes": [{"id": 12, "status": "Do naprawy"}, ...]} -> [(12, "Do naprawy"), ...]
+    changes = payload.get("changes") if isinstance(payload, dict) else None
+    if not isinstance(changes, list):
+        raise StatusRequestError("Oczekiwano listy changes")
+    if len(changes) > STATUS_BATCH_MAX:
+        raise StatusRequestError(f"Za dużo zmian w jednym żądaniu (maks. {STATUS_BATCH_MAX})", 413)
+    try:
+        return [(int(change["id"]), change["status"]) for change in changes]
+    except (KeyError, TypeError, ValueError):
+        raise StatusRequestError("Każda zmiana musi mieć id i status")
+
+def apply_status_changes(changes):
+    cards = update_statuses(changes)
+    pdf_cache.invalidate_many(cards)
+    return cards
+
+@app.route("/update_status/<int:stone_id>", methods=["POST"])
+def update_status(stone_id):
+    try:
+        cards = apply_status_changes([(stone_id, request.form.get("status", ""))])
+    except InvalidStatusError as e:
+        return jsonify(error=str(e)), 400
+    if not cards:
+        return jsonify(error="Nie znaleziono kamienia"), 404
+    return jsonify(updated=1, cards=cards)
+
+@app.route("/update_status", methods=["POST"])
+def update_status_bulk():
+    # {"changes": [{"id": 12, "status": "Do naprawy"}, ...]} - jedna transakcja,
+    # jeden commit; wysyłane paczkami przez stronę historii (także sendBeacon)
+    try:
+        pairs = parse_status_changes(request.get_json(force=True, silent=True))
+        cards = apply_status_changes(pairs)
+    except StatusRequestError as e:
+        return jsonify(error=str(e)), e.status_code
+    except InvalidStatusError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(updated=len(pairs), cards=cards)
+
+@app.route("/add_stone", methods=["POST"])
+def add_stone_route():
+    satznummer = request.form.get("satznummer", "").strip()
+    code = request.form.get("code", "").strip()
+    try:
+        diameter = float(request.form.get("diameter", ""))
+    except ValueError:
+        diameter = math.nan
+    if not math.isfinite(diameter):
+        return "Nieprawidłowa średnica", 400
+    diameter = snap_diameter(diameter)
+    if not satznummer:
+        return "Brak numeru karty", 400
+    try:
+        add_stone(satznummer, code, diameter)
+    except CardNotFoundError as e:
+        return str(e), 404
+    pdf_cache.invalidate(satznummer)
+    return redirect(url_for("history", satznummer=satznummer))
 
 @app.route("/generate_label_direct", methods=["POST"])
 def generate_label_direct():
-    satznummer = request.form.get("satznummer") or generate_unique_satznummer()
+    # naklejka nie tworzy karty, więc nie rezerwuje numeru z sekwencji
+    satznummer = request.form.get("satznummer", "").strip()
+    if not satznummer:
+        return "Brak numeru karty", 400
     selected_set = request.form.get("diameter_set", "3")
     set_name = ZESTAWY.get(selected_set, "Zestaw")
-    stone_count = len([k for k in request.form.keys() if k.startswith("code")])
-    pdf_bytes = generate_label_pdf(set_name=set_name, stone_count=stone_count, uuid_code=satznummer)
-    if isinstance(pdf_bytes, BytesIO):
-        pdf_bytes.seek(0)
-        return send_file(pdf_bytes, as_attachment=True, download_name=f"naklejka_{satznummer}.pdf", mimetype="application/pdf")
+    stone_count = len([code for code, _ in form_stones(request.form) if code])
+    pdf_bytes = render_executor.run(render_label_pdf, set_name, stone_count, satznummer)
+    return send_file(BytesIO(pdf_bytes), as_attachment=True, download_name=f"naklejka_{satznummer}.pdf", mimetype="application/pdf")
+
+BATCH_MAX_CARDS = int(os.environ.get("BATCH_MAX_CARDS", "500"))
+
+@app.route("/batch_pdf", methods=["GET", "POST"])
+def batch_pdf():
+    # POST: lista satznummer (formularz lub JSON {"satznummers": [...]}),
+    # GET: wszystkie karty pasujące do filtrów /history.
+    # mode=labels -> arkusz naklejek A4 zamiast kart
+    if request.method == "POST":
+        payload, satznummers = _card_list_payload()
+        satznummers = [str(s) for s in satznummers if s]
+        mode = payload.get("mode") or request.form.get("mode", "cards")
+        filters = None
+        if not satznummers:
+            return "Nie wybrano żadnej karty", 400
+        if len(satznummers) > BATCH_MAX_CARDS:
+            return f"Za dużo kart w jednym wydruku (maks. {BATCH_MAX_CARDS})", 413
+    else:
+        satznummers = None
+        mode = request.args.get("mode", "cards")
+        filters = {name: request.args.get(name, "") for name in HISTORY_FILTERS}
+
+    total = count_cards(satznummers=satznummers, filters=filters)
+    if total == 0:
+        return "Nie znaleziono kart", 404
+    if total > BATCH_MAX_CARDS:
+        return f"Za dużo kart w jednym wydruku ({total}, maks. {BATCH_MAX_CARDS}) - zawęź filtr", 413
+
+    mode = "labels" if mode == "labels" else "cards"
+    pdf_bytes = render_executor.run(render_batch_pdf, satznummers, filters, mode)
+    download_name = f"naklejki_{total}.pdf" if mode == "labels" else f"Satzkarten_{total}.pdf"
+    return send_file(BytesIO(pdf_bytes), as_attachment=True, download_name=download_name, mimetype="application/pdf")
+
+# --- Katalog średnic (dla frontendu i skanera) ---
+@app.route("/api/diameters")
+def api_diameters():
+    response = jsonify(catalog_payload())
+    # katalog zmienia się tylko z wdrożeniem
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response
+
+@app.route("/api/diameters/match")
+def api_diameter_match():
+    # /api/diameters/match?d=0.705 -> najbliższy rozmiar z katalogu (lub null)
+    value = request.args.get("d", type=float)
+    if value is None or not math.isfinite(value):
+        return jsonify(error="Parametr d musi być liczbą"), 400
+    return jsonify(match=match_payload(value))
+
+@app.route("/api/satznummer/next")
+def api_next_satznummer():
+    # kolejny numer dla formularza (po wydaniu karty strona się nie przeładowuje);
+    # podgląd bez rezerwacji, ?after=<numer wysłanej karty>
+    response = jsonify(satznummer=peek_satznummer(request.args.get("after", "").strip()))
+    response.cache_control.no_store = True
+    return response
+
+@app.route("/api/satznummer/check")
+def api_check_satznummer():
+    # /api/satznummer/check?satznummer=10000042 -> czy numer jest już zajęty
+    satznummer = request.args.get("satznummer", "").strip()
+    if not satznummer:
+        return jsonify(error="Brak parametru satznummer"), 400
+    return jsonify(satznummer=satznummer, exists=card_exists(satznummer))
+
+# --- Statystyki ---
+def _pivot(rows):
+    # [(klucz, status, liczba)] -> {klucz: {status: liczba}}; kolejność kluczy jak w zapytaniu
+    table = {}
+    for key, status, stones in rows:
+        table.setdefault(key, dict.fromkeys(STATUSES, 0))[status] = stones
+    return table
+
+def _diameter_order(item):
+    # średnice spoza katalogu po liczbie; pusta (brak średnicy) na końcu
+    return (item[0] == "", item[0] if item[0] != "" else 0)
+
+@app.route("/stats")
+def stats():
+    filters = {name: request.args.get(name, "") for name in STATS_FILTERS}
+
+    counts = {}
+    for zestaw, diameter, stones in stone_stats(["zestaw", "diameter"], filters):
+        counts.setdefault(zestaw, {})[diameter] = stones
+    # pełny katalog średnic zestawu (także rozmiary bez kamieni), potem średnice spoza katalogu
+    by_diameter = {}
+    for zestaw in sorted(set(DIAMETERS_BY_SET) | set(counts)):
+        if filters["zestaw"] and zestaw != filters["zestaw"]:
+            continue
+        set_counts = counts.get(zestaw, {})
+        catalog = DIAMETERS_BY_SET.get(zestaw, [])
+        by_diameter[zestaw] = [(d, set_counts.get(d, 0)) for d in catalog] + sorted(
+            ((d, n) for d, n in set_counts.items() if d not in catalog), key=_diameter_order
+        )
+
+    return render_template(
+        "stats.html",
+        filters=filters,
+        statuses=STATUSES,
+        zestawy=ZESTAWY,
+        total=stone_stats([], filters)[0][0],
+        by_status=dict(stone_stats(["status"], filters)),
+        by_zestaw=_pivot(stone_stats(["zestaw", "status"], filters)),
+        by_machine=_pivot(stone_stats(["machine", "status"], filters)),
+        by_month=_pivot(stone_stats(["month", "status"], filters)),
+        by_diameter=by_diameter,
+        json_url=url_for("stats_json", group="month,status", **{k: v for k, v in filters.items() if v}),
+    )
+
+@app.route("/stats.json")
+def stats_json():
+    # np. /stats.json?group=machine,status&month_from=2025-01
+    group_by = [g for g in request.args.get("group", "status").split(",") if g]
+    filters = {name: request.args.get(name, "") for name in STATS_FILTERS}
+    try:
+        rows = stone_stats(group_by, filters)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(
+        group=group_by,
+        filters={k: v for k, v in filters.items() if v},
+        rows=[dict(zip(group_by + ["stones"], row)) for row in rows],
+    )
+
+# --- Import kart (API JSON, plik CSV/JSON ze stanowiska pomiarowego) ---
+IMPORT_FLASH_ERRORS = 10
+
+def _import_response(report):
+    # 201: wszystko zapisane; 422: nic nie zapisano z powodu błędów; 200: częściowo / dry_run
+    if report["error_count"] and not report["created"]:
+        return jsonify(report), 422
+    if report["created"] and not report["error_count"]:
+        return jsonify(report), 201
+    return jsonify(report), 200
+
+@app.route("/api/cards", methods=["POST"])
+def api_cards():
+    # karta albo lista kart: {"satznummer", "machine", "zestaw", "operator", "data",
+    # "stones": [{"code", "diameter", "status"}]}; bez satznummer - numer z sekwencji.
+    # ?dry_run=1 - tylko walidacja. Odpowiedź: raport z card_import.import_frame
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return jsonify(error="Oczekiwano JSON z kartą albo listą kart"), 400
+    try:
+        report = import_frame(rows_from_cards(payload), dry_run=request.args.get("dry_run") == "1")
+    except CardImportError as e:
+        return jsonify(error=str(e)), e.status_code
+    return _import_response(report)
+
+@app.route("/import", methods=["POST"])
+def import_cards():
+    # plik CSV/JSON (pole file) albo surowe body (Content-Type text/csv / application/json);
+    # formularz z /history dostaje komunikat na stronie, reszta - raport JSON
+    upload = request.files.get("file")
+    if upload is not None:
+        data, filename, content_type = upload.read(), upload.filename or "", upload.mimetype
+    else:
+        data, filename, content_type = request.get_data(), "", request.mimetype
+    from_page = request.accept_mimetypes.best == "text/html"
+    dry_run = (request.form.get("dry_run") or request.args.get("dry_run")) == "1"
+    try:
+        if not data:
+            raise CardImportError("Brak pliku do importu")
+        report = import_frame(read_upload(data, filename, content_type), dry_run=dry_run)
+    except CardImportError as e:
+        if from_page:
+            flash(str(e), "danger")
+            return _back_to_history()
+        return jsonify(error=str(e)), e.status_code
+    if not from_page:
+        return _import_response(report)
+
+    if dry_run:
+        flash(f"Sprawdzono {report['rows']} wierszy: {report['cards']} poprawnych kart, "
+              f"{report['error_count']} błędów", "info")
     else:
-        return send_file(BytesIO(pdf_bytes), as_attachment=True, download_name=f"naklejka_{satznummer}.pdf", mimetype="application/pdf")
+        flash(f"Zaimportowano {len(report['created'])} kart z {report['rows']} wierszy, "
+              f"błędów: {report['error_count']}", "success" if not report["error_count"] else "warning")
+    for error in report["errors"][:IMPORT_FLASH_ERRORS]:
+        flash(f"Wiersz {error['row']}: {error['field']} - {error['error']}", "danger")
+    if report["error_count"] > IMPORT_FLASH_ERRORS:
+        flash(f"... i {report['error_count'] - IMPORT_FLASH_ERRORS} kolejnych błędów", "danger")
+    return _back_to_history()
+
+@app.errorhandler(RenderBusy)
+def render_busy(e):
+    response = make_response(str(e), 503)
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+@app.errorhandler(RenderTimeout)
+def render_timeout(e):
+    return str(e), 504
+
+@app.errorhandler(ArchiveRangeError)
+def archive_range(e):
+    return str(e), 400
+
+@app.route("/render_status")
+def render_status():
+    return jsonify(render_executor.stats())
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5001, debug=True)
+    create_app().run(host="0.0.0.0", port=5001, debug=True)
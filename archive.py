@@ -0,0 +1,304 @@
+"""Archiwum roczne: stare karty przenoszone z bazy bieżącej do plików per rok.
+
+Karty (history + details) starsze niż ARCHIVE_AFTER_DAYS trafiają do
+ARCHIVE_DIR/<baza>_<rok>.db (rok z kolumny data), więc bieżąca baza, jej
+indeksy i kopie zapasowe nie rosną przez cały czas życia zakładu, a plik
+zamkniętego roku przestaje się zmieniać. Przenoszenie idzie porcjami: najpierw
+kopia do archiwum (INSERT OR IGNORE po id), potem w osobnej transakcji
+usunięcie z bazy bieżącej i wpis w archived_cards (satznummer -> rok).
+Przerwanie między krokami zostawia kartę w obu miejscach do następnego
+przebiegu - nigdy jej nie gubi.
+
+Zapytania (/history, PDF, eksporty, wydruk zbiorczy) dołączają przez ATTACH
+tylko roczniki wskazane przez filtr date_from/date_to albo przez katalog
+archived_cards (konkretne satznummery). Karty w archiwum są tylko do odczytu.
+
+Archiwizacja jest opcjonalna i nie działa w procesach aplikacji: tylko
+ręcznie albo z crona, z wiekiem kart podanym jawnie (albo ARCHIVE_AFTER_DAYS):
+    python archive.py --older-than-days 730 [--batch-size 500]
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from db_pool import DB_NAME, connection
+
+# domyślny wiek dla python archive.py; 0 = bez archiwizacji (wszystko zostaje w bazie bieżącej)
+ARCHIVE_AFTER_DAYS = float(os.environ.get("ARCHIVE_AFTER_DAYS", "0"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_DIR = os.environ.get(
+    "ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(DB_NAME)), "archive")
+)
+_DB_STEM = os.path.splitext(os.path.basename(DB_NAME))[0]
+_ARCHIVE_FILE = re.compile(re.escape(_DB_STEM) + r"_(\d{4})\.db$")
+
+logger = logging.getLogger("satzkarten.archive")
+
+
+class ArchiveRangeError(Exception):
+    # więcej roczników niż SQLite pozwala dołączyć do jednego połączenia
+    pass
+
+
+# --- Pliki archiwum ---
+def archive_path(year):
+    return os.path.join(ARCHIVE_DIR, f"{_DB_STEM}_{year}.db")
+
+
+def archive_years():
+    # roczniki, dla których istnieje plik archiwum (rosnąco)
+    try:
+        names = os.listdir(ARCHIVE_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(int(match.group(1)) for match in map(_ARCHIVE_FILE.match, names) if match)
+
+
+# schemat jak w bazie bieżącej (te same kolumny, indeksy i FTS), żeby filtry
+# /history działały bez zmian; bez triggerów statystyk i dziennika zmian
+_ARCHIVE_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS history (
+           id INTEGER PRIMARY KEY,
+           satznummer TEXT,
+           machine TEXT,
+           zestaw TEXT,
+           data TEXT,
+           operator TEXT DEFAULT '',
+           deleted_at TEXT
+       )""",
+    """CREATE TABLE IF NOT EXISTS details (
+           id INTEGER PRIMARY KEY,
+           satznummer TEXT,
+           code TEXT,
+           diameter REAL,
+           status TEXT DEFAULT 'Nowy',
+           deleted_at TEXT
+       )""",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_history_satznummer ON history(satznummer)",
+    "CREATE INDEX IF NOT EXISTS idx_history_machine ON history(machine)",
+    "CREATE INDEX IF NOT EXISTS idx_history_zestaw_data ON history(zestaw, data)",
+    "CREATE INDEX IF NOT EXISTS idx_history_data ON history(data)",
+    "CREATE INDEX IF NOT EXISTS idx_details_satznummer ON details(satznummer)",
+    "CREATE INDEX IF NOT EXISTS idx_details_diameter ON details(diameter)",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+           satznummer, machine,
+           content='history', content_rowid='id', tokenize='trigram'
+       )""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS details_fts USING fts5(
+           code,
+           content='details', content_rowid='id', tokenize='trigram'
+       )""",
+    # archiwum tylko przyrasta - wystarczą triggery wstawiania
+    """CREATE TRIGGER IF NOT EXISTS history_fts_ai AFTER INSERT ON history BEGIN
+           INSERT INTO history_fts(rowid, satznummer, machine)
+           VALUES (new.id, new.satznummer, new.machine);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS details_fts_ai AFTER INSERT ON details BEGIN
+           INSERT INTO details_fts(rowid, code) VALUES (new.id, new.code);
+       END""",
+)
+
+
+def _create_archive(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("BEGIN IMMEDIATE")
+        for statement in _ARCHIVE_SCHEMA:
+            conn.execute(statement)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+# --- Dołączanie roczników do połączenia ---
+def _schema_name(year):
+    return f"archive_{int(year)}"
+
+
+@contextmanager
+def attached(conn, years, create=False):
+    # -> ["main", "archive_2023", ...]; po wyjściu roczniki są odłączane, bo
+    # połączenie wraca do puli (ATTACH działa tylko poza transakcją)
+    years = sorted(set(years))
+    if not years:
+        # bez archiwum: zwykłe zapytanie do bazy bieżącej
+        yield ["main"]
+        return
+    limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    if len(years) > limit:
+        raise ArchiveRangeError(f"Zakres obejmuje {len(years)} lat archiwum (najwyżej {limit}) - zawęź filtr dat")
+    # rocznik pozostały po nieudanym odłączeniu jest używany dalej
+    present = {row[1] for row in conn.execute("PRAGMA database_list")}
+    added = []
+    try:
+        for year in years:
+            name = _schema_name(year)
+            if name in present:
+                continue
+            path = archive_path(year)
+            if create and not os.path.exists(path):
+                _create_archive(path)
+            conn.execute(f"ATTACH DATABASE ? AS {name}", (path,))
+            added.append(name)
+        yield ["main"] + [_schema_name(year) for year in years]
+    finally:
+        for name in added:
+            try:
+                conn.execute(f"DETACH DATABASE {name}")
+            except sqlite3.OperationalError:
+                # otwarty kursor na rocznik; zostaje dołączony do następnego użycia
+                logger.warning("Nie udało się odłączyć %s", name)
+
+
+def _year(text):
+    try:
+        return int(str(text)[:4])
+    except ValueError:
+        return None
+
+
+def partition_years(conn, filters=None, satznummers=None):
+    # roczniki archiwum potrzebne dla filtrów /history albo listy satznummer;
+    # bez filtra dat i bez numerów z archiwum - tylko baza bieżąca
+    years = archive_years()
+    if not years:
+        return []
+    filters = filters or {}
+    selected = set()
+    if filters.get("date_from") or filters.get("date_to"):
+        low = _year(filters.get("date_from")) or years[0]
+        high = _year(filters.get("date_to")) or years[-1]
+        selected.update(year for year in years if low <= year <= high)
+    if satznummers:
+        selected.update(row[0] for row in conn.execute(
+            "SELECT DISTINCT year FROM archived_cards WHERE satznummer IN (SELECT value FROM json_each(?))",
+            (json.dumps([str(s) for s in satznummers]),)
+        ))
+    if filters.get("satznummer"):
+        # jak filtr /history (FTS trigram / LIKE): fragment numeru, bez rozróżniania wielkości liter
+        term = re.sub(r"([\\%_])", r"\\\1", filters["satznummer"])
+        selected.update(row[0] for row in conn.execute(
+            "SELECT DISTINCT year FROM archived_cards WHERE satznummer LIKE ? ESCAPE '\\'",
+            (f"%{term}%",)
+        ))
+    return sorted(selected.intersection(years))
+
+
+# --- Przenoszenie kart do archiwum ---
+def _candidate_years(conn, cutoff):
+    return [int(row[0]) for row in conn.execute(
+        """SELECT DISTINCT substr(data, 1, 4) FROM history
+           WHERE deleted_at IS NULL AND data < datetime('now', ?)
+             AND data GLOB '[0-9][0-9][0-9][0-9]-*'""",
+        (cutoff,)
+    )]
+
+
+def _archive_batch(conn, schema, year, cutoff, batch_size):
+    from database import retain_stone_stats
+
+    ids = [row[0] for row in conn.execute(
+        """SELECT id FROM main.history
+           WHERE deleted_at IS NULL AND data >= ? AND data < ? AND data < datetime('now', ?)
+           ORDER BY id LIMIT ?""",
+        (f"{year}-01-01", f"{year + 1}-01-01", cutoff, batch_size)
+    )]
+    if not ids:
+        return 0
+    selection = json.dumps(ids)
+
+    # 1. kopia do archiwum (piszemy tylko do pliku rocznika)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            f"""INSERT OR IGNORE INTO {schema}.history (id, satznummer, machine, zestaw, data, operator)
+                SELECT id, satznummer, machine, zestaw, data, operator FROM main.history
+                WHERE id IN (SELECT value FROM json_each(?))""",
+            (selection,)
+        )
+        # kamienie usunięte miękko nie są archiwizowane
+        conn.execute(
+            f"""INSERT OR IGNORE INTO {schema}.details (id, satznummer, code, diameter, status)
+                SELECT d.id, d.satznummer, d.code, d.diameter, d.status
+                FROM main.details d JOIN main.history h ON h.satznummer = d.satznummer
+                WHERE h.id IN (SELECT value FROM json_each(?)) AND d.deleted_at IS NULL""",
+            (selection,)
+        )
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+    # 2. usunięcie z bazy bieżącej (kamienie kaskadowo) + katalog numerów
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            """INSERT OR REPLACE INTO main.archived_cards (satznummer, year)
+               SELECT satznummer, ? FROM main.history WHERE id IN (SELECT value FROM json_each(?))""",
+            (year, selection)
+        )
+        # statystyki obejmują cały okres, także archiwum
+        retain_stone_stats(conn, selection)
+        conn.execute("DELETE FROM main.history WHERE id IN (SELECT value FROM json_each(?))", (selection,))
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    return len(ids)
+
+
+def archive_cards(older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    # -> {rok: liczba przeniesionych kart}
+    if older_than_days <= 0:
+        return {}
+    cutoff = f"-{older_than_days} days"
+    moved = {}
+    with connection() as conn:
+        for year in _candidate_years(conn, cutoff):
+            with attached(conn, [year], create=True) as schemas:
+                schema = schemas[1]
+                moved[year] = 0
+                while True:
+                    count = _archive_batch(conn, schema, year, cutoff, batch_size)
+                    moved[year] += count
+                    if count < batch_size:
+                        break
+                conn.execute(f"INSERT INTO {schema}.history_fts(history_fts) VALUES ('optimize')")
+                conn.execute(f"INSERT INTO {schema}.details_fts(details_fts) VALUES ('optimize')")
+                conn.execute(f"ANALYZE {schema}")
+    if moved:
+        logger.info("Archiwizacja kart: %s", moved)
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--older-than-days", type=float, default=ARCHIVE_AFTER_DAYS,
+                        help="przenieś karty starsze niż tyle dni (według kolumny data)")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+    if args.older_than_days <= 0:
+        parser.error("archiwizacja wyłączona: podaj --older-than-days (albo ARCHIVE_AFTER_DAYS)")
+
+    from database import init_db
+    from maintenance import optimize_indexes
+
+    init_db()
+    start = time.perf_counter()
+    moved = archive_cards(args.older_than_days, args.batch_size)
+    if moved:
+        # indeksy FTS i statystyki bazy bieżącej po usunięciu przeniesionych kart
+        with connection() as conn:
+            optimize_indexes(conn, sum(moved.values()))
+    print({"moved": moved, "seconds": round(time.perf_counter() - start, 3)})
+
+
+if __name__ == "__main__":
+    main()
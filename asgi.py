@@ -0,0 +1,310 @@
+"""Opcjonalny tryb ASGI (uvicorn / gunicorn z workerem uvicorn).
+
+    uvicorn asgi:app --workers 2
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:app
+
+Bezczynne połączenia i długie odpytywanie nie zajmują procesu ani wątku.
+Trasy Flask działają bez zmian przez adapter a2wsgi (pula ASGI_THREADS wątków),
+ciężkie renderowanie dalej idzie do render_pool. Wybrane krótkie trasy
+(async_route) obsługiwane są natywnie: baza przez run_db (pula wątków
+o rozmiarze puli połączeń), bez przechodzenia przez Flask. Natywnie działa
+też strumień zmian /history/changes (SSE) dla otwartych stron historii.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+
+from db_pool import POOL_SIZE, close_all
+from maintenance import start_background as start_compaction
+from metrics import REQUEST_LATENCY, flush as flush_metrics
+
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", "32"))
+
+# nie więcej równoległych operacji na bazie niż połączeń w puli
+_db_threads = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="asgi-db")
+
+logger = logging.getLogger("satzkarten.asgi")
+
+
+async def run_db(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_db_threads, lambda: fn(*args))
+
+
+def _flask_app():
+    from app import create_app
+    # ciało żądania czytane przez adapter porcjami z receive, odpowiedź wysyłana
+    # porcjami (strumień eksportu), close() iterable wołane po wysłaniu
+    return WSGIMiddleware(create_app(), workers=ASGI_THREADS)
+
+
+# --- Trasy natywne ---
+_routes = {}
+
+
+def async_route(method, path):
+    def decorator(handler):
+        _routes[(method, path)] = handler
+        return handler
+    return decorator
+
+
+def json_response(payload, status=200):
+    return status, [(b"content-type", b"application/json")], json.dumps(payload, ensure_ascii=False).encode()
+
+
+@async_route("GET", "/api/diameters/match")
+async def diameter_match(scope, body):
+    # skaner: pojedynczy pomiar -> rozmiar z katalogu, bez wątku i bez Flask
+    from diameters import match_payload
+
+    values = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("d")
+    try:
+        value = float(values[0])
+        if not math.isfinite(value):
+            raise ValueError(values[0])
+    except (TypeError, ValueError):
+        return json_response({"error": "Parametr d musi być liczbą"}, 400)
+    return json_response({"match": match_payload(value)})
+
+
+@async_route("POST", "/update_status")
+async def update_status_bulk(scope, body):
+    from app import StatusRequestError, apply_status_changes, parse_status_changes
+    from database import InvalidStatusError
+
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        payload = None
+    try:
+        pairs = parse_status_changes(payload)
+        cards = await run_db(apply_status_changes, pairs)
+    except StatusRequestError as e:
+        return json_response({"error": str(e)}, e.status_code)
+    except InvalidStatusError as e:
+        return json_response({"error": str(e)}, 400)
+    return json_response({"updated": len(pairs), "cards": cards})
+
+
+# --- Strumień zmian /history/changes (SSE) ---
+CHANGES_POLL_INTERVAL = float(os.environ.get("CHANGES_POLL_INTERVAL", "1"))
+# po tym czasie połączenie jest zamykane - EventSource wznawia je od Last-Event-ID
+CHANGES_STREAM_SECONDS = 300
+# komentarz SSE co tyle sekund ciszy, żeby proxy nie zamknęło połączenia
+CHANGES_HEARTBEAT = 15
+
+
+def _read_change_position():
+    from database import change_position
+    from db_pool import connection
+
+    with connection() as conn:
+        return change_position(conn)
+
+
+class ChangeFeed:
+    # jedno zapytanie o pozycję dziennika na CHANGES_POLL_INTERVAL na proces,
+    # niezależnie od liczby otwartych stron; odpytywanie tylko, gdy ktoś słucha
+    # (zmiany z innych workerów widać tylko przez bazę)
+    def __init__(self):
+        self.position = None
+        self._listeners = 0
+        self._changed = None
+        self._task = None
+
+    async def _poll(self):
+        while self._listeners:
+            try:
+                position = await run_db(_read_change_position)
+            except Exception:
+                logger.exception("Odczyt dziennika zmian nie powiódł się")
+            else:
+                if position != self.position:
+                    self.position = position
+                    async with self._changed:
+                        self._changed.notify_all()
+            await asyncio.sleep(CHANGES_POLL_INTERVAL)
+        # bez słuchaczy pozycja się starzeje - następny odczyt od nowa
+        self.position = None
+        self._task = None
+
+    async def wait(self, since, timeout):
+        # -> True, gdy w dzienniku pojawiło się coś po pozycji since
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        self._listeners += 1
+        try:
+            if self._task is None:
+                self._task = asyncio.ensure_future(self._poll())
+            async with self._changed:
+                await asyncio.wait_for(
+                    self._changed.wait_for(lambda: self.position is not None and self.position > since), timeout
+                )
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._listeners -= 1
+
+
+_change_feed = ChangeFeed()
+
+
+def _event(data, event=None, event_id=None):
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False))
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+async def _change_events(since):
+    from database import CHANGES_BATCH, changes_since
+
+    deadline = time.monotonic() + CHANGES_STREAM_SECONDS
+    yield b"retry: 3000\n\n"
+    fetch = True  # na starcie od razu: zaległe zmiany albo reset
+    while True:
+        if fetch:
+            batch = await run_db(changes_since, since)
+            if batch["reset"]:
+                yield _event({}, event="reset")
+                return
+            since = batch["position"]
+            if batch["changes"]:
+                yield _event(batch["changes"], event_id=since)
+            if len(batch["changes"]) >= CHANGES_BATCH:
+                continue  # pełna porcja: kolejna bez czekania
+        if time.monotonic() >= deadline:
+            return
+        fetch = await _change_feed.wait(since, CHANGES_HEARTBEAT)
+        if not fetch:
+            yield b": ping\n\n"
+
+
+@async_route("GET", "/history/changes")
+async def history_changes(scope, body):
+    # EventSource (Accept: text/event-stream) dostaje strumień, reszta - JSON jak
+    # trasa Flask; po zerwaniu EventSource wznawia od nagłówka Last-Event-ID
+    from database import changes_since
+
+    headers = dict(scope["headers"])
+    since = headers.get(b"last-event-id", b"").decode("latin-1")
+    if not since:
+        since = (parse_qs(scope.get("query_string", b"").decode("latin-1")).get("since") or [""])[0]
+    try:
+        since = int(since)
+    except ValueError:
+        return json_response({"error": "Parametr since musi być liczbą"}, 400)
+    if b"text/event-stream" in headers.get(b"accept", b""):
+        return 200, [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-store")], _change_events(since)
+    status, headers, content = json_response(await run_db(changes_since, since))
+    return status, headers + [(b"cache-control", b"no-store")], content
+
+
+async def _disconnected(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def _send_stream(chunks, receive, send):
+    # strumień do końca albo do rozłączenia klienta (bez zapisu w próżnię)
+    disconnect = asyncio.ensure_future(_disconnected(receive))
+    iterator = chunks.__aiter__()
+    try:
+        while True:
+            next_chunk = asyncio.ensure_future(iterator.__anext__())
+            await asyncio.wait({next_chunk, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_chunk.done():
+                next_chunk.cancel()
+                await asyncio.wait({next_chunk})
+                return
+            try:
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                await send({"type": "http.response.body", "body": b""})
+                return
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    finally:
+        disconnect.cancel()
+        await iterator.aclose()
+
+
+async def _serve_native(handler, scope, receive, send):
+    start = time.perf_counter()
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    # jak before_request w app.py: kompaktowanie w tle startuje w workerze
+    start_compaction()
+    status, headers, content = await handler(scope, body)
+    if not isinstance(content, bytes):
+        # strumień (async generator); czas połączenia nie trafia do histogramu opóźnień
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await _send_stream(content, receive, send)
+        return
+    await send({"type": "http.response.start", "status": status,
+                "headers": headers + [(b"content-length", str(len(content)).encode())]})
+    await send({"type": "http.response.body", "body": content})
+    REQUEST_LATENCY.observe(time.perf_counter() - start, scope["path"], scope["method"], str(status))
+    # jak after_request w app.py (zapis najwyżej co METRICS_FLUSH_INTERVAL)
+    await asyncio.get_running_loop().run_in_executor(None, flush_metrics)
+
+
+# --- Aplikacja ASGI ---
+_flask_asgi = None
+_init_lock = asyncio.Lock()
+
+
+async def _ensure_app():
+    # migracje bazy i import Flask raz na proces, przed pierwszym żądaniem -
+    # także natywnym (trasy async_route nie przechodzą przez before_request)
+    global _flask_asgi
+    async with _init_lock:
+        if _flask_asgi is None:
+            _flask_asgi = await asyncio.get_running_loop().run_in_executor(None, _flask_app)
+    return _flask_asgi
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # migracje bazy i import Flask raz, przy starcie workera
+            await _ensure_app()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            from render_pool import render_executor
+            render_executor.shutdown()
+            close_all()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    # serwer bez obsługi lifespan: inicjalizacja przy pierwszym żądaniu dowolnej trasy
+    flask_asgi = _flask_asgi or await _ensure_app()
+    handler = _routes.get((scope["method"], scope["path"]))
+    if handler is not None:
+        await _serve_native(handler, scope, receive, send)
+        return
+    await flask_asgi(scope, receive, send)
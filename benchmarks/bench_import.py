@@ -0,0 +1,79 @@
+"""Benchmark zimnego startu workera: czas importu app.py i create_app().
+
+Uruchomienie (z katalogu repozytorium):
+    python benchmarks/bench_import.py [--runs 15] [--repo ŚCIEŻKA]
+
+Każdy pomiar to osobny proces Pythona. --repo pozwala porównać z inną wersją
+kodu, np. z worktree starszego commita:
+    git worktree add /tmp/satz-base <commit>
+    python benchmarks/bench_import.py --repo /tmp/satz-base
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ("pandas", "numpy", "openpyxl", "fpdf", "barcode", "PIL", "pyarrow")
+
+# kod mierzony w procesie potomnym; starsze wersje nie mają create_app()
+CHILD = """
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+factory = getattr(app, "create_app", None)
+if factory is not None:
+    factory()
+t2 = time.perf_counter()
+print(json.dumps({
+    "import": t1 - t0,
+    "init": t2 - t1,
+    "heavy": [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def _measure(repo, db_path):
+    env = dict(os.environ, SATZKARTEN_DB=db_path)
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD, repo],
+        cwd=repo, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=15)
+    parser.add_argument("--repo", default=REPO)
+    parser.add_argument("--db", default=os.path.join(REPO, "satzkarten.db"),
+                        help="baza kopiowana do katalogu tymczasowego przed pomiarem")
+    args = parser.parse_args()
+
+    repo = os.path.abspath(args.repo)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        if os.path.exists(args.db):
+            shutil.copy(args.db, db_path)
+        # pierwszy przebieg rozgrzewa cache plików .pyc i wykonuje migracje
+        _measure(repo, db_path)
+        results = [_measure(repo, db_path) for _ in range(args.runs)]
+
+    imports = [r["import"] * 1000 for r in results]
+    inits = [r["init"] * 1000 for r in results]
+    print(f"repo:           {repo}")
+    print(f"import app:     mediana {statistics.median(imports):.1f} ms, min {min(imports):.1f} ms")
+    print(f"create_app():   mediana {statistics.median(inits):.1f} ms")
+    print(f"razem:          mediana {statistics.median(i + j for i, j in zip(imports, inits)):.1f} ms")
+    print(f"ciężkie moduły: {', '.join(results[-1]['heavy']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Mikro-benchmark renderowania Satz-Karte.
+
+Uruchomienie (z katalogu repozytorium):
+    python benchmarks/bench_pdf.py [--cards 200] [--stones 10]
+
+Mierzy czas generate_pdf_bytes() na kartę: pierwszy wydruk (nowy numer,
+zimny kod kreskowy) i ponowny wydruk tej samej karty.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data import DIAMETERS_SET_3  # noqa: E402
+from pdf_utils import generate_pdf_bytes  # noqa: E402
+
+
+def _render(satznummer, stones):
+    codes = [f"ND-{satznummer}-{i}" for i in range(stones)]
+    diameters = [DIAMETERS_SET_3[i % len(DIAMETERS_SET_3)] for i in range(stones)]
+    return generate_pdf_bytes(
+        codes=codes,
+        satznummer=satznummer,
+        diameters=diameters,
+        machine_number="M12",
+        stone_count=stones,
+        stone_type="ND",
+        set_name="Grundsatz",
+        operator="Operator",
+    )
+
+
+def _measure(label, numbers, stones):
+    times = []
+    for satznummer in numbers:
+        start = time.perf_counter()
+        _render(satznummer, stones)
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    print(
+        f"{label:<10} n={len(times):<5} "
+        f"mean={statistics.mean(times):6.2f} ms  "
+        f"p50={times[len(times) // 2]:6.2f} ms  "
+        f"p99={times[min(len(times) - 1, int(len(times) * 0.99))]:6.2f} ms  "
+        f"-> {1000 / statistics.mean(times):6.1f} kart/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cards", type=int, default=200)
+    parser.add_argument("--stones", type=int, default=10)
+    args = parser.parse_args()
+
+    # rozgrzewka: importy, fonty, pierwsze wczytanie logo
+    _render("00000000", args.stones)
+
+    numbers = [f"{n:08d}" for n in range(1, args.cards + 1)]
+    _measure("nowe", numbers, args.stones)
+    _measure("ponowne", numbers, args.stones)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""Zestaw benchmarków gorących ścieżek: PDF, naklejki, Excel, /history, POST /.
+
+Uruchomienie (z katalogu repozytorium):
+    python benchmarks/bench_suite.py [--cards 5000] [--stones 10] [--iterations 30]
+                                     [--concurrency 4] [--posts 20]
+                                     [--save wyniki.json] [--compare baza.json]
+
+Przed pomiarem w katalogu tymczasowym tworzona jest syntetyczna baza
+(benchmarks/seed.py) albo kopia istniejącej (--db); oryginał nie jest zmieniany.
+Dla każdego przypadku: p50/p99, przepustowość i szczytowa pamięć (tracemalloc,
+osobny przebieg). --compare z poprzednim --save zwraca kod 1, gdy p50 któregoś
+przypadku wzrosło ponad --tolerance (domyślnie 1.25x).
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+# wartości filtrów /history dopasowane do danych z seed.py
+HISTORY_FILTER_VALUES = {
+    "satznummer": "000012",
+    "machine": "M07",
+    "zestaw": "2",
+    "date_from": "2024-06-01",
+    "date_to": "2024-12-31",
+    "code": "ND-00001",
+    "diameter": "0.7049",
+}
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def _result(name, times_ms, wall_s, count, peak_bytes):
+    times_ms = sorted(times_ms)
+    return {
+        "name": name,
+        "n": count,
+        "p50_ms": round(_percentile(times_ms, 0.5), 3),
+        "p99_ms": round(_percentile(times_ms, 0.99), 3),
+        "mean_ms": round(statistics.mean(times_ms), 3),
+        "per_s": round(count / wall_s, 1) if wall_s else 0.0,
+        "peak_kib": round(peak_bytes / 1024),
+    }
+
+
+def _peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(name, fn, iterations):
+    fn()  # rozgrzewka: importy, fonty, cache zapytań
+    times = []
+    wall = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    wall = time.perf_counter() - wall
+    return _result(name, times, wall, iterations, _peak_memory(fn))
+
+
+def measure_concurrent(name, fn, threads, per_thread):
+    # fn(thread_no, i) wywoływane równolegle z `threads` wątków
+    fn(-1, 0)
+    times = []
+    lock = threading.Lock()
+
+    def worker(thread_no):
+        local = []
+        for i in range(per_thread):
+            start = time.perf_counter()
+            fn(thread_no, i)
+            local.append((time.perf_counter() - start) * 1000)
+        with lock:
+            times.extend(local)
+
+    def run_all(offset):
+        pool = [threading.Thread(target=worker, args=(offset + t,)) for t in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+
+    wall = time.perf_counter()
+    run_all(0)
+    wall = time.perf_counter() - wall
+    measured = list(times)
+    peak = _peak_memory(lambda: run_all(threads))
+    return _result(name, measured, wall, len(measured), peak)
+
+
+# --- Przypadki ---
+def bench_render(iterations, stones):
+    from data import DIAMETERS_SET_3
+    from database import export_to_excel_transposed
+    from pdf_utils import generate_label_pdf, generate_pdf_bytes
+
+    counter = itertools.count(1)
+
+    def pdf():
+        # za każdym razem nowy numer: zimny kod kreskowy, jak przy nowej karcie
+        satznummer = f"9{next(counter):07d}"
+        generate_pdf_bytes(
+            codes=[f"ND-{satznummer}-{i}" for i in range(stones)],
+            satznummer=satznummer,
+            diameters=[DIAMETERS_SET_3[i % len(DIAMETERS_SET_3)] for i in range(stones)],
+            machine_number="M01", stone_type="ND", set_name="Grundsatz", operator="Operator",
+        )
+
+    def label():
+        generate_label_pdf(set_name="Grundsatz", stone_count=stones, uuid_code=f"8{next(counter):07d}")
+
+    def excel_card():
+        export_to_excel_transposed(satznummer="00000001")
+
+    return [
+        measure("generate_pdf_bytes", pdf, iterations),
+        measure("generate_label_pdf", label, iterations),
+        measure("export_to_excel_transposed", excel_card, iterations),
+    ]
+
+
+def bench_history(client, iterations, all_combinations):
+    names = list(HISTORY_FILTER_VALUES)
+    max_size = len(names) if all_combinations else 2
+    results = []
+    for size in range(max_size + 1):
+        for combo in itertools.combinations(names, size):
+            query = {name: HISTORY_FILTER_VALUES[name] for name in combo}
+
+            def request(query=query):
+                response = client.get("/history", query_string=query)
+                assert response.status_code == 200, response.status_code
+
+            label = "+".join(combo) or "bez filtrów"
+            results.append(measure(f"history[{label}]", request, iterations))
+    return results
+
+
+def bench_post_index(app, threads, per_thread, stones):
+    from data import DIAMETERS_SET_2
+
+    run_id = int(time.time()) % 100000
+
+    def post(thread_no, i):
+        # test client nie jest współdzielony między wątkami
+        client = app.test_client()
+        form = {
+            "satznummer": f"B{run_id:05d}-{thread_no + 1:03d}-{i:05d}",
+            "machine_number": "M01",
+            "diameter_set": "2",
+            "stone_type": "ND",
+            "operator": "Benchmark",
+        }
+        for n in range(stones):
+            form[f"code{n}"] = f"ND-{thread_no}-{i}-{n}"
+            form[f"diameter{n}"] = str(DIAMETERS_SET_2[n % len(DIAMETERS_SET_2)])
+        response = client.post("/", data=form)
+        assert response.status_code == 200, response.status_code
+
+    return [measure_concurrent(f"POST / x{threads} wątki", post, threads, per_thread)]
+
+
+def _print(results):
+    width = max(len(r["name"]) for r in results)
+    print(f"{'przypadek':<{width}}  {'n':>5}  {'p50 ms':>9}  {'p99 ms':>9}  {'/s':>8}  {'pamięć KiB':>10}")
+    for r in results:
+        print(
+            f"{r['name']:<{width}}  {r['n']:>5}  {r['p50_ms']:>9.2f}  {r['p99_ms']:>9.2f}  "
+            f"{r['per_s']:>8.1f}  {r['peak_kib']:>10}"
+        )
+
+
+def _compare(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        base = baseline.get(r["name"])
+        if base and base["p50_ms"] and r["p50_ms"] > base["p50_ms"] * tolerance:
+            regressions.append(f"{r['name']}: p50 {base['p50_ms']:.2f} -> {r['p50_ms']:.2f} ms")
+    if regressions:
+        print(f"\nREGRESJE (p50 > {tolerance}x względem {baseline_path}):")
+        for line in regressions:
+            print("  " + line)
+    else:
+        print(f"\nBrak regresji względem {baseline_path}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", help="istniejąca baza zamiast syntetycznej (kopiowana do katalogu tymczasowego)")
+    parser.add_argument("--cards", type=int, default=5000)
+    parser.add_argument("--stones", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--posts", type=int, default=20, help="POST / na wątek")
+    parser.add_argument("--render-workers", default="0",
+                        help="RENDER_WORKERS dla POST / (0 = renderowanie w wątku żądania)")
+    parser.add_argument("--all-combinations", action="store_true",
+                        help="wszystkie kombinacje filtrów /history (domyślnie do dwóch naraz)")
+    parser.add_argument("--only", choices=("render", "history", "post"), action="append")
+    parser.add_argument("--save")
+    parser.add_argument("--compare")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="satz-bench-")
+    try:
+        db_path = os.path.join(tmp, "bench.db")
+        # konfiguracja czytana przy imporcie modułów aplikacji
+        os.environ.update({
+            "SATZKARTEN_DB": db_path,
+            "RENDER_WORKERS": args.render_workers,
+            "PDF_CACHE_DIR": os.path.join(tmp, "pdf"),
+            "METRICS_DIR": "",
+            "COMPACT_INTERVAL": "0",
+            # log wolnych zapytań zagłuszyłby wyniki; czasy i tak są w tabeli
+            "SLOW_SQL_MS": "1e9",
+        })
+        if args.db:
+            shutil.copy(args.db, db_path)
+        else:
+            from seed import seed
+            start = time.perf_counter()
+            seed(args.cards, args.stones)
+            print(f"baza: {args.cards} kart x {args.stones} kamieni ({time.perf_counter() - start:.1f} s)\n")
+
+        from app import create_app
+        app = create_app()
+        only = set(args.only or ("render", "history", "post"))
+
+        results = []
+        if "render" in only:
+            results += bench_render(args.iterations, args.stones)
+        if "history" in only:
+            results += bench_history(app.test_client(), args.iterations, args.all_combinations)
+        if "post" in only:
+            results += bench_post_index(app, args.concurrency, args.posts, args.stones)
+        _print(results)
+
+        if args.save:
+            with open(args.save, "w") as f:
+                json.dump({"args": vars(args), "results": results}, f, indent=2, ensure_ascii=False)
+        if args.compare and _compare(results, args.compare, args.tolerance):
+            return 1
+        return 0
+    finally:
+        from db_pool import close_all
+        close_all()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""Syntetyczna baza satzkarten.db do benchmarków.
+
+Uruchomienie (z katalogu repozytorium):
+    python benchmarks/seed.py --db /tmp/bench.db [--cards 5000] [--stones 10] [--seed 1]
+
+Numery kart to kolejne liczby 8-cyfrowe, maszyny M01..M20, daty rozłożone
+na dwa lata, średnice z katalogu zestawu, statusy w proporcji 80/15/5.
+Ten sam --seed daje zawsze tę samą bazę.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+MACHINES = [f"M{n:02d}" for n in range(1, 21)]
+STATUS_WEIGHTS = (("Nowy", 80), ("Do naprawy", 15), ("Do utylizacji", 5))
+START_DATE = datetime(2024, 1, 1)
+BATCH_CARDS = 1000
+
+
+def _cards(count, stones, rng):
+    from data import DIAMETERS_BY_SET
+
+    statuses = [s for s, _ in STATUS_WEIGHTS]
+    weights = [w for _, w in STATUS_WEIGHTS]
+    for n in range(1, count + 1):
+        satznummer = f"{n:08d}"
+        zestaw = rng.choice(sorted(DIAMETERS_BY_SET))
+        catalog = DIAMETERS_BY_SET[zestaw]
+        data = START_DATE + timedelta(minutes=rng.randrange(2 * 365 * 24 * 60))
+        details = [
+            (satznummer, f"ND-{satznummer}-{i}", catalog[i % len(catalog)], rng.choices(statuses, weights)[0])
+            for i in range(stones)
+        ]
+        yield (satznummer, rng.choice(MACHINES), zestaw, "Operator", data.strftime("%Y-%m-%d %H:%M:%S")), details
+
+
+def seed(cards, stones, random_seed=1):
+    # baza wskazana przez SATZKARTEN_DB (ustawione przed importem db_pool)
+    from database import init_db
+    from db_pool import transaction
+
+    init_db()
+    rng = random.Random(random_seed)
+    history, details = [], []
+    for card, stones_rows in _cards(cards, stones, rng):
+        history.append(card)
+        details.extend(stones_rows)
+        if len(history) >= BATCH_CARDS:
+            _write(transaction, history, details)
+            history, details = [], []
+    if history:
+        _write(transaction, history, details)
+
+
+def _write(transaction, history, details):
+    with transaction() as conn:
+        conn.executemany(
+            "INSERT INTO history (satznummer, machine, zestaw, operator, data) VALUES (?, ?, ?, ?, ?)", history
+        )
+        conn.executemany(
+            "INSERT INTO details (satznummer, code, diameter, status) VALUES (?, ?, ?, ?)", details
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", required=True)
+    parser.add_argument("--cards", type=int, default=5000)
+    parser.add_argument("--stones", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        parser.error(f"{args.db} już istnieje - podaj nową ścieżkę")
+    os.environ["SATZKARTEN_DB"] = args.db
+    start = time.perf_counter()
+    seed(args.cards, args.stones, args.seed)
+    print(f"{args.db}: {args.cards} kart x {args.stones} kamieni w {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
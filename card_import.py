@@ -0,0 +1,304 @@
+"""Import kart z pliku (CSV/JSON) i z API /api/cards - cała paczka naraz.
+
+Wiersz = kamień (jak w eksporcie CSV): satznummer, machine, zestaw, operator,
+data, code, diameter, status; pozostałe kolumny (np. stone_id z eksportu) są
+pomijane. Wiersze z tym samym satznummer tworzą jedną kartę; karta bez numeru
+dostaje numer z sekwencji (numbering.py) - wiersze takiej karty łączy kolumna
+card. Wiersz bez kodu i średnicy to karta bez kamieni.
+
+Walidacja i normalizacja idą jednym przebiegiem pandas po wszystkich
+wierszach: zestaw (klucz albo nazwa z data.ZESTAWY), średnica dopasowana do
+katalogu zestawu karty (data.DIAMETERS_BY_SET, tolerancja DIAMETER_TOLERANCE),
+status, data, spójność pól karty i numery już zajęte w bazie. Karta z
+jakimkolwiek błędem jest pomijana w całości, a błąd trafia do raportu z numerem
+wiersza; poprawne karty zapisywane są paczkami po IMPORT_CHUNK_CARDS w jednej
+transakcji na paczkę.
+
+Z linii poleceń (np. plik ze stanowiska pomiarowego):
+    python card_import.py pomiary.csv [--dry-run]
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import zoneinfo
+from datetime import datetime
+
+from data import DIAMETERS_BY_SET, STATUSES, ZESTAWY
+from database import DuplicateCardError, create_cards, existing_cards
+from diameters import DIAMETER_TOLERANCE
+from numbering import next_satznummer
+
+IMPORT_CHUNK_CARDS = int(os.environ.get("IMPORT_CHUNK_CARDS", "200"))
+IMPORT_MAX_ROWS = int(os.environ.get("IMPORT_MAX_ROWS", "50000"))
+# dłuższa lista błędów jest ucinana (liczba wszystkich zostaje w raporcie)
+IMPORT_MAX_ERRORS = int(os.environ.get("IMPORT_MAX_ERRORS", "1000"))
+
+COLUMNS = ("satznummer", "card", "machine", "zestaw", "operator", "data", "code", "diameter", "status")
+# nazwy pól formularza z index.html
+COLUMN_ALIASES = {"machine_number": "machine", "diameter_set": "zestaw"}
+
+# "3", "grundsatz" -> "3"
+_ZESTAW_KEYS = {**{key: key for key in ZESTAWY}, **{name.lower(): key for key, name in ZESTAWY.items()}}
+
+
+class CardImportError(Exception):
+    # plik/żądanie nie do odczytania jako całość (błędy wierszy idą do raportu)
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# --- Wczytanie wierszy ---
+def _frame(records):
+    import pandas as pd
+
+    frame = pd.DataFrame(records, dtype=object)
+    frame.columns = [COLUMN_ALIASES.get(name, name) for name in frame.columns.str.strip().str.lower()]
+    if len(frame) > IMPORT_MAX_ROWS:
+        raise CardImportError(f"Za dużo wierszy w jednym imporcie (maks. {IMPORT_MAX_ROWS})", 413)
+    return frame
+
+
+def rows_from_cards(cards):
+    # JSON: karta {"satznummer", "machine", "zestaw", "operator", "data",
+    # "stones": [{"code", "diameter", "status"}]} -> wiersze; row/stone z indeksów listy
+    if isinstance(cards, dict):
+        cards = cards.get("cards", [cards])
+    if not isinstance(cards, list):
+        raise CardImportError("Oczekiwano karty albo listy kart")
+    records = []
+    for row, card in enumerate(cards, start=1):
+        if not isinstance(card, dict) or not isinstance(card.get("stones", []), list):
+            raise CardImportError(f"Karta {row}: oczekiwano obiektu z listą stones")
+        fields = {name: card.get(name) for name in COLUMNS if name not in ("code", "diameter", "status")}
+        fields.update(card=str(row), row=row)
+        stones = card.get("stones") or [{}]
+        for stone, values in enumerate(stones, start=1):
+            if not isinstance(values, dict):
+                raise CardImportError(f"Karta {row}, kamień {stone}: oczekiwano obiektu")
+            records.append(dict(fields, stone=stone if values else None, code=values.get("code"),
+                                diameter=values.get("diameter"), status=values.get("status")))
+    if not records:
+        raise CardImportError("Brak kart do importu")
+    return _frame(records)
+
+
+def rows_from_csv(text):
+    import pandas as pd
+
+    header = text.split("\n", 1)[0]
+    # Excel z polskimi ustawieniami zapisuje CSV ze średnikiem
+    sep = ";" if header.count(";") > header.count(",") else ","
+    try:
+        frame = pd.read_csv(io.StringIO(text), sep=sep, dtype=str, keep_default_na=False,
+                            skipinitialspace=True, nrows=IMPORT_MAX_ROWS + 1)
+    except (ValueError, pd.errors.ParserError) as e:
+        raise CardImportError(f"Nieprawidłowy plik CSV: {e}")
+    frame = _frame(frame)
+    missing = [name for name in ("zestaw", "code", "diameter") if name not in frame]
+    if "satznummer" not in frame and "card" not in frame:
+        missing.append("satznummer/card")
+    if missing:
+        raise CardImportError("Brak kolumn: " + ", ".join(missing))
+    # numer linii w pliku (nagłówek = 1)
+    frame["row"] = frame.index + 2
+    frame["stone"] = None
+    return frame
+
+
+def read_upload(data, filename="", content_type=""):
+    # bajty pliku -> wiersze; JSON jak w /api/cards, wszystko inne jako CSV
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        # eksport z Excela bez UTF-8
+        text = data.decode("cp1250")
+    if filename.lower().endswith(".json") or "json" in content_type:
+        try:
+            payload = json.loads(text)
+        except ValueError as e:
+            raise CardImportError(f"Nieprawidłowy plik JSON: {e}")
+        return rows_from_cards(payload)
+    return rows_from_csv(text)
+
+
+# --- Walidacja i normalizacja (jeden przebieg po wszystkich wierszach) ---
+def _text(frame, column):
+    import pandas as pd
+
+    if column not in frame:
+        return pd.Series("", index=frame.index, dtype=object)
+    # najpierw tekst, potem puste pola: fillna("") na kolumnie z liczbami z JSON
+    # (średnice, numery) to rzutowanie typu, na które pandas ostrzega (FutureWarning)
+    values = frame[column]
+    return values.astype(str).where(values.notna(), "").str.strip()
+
+
+def _snap(values, catalog, tolerance):
+    # najbliższy rozmiar z katalogu dla całej tablicy naraz; NaN poza tolerancją
+    import numpy as np
+
+    catalog = np.sort(np.asarray(catalog, dtype=float))
+    right = np.clip(np.searchsorted(catalog, values), 1, len(catalog) - 1)
+    left = right - 1
+    nearest = np.where(values - catalog[left] <= catalog[right] - values, catalog[left], catalog[right])
+    return np.where(np.abs(nearest - values) <= tolerance, nearest, np.nan)
+
+
+def normalize(frame, tolerance=DIAMETER_TOLERANCE):
+    # -> (karty, błędy); karta: słownik z polami historii, "stones" [(kod, średnica, status)]
+    # i "row" (pierwszy wiersz karty); błąd: {"row", "stone", "satznummer", "field", "error"}
+    import numpy as np
+    import pandas as pd
+
+    if frame.empty:
+        return [], []
+    satznummer = _text(frame, "satznummer")
+    card = _text(frame, "card")
+    # klucz karty: numer albo (bez numeru) wartość kolumny card; NaN = nie wiadomo
+    group = satznummer.where(satznummer != "", ("#" + card).where(card != ""))
+    zestaw_text = _text(frame, "zestaw")
+    zestaw = zestaw_text.str.lower().map(_ZESTAW_KEYS)
+    code = _text(frame, "code")
+    diameter_text = _text(frame, "diameter").str.replace(",", ".", regex=False)
+    diameter = pd.to_numeric(diameter_text, errors="coerce")
+    has_stone = (code != "") | (diameter_text != "")
+    status = _text(frame, "status").replace("", STATUSES[0])
+    data_text = _text(frame, "data")
+    parsed = pd.to_datetime(data_text.where(data_text != ""), errors="coerce", format="ISO8601")
+
+    snapped = pd.Series(np.nan, index=frame.index)
+    for key, catalog in DIAMETERS_BY_SET.items():
+        mask = (zestaw == key) & diameter.notna()
+        if mask.any():
+            snapped[mask] = _snap(diameter[mask].to_numpy(dtype=float), catalog, tolerance)
+
+    checks = [
+        (group.isna(), "satznummer", "Brak satznummer (albo kolumny card)"),
+        (zestaw.isna(), "zestaw", "Nieznany zestaw: '" + zestaw_text + "'"),
+        (has_stone & (code == ""), "code", "Brak kodu kamienia"),
+        (has_stone & diameter.isna(), "diameter", "Średnica nie jest liczbą: '" + diameter_text + "'"),
+        (diameter.notna() & zestaw.notna() & snapped.isna(), "diameter",
+         "Średnica " + diameter_text + " spoza katalogu zestawu " + zestaw_text),
+        (~status.isin(STATUSES), "status", "Nieznany status: '" + status + "'"),
+        ((data_text != "") & parsed.isna(), "data", "Nieprawidłowa data: '" + data_text + "'"),
+    ]
+    # pola karty muszą być takie same we wszystkich jej wierszach
+    card_values = {"machine": _text(frame, "machine"), "zestaw": zestaw,
+                   "operator": _text(frame, "operator"), "data": data_text}
+    for column, values in card_values.items():
+        checks.append((values.groupby(group).transform("nunique") > 1, column,
+                       f"Różne wartości {column} w wierszach jednej karty"))
+    if "card" in frame and "satznummer" in frame:
+        checks.append(((satznummer != "") & (card.groupby(satznummer).transform("nunique") > 1),
+                       "satznummer", "Satznummer powtórzony w kilku kartach"))
+    taken = existing_cards(satznummer[satznummer != ""].unique().tolist())
+    if taken:
+        checks.append((satznummer.isin(taken), "satznummer", "Karta " + satznummer + " już istnieje"))
+
+    errors = []
+    for mask, field, message in checks:
+        mask = mask.fillna(False).astype(bool)
+        if mask.any():
+            errors.append(pd.DataFrame({
+                "row": frame.loc[mask, "row"],
+                "stone": frame.loc[mask, "stone"],
+                "satznummer": satznummer[mask],
+                "field": field,
+                "error": message[mask] if isinstance(message, pd.Series) else message,
+            }))
+    if errors:
+        errors = pd.concat(errors).sort_values(["row", "field"], kind="stable")
+        rejected = group.isna() | group.isin(group[errors.index].dropna().unique())
+        errors = errors.astype(object).where(errors.notna(), None).to_dict("records")
+    else:
+        rejected = pd.Series(False, index=frame.index)
+
+    # karta bez daty: czas lokalny zakładu, jak w formularzu
+    now = datetime.now(zoneinfo.ZoneInfo("Europe/Warsaw")).strftime("%Y-%m-%d %H:%M:%S")
+    rows = pd.DataFrame({
+        "group": group, "row": frame["row"], "satznummer": satznummer,
+        "machine": card_values["machine"], "zestaw": zestaw, "operator": card_values["operator"],
+        "data": parsed.dt.strftime("%Y-%m-%d %H:%M:%S").fillna(now),
+        "has_stone": has_stone, "code": code, "diameter": snapped, "status": status,
+    })[~rejected]
+    cards = []
+    for _, card_rows in rows.groupby("group", sort=False):
+        first = card_rows.iloc[0]
+        stone_rows = card_rows[card_rows["has_stone"]]
+        cards.append({
+            "row": int(first["row"]),
+            "satznummer": first["satznummer"] or None,
+            "machine": first["machine"],
+            "zestaw": first["zestaw"],
+            "operator": first["operator"],
+            "data": first["data"],
+            "stones": list(zip(stone_rows["code"], stone_rows["diameter"].astype(float), stone_rows["status"])),
+        })
+    return cards, errors
+
+
+# --- Zapis paczkami ---
+def insert_cards(cards, chunk_size=IMPORT_CHUNK_CARDS):
+    # -> (zapisane satznummery, błędy); karty bez numeru dostają go z sekwencji
+    created, errors = [], []
+    for start in range(0, len(cards), chunk_size):
+        chunk = cards[start:start + chunk_size]
+        for card in chunk:
+            card["satznummer"] = card["satznummer"] or next_satznummer()
+        while chunk:
+            try:
+                created += create_cards([
+                    (card["satznummer"], card["machine"], card["zestaw"], card["operator"], card["data"], card["stones"])
+                    for card in chunk
+                ])
+                break
+            except DuplicateCardError as e:
+                # numer zajęty po walidacji (równoległy zapis): bez tej karty, reszta paczki od nowa
+                duplicate = next(card for card in chunk if card["satznummer"] == e.satznummer)
+                errors.append({"row": duplicate["row"], "stone": None, "satznummer": e.satznummer,
+                               "field": "satznummer", "error": str(e)})
+                chunk = [card for card in chunk if card is not duplicate]
+    return created, errors
+
+
+def import_frame(frame, dry_run=False):
+    # raport: rows, cards (poprawne karty), created, error_count, errors (do IMPORT_MAX_ERRORS)
+    cards, errors = normalize(frame)
+    created = []
+    if not dry_run:
+        created, insert_errors = insert_cards(cards)
+        errors += insert_errors
+    return {
+        "rows": len(frame),
+        "cards": len(cards),
+        "created": created,
+        "dry_run": dry_run,
+        "error_count": len(errors),
+        "errors": errors[:IMPORT_MAX_ERRORS],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="plik CSV albo JSON")
+    parser.add_argument("--dry-run", action="store_true", help="tylko walidacja, bez zapisu")
+    args = parser.parse_args()
+
+    from database import init_db
+
+    init_db()
+    with open(args.path, "rb") as f:
+        try:
+            report = import_frame(read_upload(f.read(), args.path), dry_run=args.dry_run)
+        except CardImportError as e:
+            print(e, file=sys.stderr)
+            return 1
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 1 if report["error_count"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -18,4 +18,10 @@ DIAMETERS_BY_SET = {
     "1": DIAMETERS_SET_1,
     "2": DIAMETERS_SET_2,
     "3": DIAMETERS_SET_3
-}
\ No newline at end of file
+}
+
+# --- Nazwy zestawów ---
+ZESTAWY = {"1": "Untersatz", "2": "Mittelsatz", "3": "Grundsatz"}
+
+# --- Statusy kamieni ---
+STATUSES = ("Nowy", "Do naprawy", "Do utylizacji")
@@ -1,16 +1,21 @@
+import json
 import sqlite3
-import pandas as pd
 from io import BytesIO
 
-DB_NAME = "satzkarten.db"
+from data import STATUSES
+from archive import attached, partition_years
+from db_pool import DB_NAME, connection, transaction
+from diameters import diameter_bounds
+from metrics import sql_span, timed
+from numbering import FIRST_NUMBER, MAX_DIGITS, SEQUENCE_NAME, advance_past, compact_number, sequence_number
 
-# --- Inicjalizacja bazy ---
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+# --- Migracje schematu ---
+# Wersja schematu trzymana jest w PRAGMA user_version. Każdy krok migracji
+# wykonuje się raz, w kolejności, w osobnej transakcji razem z podbiciem wersji.
 
+def _migration_1_base_tables(conn):
     # tabela historii
-    cursor.execute("""
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS history (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             satznummer TEXT,
@@ -21,7 +26,7 @@ def init_db():
     """)
 
     # tabela szczegółów kamieni
-    cursor.execute("""
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS details (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             satznummer TEXT,
@@ -32,144 +37,1014 @@ def init_db():
         )
     """)
 
-    # włączenie kluczy obcych (ważne w SQLite!)
-    cursor.execute("PRAGMA foreign_keys = ON")
 
-    conn.commit()
-    conn.close()
+def _migration_2_lookup_indexes(conn):
+    # duplikaty satznummer (stare losowe numery) przenosimy do osobnej tabeli,
+    # żeby móc założyć unikalny indeks bez utraty danych; kamienie zostają
+    # przy pierwszej (najstarszej) karcie o tym numerze
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS history_duplicates AS
+        SELECT * FROM history WHERE 0
+    """)
+    conn.execute("""
+        INSERT INTO history_duplicates
+        SELECT * FROM history h
+        WHERE h.id > (SELECT MIN(id) FROM history WHERE satznummer = h.satznummer)
+    """)
+    conn.execute("DELETE FROM history WHERE id IN (SELECT id FROM history_duplicates)")
+
+    # data jako kanoniczny ISO-8601 'YYYY-MM-DD HH:MM:SS': porównanie tekstowe
+    # = porównanie czasowe, więc filtry zakresowe mogą korzystać z indeksu
+    conn.execute("""
+        UPDATE history
+        SET data = strftime('%Y-%m-%d %H:%M:%S', data)
+        WHERE strftime('%Y-%m-%d %H:%M:%S', data) IS NOT NULL
+          AND data != strftime('%Y-%m-%d %H:%M:%S', data)
+    """)
+
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_history_satznummer ON history(satznummer)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_history_machine ON history(machine)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_history_zestaw_data ON history(zestaw, data)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_history_data ON history(data)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_details_satznummer ON details(satznummer)")
+
+
+# triggery details_fts (odtwarzane także po przebudowie details w migracji 7)
+_DETAILS_FTS_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS details_fts_ai AFTER INSERT ON details BEGIN
+           INSERT INTO details_fts(rowid, code) VALUES (new.id, new.code);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS details_fts_ad AFTER DELETE ON details BEGIN
+           INSERT INTO details_fts(details_fts, rowid, code) VALUES ('delete', old.id, old.code);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS details_fts_au AFTER UPDATE OF code ON details BEGIN
+           INSERT INTO details_fts(details_fts, rowid, code) VALUES ('delete', old.id, old.code);
+           INSERT INTO details_fts(rowid, code) VALUES (new.id, new.code);
+       END""",
+)
+
+
+def _migration_3_search_index(conn):
+    # indeksy trigramowe FTS5 (external content) dla wyszukiwania fragmentów
+    # numeru karty, maszyny i kodu kamienia; triggery trzymają je w zgodzie z tabelami
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+            satznummer, machine,
+            content='history', content_rowid='id', tokenize='trigram'
+        )
+    """)
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS details_fts USING fts5(
+            code,
+            content='details', content_rowid='id', tokenize='trigram'
+        )
+    """)
+    for statement in (
+        """CREATE TRIGGER IF NOT EXISTS history_fts_ai AFTER INSERT ON history BEGIN
+               INSERT INTO history_fts(rowid, satznummer, machine)
+               VALUES (new.id, new.satznummer, new.machine);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS history_fts_ad AFTER DELETE ON history BEGIN
+               INSERT INTO history_fts(history_fts, rowid, satznummer, machine)
+               VALUES ('delete', old.id, old.satznummer, old.machine);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS history_fts_au AFTER UPDATE OF satznummer, machine ON history BEGIN
+               INSERT INTO history_fts(history_fts, rowid, satznummer, machine)
+               VALUES ('delete', old.id, old.satznummer, old.machine);
+               INSERT INTO history_fts(rowid, satznummer, machine)
+               VALUES (new.id, new.satznummer, new.machine);
+           END""",
+    ) + _DETAILS_FTS_TRIGGERS:
+        conn.execute(statement)
+
+    # zindeksuj istniejące wiersze
+    conn.execute("INSERT INTO history_fts(history_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO details_fts(details_fts) VALUES ('rebuild')")
+
+
+def _migration_4_card_operator(conn):
+    # operator zapisany przy karcie, żeby ponowny wydruk był identyczny z pierwszym
+    conn.execute("ALTER TABLE history ADD COLUMN operator TEXT DEFAULT ''")
+
+
+# klucz grupy w stone_stats dla kamienia {row} (new/old) na karcie h;
+# NULL zamieniany na '', bo w kluczu głównym NULL-e nie byłyby sobie równe
+_STATS_KEY = """
+    COALESCE(strftime('%Y-%m', h.data), ''), COALESCE(h.machine, ''), COALESCE(h.zestaw, ''),
+    COALESCE({row}.status, ''), COALESCE({row}.diameter, '')
+"""
+
+# zmiana liczników o {delta} dla jednego kamienia
+_STATS_STONE = """
+    INSERT INTO stone_stats (month, machine, zestaw, status, diameter, stones)
+    SELECT """ + _STATS_KEY + """, {delta}
+    FROM history h WHERE h.satznummer = {row}.satznummer{live}
+    ON CONFLICT (month, machine, zestaw, status, diameter)
+    DO UPDATE SET stones = stones + excluded.stones;
+"""
+
+# zmiana liczników o {sign}(liczba kamieni) dla całej karty {row}
+_STATS_CARD = """
+    INSERT INTO stone_stats (month, machine, zestaw, status, diameter, stones)
+    SELECT COALESCE(strftime('%Y-%m', {row}.data), ''), COALESCE({row}.machine, ''),
+           COALESCE({row}.zestaw, ''), COALESCE(d.status, ''), COALESCE(d.diameter, ''),
+           {sign}COUNT(*)
+    FROM details d WHERE d.satznummer = {row}.satznummer{live}
+    GROUP BY 4, 5
+    ON CONFLICT (month, machine, zestaw, status, diameter)
+    DO UPDATE SET stones = stones + excluded.stones;
+"""
+
+
+def _stone_stats_triggers(soft_delete):
+    # soft_delete (od migracji 7): karty i kamienie z deleted_at nie są liczone,
+    # a ustawienie/zdjęcie deleted_at działa jak usunięcie/wstawienie
+    def stone(row, delta):
+        live = f" AND h.deleted_at IS NULL AND {row}.deleted_at IS NULL" if soft_delete else ""
+        return _STATS_STONE.format(row=row, delta=delta, live=live)
+
+    def card(row, sign):
+        live = f" AND d.deleted_at IS NULL AND {row}.deleted_at IS NULL" if soft_delete else ""
+        return _STATS_CARD.format(row=row, sign=sign, live=live)
+
+    deleted_at = ", deleted_at" if soft_delete else ""
+    if soft_delete:
+        # ON DELETE CASCADE usuwa kamienie, zanim wykonają się triggery AFTER
+        # karty (i wtedy kamienie nie widzą już karty) - odejmujemy wcześniej
+        card_delete = "CREATE TRIGGER stone_stats_history_bd BEFORE DELETE ON history BEGIN"
+    else:
+        card_delete = "CREATE TRIGGER IF NOT EXISTS stone_stats_history_ad AFTER DELETE ON history BEGIN"
+    return (
+        "CREATE TRIGGER IF NOT EXISTS stone_stats_details_ai AFTER INSERT ON details BEGIN"
+        + stone("new", "1") + "END",
+        "CREATE TRIGGER IF NOT EXISTS stone_stats_details_ad AFTER DELETE ON details BEGIN"
+        + stone("old", "-1") + "END",
+        "CREATE TRIGGER IF NOT EXISTS stone_stats_details_au"
+        f" AFTER UPDATE OF satznummer, status, diameter{deleted_at} ON details BEGIN"
+        + stone("old", "-1") + stone("new", "1") + "END",
+        # karta zapisana po kamieniach (stary przepływ save_history/save_details)
+        "CREATE TRIGGER IF NOT EXISTS stone_stats_history_ai AFTER INSERT ON history BEGIN"
+        + card("new", "") + "END",
+        card_delete + card("old", "-") + "END",
+        "CREATE TRIGGER IF NOT EXISTS stone_stats_history_au"
+        f" AFTER UPDATE OF satznummer, machine, zestaw, data{deleted_at} ON history BEGIN"
+        + card("old", "-") + card("new", "") + "END",
+    )
+
+
+def _migration_5_stone_stats(conn):
+    # zagregowane liczniki kamieni (miesiąc x maszyna x zestaw x status x średnica),
+    # utrzymywane przez triggery przy każdym zapisie; statystyki czytają tylko
+    # tę tabelę (liczba grup), a nie całe details. Liczone są kamienie, które
+    # mają kartę w history. Wiersze z stones = 0 zostają (pomijane w zapytaniach).
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stone_stats (
+            month TEXT NOT NULL,
+            machine TEXT NOT NULL,
+            zestaw TEXT NOT NULL,
+            status TEXT NOT NULL,
+            diameter REAL NOT NULL,
+            stones INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (month, machine, zestaw, status, diameter)
+        ) WITHOUT ROWID
+    """)
+    for statement in _stone_stats_triggers(soft_delete=False):
+        conn.execute(statement)
+
+    # stan początkowy z istniejących danych
+    rebuild_stone_stats(conn, soft_delete=False)
+
+
+def rebuild_stone_stats(conn, soft_delete=True):
+    # przeliczenie liczników od zera (migracja, naprawa po ręcznych zmianach w bazie)
+    live = " WHERE h.deleted_at IS NULL AND d.deleted_at IS NULL" if soft_delete else ""
+    conn.execute("DELETE FROM stone_stats")
+    conn.execute("""
+        INSERT INTO stone_stats (month, machine, zestaw, status, diameter, stones)
+        SELECT """ + _STATS_KEY.format(row="d") + """, COUNT(*)
+        FROM details d JOIN history h ON h.satznummer = d.satznummer""" + live + """
+        GROUP BY 1, 2, 3, 4, 5
+    """)
+
+
+def _migration_6_diameter_index(conn):
+    # filtr zakresowy po średnicy (diameter BETWEEN) bez skanowania details
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_details_diameter ON details(diameter)")
+
+
+def _migration_7_soft_delete(conn):
+    # miękkie usuwanie: deleted_at zamiast DELETE (wiersze fizycznie usuwa
+    # maintenance.py), kamienie usuwane kaskadowo razem z kartą (ON DELETE
+    # CASCADE, wymaga PRAGMA foreign_keys = ON - ustawiane w db_pool).
+    # SQLite nie zmienia ograniczeń istniejącej tabeli, więc details jest
+    # przebudowywana z zachowaniem id (details_fts zostaje aktualne).
+    conn.execute("ALTER TABLE history ADD COLUMN deleted_at TEXT")
+
+    # triggery history i widoki (także dodane ręcznie) odwołują się do details -
+    # bez nich RENAME się nie uda; triggery na details znikają razem ze starą tabelą
+    for name in ("stone_stats_history_ai", "stone_stats_history_ad", "stone_stats_history_au"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    views = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'view' ORDER BY rowid").fetchall()
+    for name, _ in reversed(views):
+        conn.execute(f'DROP VIEW "{name}"')
+
+    # kamienie bez karty naruszałyby klucz obcy - przenosimy je na bok, jak duplikaty w migracji 2
+    conn.execute("CREATE TABLE IF NOT EXISTS details_orphans AS SELECT * FROM details WHERE 0")
+    conn.execute("""
+        INSERT INTO details_orphans
+        SELECT * FROM details d
+        WHERE d.satznummer IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM history h WHERE h.satznummer = d.satznummer)
+    """)
+
+    sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'details'").fetchone()
+    conn.execute("""
+        CREATE TABLE details_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            satznummer TEXT,
+            code TEXT,
+            diameter REAL,
+            status TEXT DEFAULT 'Nowy',
+            deleted_at TEXT,
+            FOREIGN KEY (satznummer) REFERENCES history(satznummer) ON DELETE CASCADE
+        )
+    """)
+    conn.execute("""
+        INSERT INTO details_new (id, satznummer, code, diameter, status)
+        SELECT id, satznummer, code, diameter, status FROM details
+        WHERE id NOT IN (SELECT id FROM details_orphans)
+    """)
+    conn.execute("DROP TABLE details")
+    conn.execute("ALTER TABLE details_new RENAME TO details")
+    if conn.execute("PRAGMA foreign_key_check(details)").fetchone() is not None:
+        raise sqlite3.IntegrityError("details: kamienie bez karty po przebudowie tabeli")
+    if sequence:
+        # id usuniętych kamieni nie wracają do obiegu
+        conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'details'", sequence)
+    # wpisy FTS przeniesionych sierot (external content: 'delete' z oryginalną treścią)
+    conn.execute("""
+        INSERT INTO details_fts(details_fts, rowid, code)
+        SELECT 'delete', id, code FROM details_orphans
+    """)
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_details_satznummer ON details(satznummer)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_details_diameter ON details(diameter)")
+    # częściowe indeksy: tylko usunięte wiersze (dla maintenance.py), puste na co dzień
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_history_deleted ON history(deleted_at) WHERE deleted_at IS NOT NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_details_deleted ON details(deleted_at) WHERE deleted_at IS NOT NULL")
+    for statement in _DETAILS_FTS_TRIGGERS + _stone_stats_triggers(soft_delete=True):
+        conn.execute(statement)
+    for _, sql in views:
+        conn.execute(sql)
+    rebuild_stone_stats(conn)
+
+
+def retain_stone_stats(conn, card_ids):
+    # przed fizycznym usunięciem kart przeniesionych do archiwum: dodaje to, co
+    # odejmą triggery usuwania, więc liczniki dalej obejmują cały okres.
+    # card_ids: lista JSON id z history
+    conn.execute("""
+        INSERT INTO stone_stats (month, machine, zestaw, status, diameter, stones)
+        SELECT """ + _STATS_KEY.format(row="d") + """, COUNT(*)
+        FROM details d JOIN history h ON h.satznummer = d.satznummer
+        WHERE h.id IN (SELECT value FROM json_each(?))
+          AND h.deleted_at IS NULL AND d.deleted_at IS NULL
+        GROUP BY 1, 2, 3, 4, 5
+        ON CONFLICT (month, machine, zestaw, status, diameter)
+        DO UPDATE SET stones = stones + excluded.stones
+    """, (card_ids,))
+
+
+def _migration_8_satznummer_sequence(conn):
+    # sekwencja numerów kart (numbering.py); start za największym istniejącym
+    # numerem cyfrowym, łącznie z kartami usuniętymi miękko
+    conn.execute("CREATE TABLE IF NOT EXISTS satznummer_sequence (name TEXT PRIMARY KEY, next INTEGER NOT NULL)")
+    highest = conn.execute(
+        f"""SELECT MAX(CAST(satznummer AS INTEGER)) FROM history
+            WHERE satznummer <> '' AND satznummer NOT GLOB '*[^0-9]*'
+              AND satznummer NOT LIKE '0%' AND length(satznummer) <= {MAX_DIGITS}"""
+    ).fetchone()[0]
+    conn.execute(
+        "INSERT OR IGNORE INTO satznummer_sequence (name, next) VALUES (?, ?)",
+        (SEQUENCE_NAME, compact_number(max(FIRST_NUMBER, (highest or 0) + 1)))
+    )
+
+
+def _migration_9_change_log(conn):
+    # dziennik zmian dla podglądu /history na żywo (/history/changes): triggery
+    # dopisują wiersz w tej samej transakcji co zmiana, więc dziennik nie
+    # rozjeżdża się z danymi. AUTOINCREMENT: id (pozycja w dzienniku) nie wraca
+    # po usunięciu starych wpisów przez maintenance.py.
+    # Fizyczne DELETE (kompaktowanie) nie jest logowane - wiersz był już usunięty miękko.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS change_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            at TEXT NOT NULL DEFAULT (datetime('now')),
+            entity TEXT NOT NULL,
+            op TEXT NOT NULL,
+            satznummer TEXT,
+            stone_id INTEGER,
+            status TEXT
+        )
+    """)
+    for statement in (
+        """CREATE TRIGGER IF NOT EXISTS change_log_history_ai AFTER INSERT ON history BEGIN
+               INSERT INTO change_log (entity, op, satznummer) VALUES ('card', 'insert', new.satznummer);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS change_log_history_au AFTER UPDATE OF deleted_at ON history
+           WHEN old.deleted_at IS NULL AND new.deleted_at IS NOT NULL BEGIN
+               INSERT INTO change_log (entity, op, satznummer) VALUES ('card', 'delete', new.satznummer);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS change_log_details_ai AFTER INSERT ON details BEGIN
+               INSERT INTO change_log (entity, op, satznummer, stone_id, status)
+               VALUES ('stone', 'insert', new.satznummer, new.id, new.status);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS change_log_details_status AFTER UPDATE OF status ON details
+           WHEN new.status IS NOT old.status BEGIN
+               INSERT INTO change_log (entity, op, satznummer, stone_id, status)
+               VALUES ('stone', 'status', new.satznummer, new.id, new.status);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS change_log_details_deleted AFTER UPDATE OF deleted_at ON details
+           WHEN old.deleted_at IS NULL AND new.deleted_at IS NOT NULL BEGIN
+               INSERT INTO change_log (entity, op, satznummer, stone_id)
+               VALUES ('stone', 'delete', new.satznummer, new.id);
+           END""",
+    ):
+        conn.execute(statement)
+
+
+def _migration_10_archive_catalog(conn):
+    # karty przeniesione do archiwum rocznego (archive.py): numer -> rok pliku.
+    # Numer z archiwum nie może wrócić jako nowa karta (unikalność między
+    # partycjami) - ten sam komunikat co unikalny indeks, czyli DuplicateCardError
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS archived_cards (
+            satznummer TEXT PRIMARY KEY,
+            year INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS history_archived_bi BEFORE INSERT ON history
+        WHEN EXISTS (SELECT 1 FROM archived_cards WHERE satznummer = new.satznummer) BEGIN
+            SELECT RAISE(ABORT, 'UNIQUE constraint failed: history.satznummer');
+        END
+    """)
+
+
+MIGRATIONS = [
+    _migration_1_base_tables,
+    _migration_2_lookup_indexes,
+    _migration_3_search_index,
+    _migration_4_card_operator,
+    _migration_5_stone_stats,
+    _migration_6_diameter_index,
+    _migration_7_soft_delete,
+    _migration_8_satznummer_sequence,
+    _migration_9_change_log,
+    _migration_10_archive_catalog,
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    # bez kontroli kluczy obcych: starsze kroki działają na schemacie sprzed
+    # unikalnego indeksu, a migracja 7 przebudowuje details (PRAGMA działa
+    # tylko poza transakcją, więc przełączamy ją wokół całej pętli)
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        for version, step in enumerate(MIGRATIONS, start=1):
+            if schema_version(conn) >= version:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # inny worker mógł zrobić ten krok, zanim dostaliśmy blokadę
+                if schema_version(conn) < version:
+                    step(conn)
+                    conn.execute(f"PRAGMA user_version = {version}")
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+
+
+# --- Inicjalizacja bazy ---
+def init_db():
+    with connection() as conn:
+        migrate(conn)
+
+
+# --- Błędy zapisu ---
+class CardError(Exception):
+    pass
+
+
+class DuplicateCardError(CardError):
+    def __init__(self, satznummer):
+        super().__init__(f"Karta {satznummer} już istnieje")
+        self.satznummer = satznummer
+
+
+class CardNotFoundError(CardError):
+    def __init__(self, satznummer):
+        super().__init__(f"Nie znaleziono karty {satznummer}")
+        self.satznummer = satznummer
+
+
+class InvalidStatusError(CardError):
+    def __init__(self, status):
+        super().__init__(f"Nieznany status: {status}")
+        self.status = status
+
+
+def _insert_stones(conn, satznummer, stones):
+    conn.executemany(
+        "INSERT INTO details (satznummer, code, diameter, status) VALUES (?, ?, ?, ?)",
+        [(satznummer, code, dia, "Nowy") for code, dia in stones]
+    )
+
+
+# --- Tworzenie karty (historia + kamienie w jednej transakcji) ---
+@timed("db")
+def create_card(satznummer, machine, zestaw, operator, stones, data=None):
+    # stones: lista par (kod, średnica); data: 'YYYY-MM-DD HH:MM:SS' (domyślnie teraz, UTC)
+    try:
+        with transaction() as conn:
+            # numer usuniętej (miękko) karty można od razu użyć ponownie
+            conn.execute("DELETE FROM history WHERE satznummer = ? AND deleted_at IS NOT NULL", (satznummer,))
+            conn.execute(
+                "INSERT INTO history (satznummer, machine, zestaw, operator, data) "
+                "VALUES (?, ?, ?, ?, COALESCE(?, datetime('now')))",
+                (satznummer, machine, zestaw, operator, data)
+            )
+            _insert_stones(conn, satznummer, stones)
+            # numer wpisany ręcznie nie wróci z sekwencji
+            advance_past(conn, satznummer)
+    except sqlite3.IntegrityError as e:
+        if "history.satznummer" in str(e):
+            raise DuplicateCardError(satznummer) from e
+        raise
+    return satznummer
+
+
+# --- Import wielu kart (card_import.py) ---
+@timed("db")
+def create_cards(cards):
+    # cards: krotki (satznummer, machine, zestaw, operator, data, stones),
+    # stones: krotki (kod, średnica, status); wszystkie karty w jednej transakcji.
+    # Przy zajętym numerze cała paczka jest wycofywana (DuplicateCardError).
+    with transaction() as conn:
+        conn.execute(
+            "DELETE FROM history WHERE satznummer IN (SELECT value FROM json_each(?)) AND deleted_at IS NOT NULL",
+            (json.dumps([card[0] for card in cards]),)
+        )
+        for satznummer, machine, zestaw, operator, data, _ in cards:
+            try:
+                conn.execute(
+                    "INSERT INTO history (satznummer, machine, zestaw, operator, data) "
+                    "VALUES (?, ?, ?, ?, COALESCE(?, datetime('now')))",
+                    (satznummer, machine, zestaw, operator, data)
+                )
+            except sqlite3.IntegrityError as e:
+                if "history.satznummer" in str(e):
+                    raise DuplicateCardError(satznummer) from e
+                raise
+        # kamienie po kartach (klucz obcy details -> history)
+        conn.executemany(
+            "INSERT INTO details (satznummer, code, diameter, status) VALUES (?, ?, ?, ?)",
+            [(card[0], code, dia, status) for card in cards for code, dia, status in card[5]]
+        )
+        numbers = [number for number in map(sequence_number, (card[0] for card in cards)) if number is not None]
+        if numbers:
+            advance_past(conn, str(max(numbers)))
+    return [card[0] for card in cards]
+
+
+def existing_cards(satznummers):
+    # -> zbiór numerów zajętych (jak card_exists, jednym zapytaniem dla całej listy)
+    selection = json.dumps([str(s) for s in satznummers])
+    with connection() as conn:
+        return {row[0] for row in conn.execute(
+            """SELECT satznummer FROM history
+               WHERE satznummer IN (SELECT value FROM json_each(?)) AND deleted_at IS NULL
+               UNION
+               SELECT satznummer FROM archived_cards WHERE satznummer IN (SELECT value FROM json_each(?))""",
+            (selection, selection)
+        )}
+
+
+def card_exists(satznummer):
+    # sprawdzenie numeru wpisanego ręcznie (numer karty usuniętej miękko jest wolny,
+    # numer karty z archiwum - nie)
+    with connection() as conn:
+        return conn.execute(
+            """SELECT EXISTS (SELECT 1 FROM history WHERE satznummer = ? AND deleted_at IS NULL)
+                   OR EXISTS (SELECT 1 FROM archived_cards WHERE satznummer = ?)""",
+            (satznummer, satznummer)
+        ).fetchone()[0] == 1
+
+
+# --- Dodanie kamienia do istniejącej karty ---
+def add_stone(satznummer, code, diameter):
+    with transaction() as conn:
+        if conn.execute(
+            "SELECT 1 FROM history WHERE satznummer = ? AND deleted_at IS NULL", (satznummer,)
+        ).fetchone() is None:
+            raise CardNotFoundError(satznummer)
+        cursor = conn.execute(
+            "INSERT INTO details (satznummer, code, diameter, status) VALUES (?, ?, ?, ?)",
+            (satznummer, code, diameter, "Nowy")
+        )
+        return cursor.lastrowid
+
+
+# --- Zmiana statusów (wiele kamieni w jednej transakcji) ---
+def update_statuses(changes):
+    # changes: pary (stone_id, status); przy powtórzonym id wygrywa ostatnia zmiana.
+    # Zwraca satznummery zmienionych kart (do unieważnienia cache PDF).
+    latest = {}
+    for stone_id, status in changes:
+        if status not in STATUSES:
+            raise InvalidStatusError(status)
+        latest[int(stone_id)] = status
+    if not latest:
+        return []
+
+    with transaction() as conn:
+        conn.executemany(
+            "UPDATE details SET status = ? WHERE id = ? AND status IS NOT ? AND deleted_at IS NULL",
+            [(status, stone_id, status) for stone_id, status in latest.items()]
+        )
+        # jeden parametr (lista JSON) zamiast ? na każde id
+        return [row[0] for row in conn.execute(
+            "SELECT DISTINCT satznummer FROM details WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(latest)),)
+        )]
+
+
+# --- Usuwanie (miękkie: deleted_at, fizycznie usuwa maintenance.py) ---
+def _card_selection(satznummers, filters):
+    where, params = card_stone_filter(filters or {})
+    if satznummers is not None:
+        where += " AND h.satznummer IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps([str(s) for s in satznummers]))
+    return where, params
+
+
+def soft_delete_cards(satznummers=None, filters=None):
+    # karty z listy i/lub pasujące do filtrów /history; kamienie znikają razem
+    # z kartą (filtry i statystyki pomijają karty z deleted_at).
+    # Zwraca satznummery usuniętych kart (do unieważnienia cache PDF).
+    where, params = _card_selection(satznummers, filters)
+    with transaction() as conn:
+        return [row[0] for row in conn.execute(
+            f"""UPDATE history SET deleted_at = datetime('now')
+                WHERE id IN (SELECT h.id FROM history h WHERE 1=1{where})
+                RETURNING satznummer""",
+            params
+        )]
+
+
+def soft_delete_stone(stone_id):
+    # -> satznummer karty albo None, gdy kamienia nie ma (lub już usunięty)
+    with transaction() as conn:
+        rows = conn.execute(
+            "UPDATE details SET deleted_at = datetime('now') WHERE id = ? AND deleted_at IS NULL RETURNING satznummer",
+            (stone_id,)
+        ).fetchall()
+    return rows[0][0] if rows else None
+
+
+# --- Dziennik zmian (podgląd /history na żywo) ---
+CHANGES_BATCH = 500
+
+
+def change_position(conn):
+    # ostatnia pozycja w dzienniku (0 = pusty); sqlite_sequence, bo MAX(id)
+    # cofnąłby się po usunięciu starych wpisów
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'").fetchone()
+    return row[0] if row else 0
+
+
+def changes_since(position, limit=CHANGES_BATCH):
+    # -> {"position", "changes", "reset"}; przy więcej niż limit zmian position
+    # wskazuje ostatnią zwróconą (reszta w kolejnym wywołaniu). reset: zmian po
+    # position nie ma już w dzienniku (maintenance.py) - strona musi się przeładować
+    with connection() as conn:
+        # jeden odczyt (migawka WAL): zapis zatwierdzony między dwoma zapytaniami
+        # dałby pozycję bez wierszy, czyli fałszywy reset wszystkich stron /history
+        conn.execute("BEGIN")
+        try:
+            rows = conn.execute(
+                "SELECT id, entity, op, satznummer, stone_id, status FROM change_log WHERE id > ? ORDER BY id LIMIT ?",
+                (position, limit)
+            ).fetchall()
+            current = change_position(conn)
+        finally:
+            conn.commit()
+    # id w dzienniku są kolejne (wycofana transakcja cofa też sqlite_sequence)
+    reset = position > current or (position < current and (not rows or rows[0][0] != position + 1))
+    return {
+        "position": rows[-1][0] if rows else current,
+        "changes": [
+            {"id": id_, "entity": entity, "op": op, "satznummer": satznummer, "stone_id": stone_id, "status": status}
+            for id_, entity, op, satznummer, stone_id, status in rows
+        ],
+        "reset": reset,
+    }
 
 
 # --- Zapisywanie historii ---
 def save_history(satznummer, machine, zestaw, data):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO history (satznummer, machine, zestaw, data) VALUES (?, ?, ?, ?)",
-        (satznummer, machine, zestaw, data)
-    )
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO history (satznummer, machine, zestaw, data) VALUES (?, ?, ?, ?)",
+            (satznummer, machine, zestaw, data)
+        )
 
 
 # --- Zapisywanie szczegółów ---
 def save_details(satznummer, codes, diameters):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    for code, dia in zip(codes, diameters):
-        cursor.execute(
-            "INSERT INTO details (satznummer, code, diameter, status) VALUES (?, ?, ?, ?)",
-            (satznummer, code, dia, "Nowy")
-        )
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        _insert_stones(conn, satznummer, zip(codes, diameters))
 
 
 # --- Pobieranie historii ---
 def get_history(filters=None):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM history ORDER BY id DESC")
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+    with connection() as conn:
+        return conn.execute("SELECT * FROM history WHERE deleted_at IS NULL ORDER BY id DESC").fetchall()
 
 
 # --- Pobieranie szczegółów ---
 def get_details(satznummer=None):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    if satznummer:
-        cursor.execute(
-            "SELECT satznummer, code, diameter, id, status FROM details WHERE satznummer = ?",
-            (satznummer,)
-        )
-    else:
-        cursor.execute("SELECT satznummer, code, diameter, id, status FROM details")
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+    with connection() as conn:
+        if satznummer:
+            return conn.execute(
+                "SELECT satznummer, code, diameter, id, status FROM details "
+                "WHERE satznummer = ? AND deleted_at IS NULL",
+                (satznummer,)
+            ).fetchall()
+        return conn.execute(
+            "SELECT satznummer, code, diameter, id, status FROM details WHERE deleted_at IS NULL"
+        ).fetchall()
 
 
-# --- Eksport klasyczny (rekordy w wierszach) ---
-def export_to_excel(satznummer=None, zestaw=None):
-    conn = sqlite3.connect(DB_NAME)
-
-    query = """
-        SELECT h.satznummer, h.machine, h.zestaw,
-               d.code, d.diameter, d.status
-        FROM history h
-        JOIN details d ON h.satznummer = d.satznummer
-        WHERE 1=1
-    """
-    params = []
+# --- Eksport: wspólne zapytanie ---
+EXPORT_COLUMNS = ("satznummer", "machine", "zestaw", "code", "diameter", "status")
+EXPORT_CHUNK_SIZE = 1000
+
+
+def _export_where(satznummer=None, zestaw=None, filters=None, db="main"):
+    where, params = stone_filter(filters or {}, db=db)
     if zestaw:
-        query += " AND h.zestaw = ?"
+        where += " AND h.zestaw = ?"
         params.append(zestaw)
     if satznummer:
-        query += " AND h.satznummer = ?"
+        where += " AND h.satznummer = ?"
         params.append(satznummer)
+    return where, params
 
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
 
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Karta")
-
-        worksheet = writer.sheets["Karta"]
-        for col in worksheet.columns:
-            max_length = 0
-            col_letter = col[0].column_letter
-            for cell in col:
-                if cell.value:
-                    max_length = max(max_length, len(str(cell.value)))
-            worksheet.column_dimensions[col_letter].width = max_length + 2
-        worksheet.auto_filter.ref = worksheet.dimensions
+def iter_export_rows(satznummer=None, zestaw=None, filters=None, chunk_size=EXPORT_CHUNK_SIZE):
+    # wiersze (satznummer, machine, zestaw, code, diameter, status) pobierane porcjami
+    with connection() as conn, partitions(conn, filters, [satznummer] if satznummer else None) as schemas:
+        def arm(db):
+            where, params = _export_where(satznummer, zestaw, filters, db)
+            return f"""
+                SELECT h.satznummer, h.machine, h.zestaw,
+                       d.code, d.diameter, d.status, h.id AS card_id, d.id AS stone_id
+                FROM {db}.history h
+                JOIN {db}.details d ON h.satznummer = d.satznummer
+                WHERE 1=1{where}
+            """, params
+
+        cursor = conn.execute(*union_partitions(arm, schemas, order_by="card_id, stone_id"))
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row[:6]
+        finally:
+            # otwarty kursor blokowałby odłączenie roczników
+            cursor.close()
+
+
+def export_column_widths(satznummer=None, zestaw=None, filters=None):
+    # szerokości kolumn liczone przez SQLite w jednym przebiegu (bez trzymania
+    # wierszy w pamięci) - w trybie write-only muszą być znane przed 1. wierszem
+    lengths = ", ".join(
+        f"MAX(LENGTH({alias}.{column}))"
+        for alias, column in (("h", "satznummer"), ("h", "machine"), ("h", "zestaw"),
+                              ("d", "code"), ("d", "diameter"), ("d", "status"))
+    )
+    widths = [len(name) for name in EXPORT_COLUMNS]
+    with connection() as conn, partitions(conn, filters, [satznummer] if satznummer else None) as schemas:
+        for db in schemas:
+            where, params = _export_where(satznummer, zestaw, filters, db)
+            row = conn.execute(
+                f"SELECT {lengths} FROM {db}.history h JOIN {db}.details d ON h.satznummer = d.satznummer WHERE 1=1{where}",
+                params
+            ).fetchone()
+            widths = [max(width, length or 0) for width, length in zip(widths, row)]
+    return [width + 2 for width in widths]
+
 
+# --- Eksport klasyczny (rekordy w wierszach) ---
+@timed("excel_write")
+def write_excel_stream(output, satznummer=None, zestaw=None, filters=None):
+    # openpyxl w trybie write-only: wiersze idą od razu do pliku tymczasowego
+    # arkusza, więc pamięć nie rośnie z liczbą wierszy
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Karta")
+    for i, width in enumerate(export_column_widths(satznummer, zestaw, filters), start=1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+
+    ws.append(EXPORT_COLUMNS)
+    count = 0
+    for row in iter_export_rows(satznummer, zestaw, filters):
+        ws.append(row)
+        count += 1
+    ws.auto_filter.ref = f"A1:{get_column_letter(len(EXPORT_COLUMNS))}{count + 1}"
+    wb.save(output)
+    return count
+
+
+def export_to_excel(satznummer=None, zestaw=None, filters=None):
+    output = BytesIO()
+    write_excel_stream(output, satznummer, zestaw, filters)
     output.seek(0)
     return output
 
 
 # --- Eksport transponowany (kolumny jako wiersze) ---
+@timed("excel_write")
 def export_to_excel_transposed(satznummer=None, zestaw=None):
-    conn = sqlite3.connect(DB_NAME)
-
-    query = """
-        SELECT h.satznummer, h.machine, h.zestaw,
-               d.code, d.diameter, d.status
-        FROM history h
-        JOIN details d ON h.satznummer = d.satznummer
-        WHERE 1=1
-    """
-    params = []
-    if zestaw:
-        query += " AND h.zestaw = ?"
-        params.append(zestaw)
-    if satznummer:
-        query += " AND h.satznummer = ?"
-        params.append(satznummer)
+    # pola jako wiersze, rekordy jako kolumny (0, 1, 2, ...) - jak df.T w starej wersji;
+    # używany dla pojedynczej karty, więc wszystkie rekordy mieszczą się w pamięci
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
 
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
+    records = list(iter_export_rows(satznummer, zestaw))
+    table = [["Pole"] + list(range(len(records)))]
+    for i, name in enumerate(EXPORT_COLUMNS):
+        table.append([name] + [record[i] for record in records])
 
-    # --- transpozycja ---
-    df_transposed = df.T
-    df_transposed.reset_index(inplace=True)
-    df_transposed.columns.values[0] = "Pole"
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Karta"
+    widths = [0] * len(table[0])
+    for row in table:
+        ws.append(row)
+        for i, value in enumerate(row):
+            if value:
+                widths[i] = max(widths[i], len(str(value)))
+    for i, width in enumerate(widths, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = width + 2
+    ws.auto_filter.ref = ws.dimensions
 
     output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df_transposed.to_excel(writer, index=False, sheet_name="Karta")
-
-        worksheet = writer.sheets["Karta"]
-        for col in worksheet.columns:
-            max_length = 0
-            col_letter = col[0].column_letter
-            for cell in col:
-                if cell.value:
-                    max_length = max(max_length, len(str(cell.value)))
-            worksheet.column_dimensions[col_letter].width = max_length + 2
-        worksheet.auto_filter.ref = worksheet.dimensions
-
+    wb.save(output)
     output.seek(0)
     return output
+
+
+# --- Filtry widoku /history (wspólne dla listy kart, kamieni i eksportów) ---
+HISTORY_FILTERS = ("satznummer", "machine", "zestaw", "date_from", "date_to", "code", "diameter")
+
+
+# trigram potrzebuje min. 3 znaków; krótsze frazy idą przez LIKE
+FTS_MIN_TERM = 3
+
+
+def fts_phrase(column, term):
+    return f'{column} : "' + term.replace('"', '""') + '"'
+
+
+def card_filter(filters, alias="h", db="main"):
+    # karty usunięte miękko (deleted_at) nie pasują do żadnego filtra;
+    # db: schemat partycji (rocznik archiwum dołączony przez ATTACH)
+    where = f" AND {alias}.deleted_at IS NULL"
+    params = []
+    phrases = []
+    for column in ("satznummer", "machine"):
+        term = filters.get(column)
+        if not term:
+            continue
+        if len(term) >= FTS_MIN_TERM:
+            phrases.append(fts_phrase(column, term))
+        else:
+            where += f" AND {alias}.{column} LIKE ?"
+            params.append(f"%{term}%")
+    if phrases:
+        where += f" AND {alias}.id IN (SELECT rowid FROM {db}.history_fts WHERE history_fts MATCH ?)"
+        params.append(" AND ".join(phrases))
+    if filters.get("zestaw"):
+        where += f" AND {alias}.zestaw = ?"
+        params.append(filters["zestaw"])
+    if filters.get("date_from"):
+        where += f" AND {alias}.data >= date(?)"
+        params.append(filters["date_from"])
+    if filters.get("date_to"):
+        where += f" AND {alias}.data < date(?, '+1 day')"
+        params.append(filters["date_to"])
+    return where, params
+
+
+def stone_filter(filters, db="main"):
+    # filtry karty odnoszą się do h (JOIN history), filtry kamienia do d
+    where, params = card_filter(filters, alias="h", db=db)
+    stone_where, stone_params = _stone_conditions(filters, db)
+    return where + stone_where, params + stone_params
+
+
+def card_stone_filter(filters, alias="h", db="main"):
+    # karty jak card_filter, a przy filtrze code/diameter tylko karty z pasującym
+    # kamieniem - ta sama selekcja dla listy kart, wydruku, liczenia i usuwania
+    where, params = card_filter(filters, alias=alias, db=db)
+    if filters.get("code") or filters.get("diameter"):
+        stone_where, stone_params = _stone_conditions(filters, db)
+        where += f" AND {alias}.satznummer IN (SELECT d.satznummer FROM {db}.details d WHERE 1=1{stone_where})"
+        params += stone_params
+    return where, params
+
+
+def _stone_conditions(filters, db):
+    where = " AND d.deleted_at IS NULL"
+    params = []
+    code = filters.get("code")
+    if code and len(code) >= FTS_MIN_TERM:
+        where += f" AND d.id IN (SELECT rowid FROM {db}.details_fts WHERE details_fts MATCH ?)"
+        params.append(fts_phrase("code", code))
+    elif code:
+        where += " AND d.code LIKE ?"
+        params.append(f"%{code}%")
+    if filters.get("diameter"):
+        # zakres zamiast równości floatów (0.705 znajdzie 0.7049), korzysta z idx_details_diameter
+        bounds = diameter_bounds(filters["diameter"])
+        if bounds is None:
+            where += " AND 0"
+        else:
+            where += " AND d.diameter BETWEEN ? AND ?"
+            params.extend(bounds)
+    return where, params
+
+
+# --- Partycje (baza bieżąca + roczniki archiwum z archive.py) ---
+def partitions(conn, filters=None, satznummers=None):
+    # kontekst -> ["main", "archive_2023", ...]: roczniki dołączone tylko, gdy
+    # wskazuje je filtr dat albo katalog archived_cards
+    return attached(conn, partition_years(conn, filters, satznummers))
+
+
+def union_partitions(arm, schemas, order_by=None):
+    # arm(db) -> (zapytanie, parametry) dla jednej partycji; wynik: UNION ALL.
+    # order_by po nazwach kolumn wyniku (aliasach), bo h.id/d.id nie istnieją poza ramieniem
+    queries, params = [], []
+    for db in schemas:
+        query, arm_params = arm(db)
+        queries.append(query)
+        params += arm_params
+    query = " UNION ALL ".join(queries)
+    if order_by:
+        query += f" ORDER BY {order_by}"
+    return query, params
+
+
+# --- Stronicowanie po kluczu (keyset) ---
+def keyset_page(conn, arms, id_column, per_page, before=None, after=None):
+    # arms: [(zapytanie, parametry), ...], jedno na partycję; zapytanie musi kończyć
+    # się warunkami WHERE - sortowanie i LIMIT dokładamy tutaj, w każdej partycji
+    # osobno (każda czyta najwyżej per_page + 1 wierszy z indeksu).
+    # before -> następna strona (starsze id), after -> poprzednia strona (nowsze id);
+    # id są unikalne we wszystkich partycjach (archiwum zachowuje id z bazy bieżącej)
+    if after:
+        condition, order = f" AND {id_column} > ?", "ASC"
+    elif before:
+        condition, order = f" AND {id_column} < ?", "DESC"
+    else:
+        condition, order = "", "DESC"
+    queries, params = [], []
+    for query, arm_params in arms:
+        queries.append(f"{query}{condition} ORDER BY {id_column} {order} LIMIT ?")
+        params += list(arm_params) + ([after or before] if condition else []) + [per_page + 1]
+    if len(queries) == 1:
+        query = queries[0]
+    else:
+        column = id_column.split(".")[-1]
+        query = " UNION ALL ".join(f"SELECT * FROM ({q})" for q in queries) + f" ORDER BY {column} {order} LIMIT ?"
+        params.append(per_page + 1)
+
+    with sql_span(query, params):
+        rows = conn.execute(query, params).fetchall()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if after:
+        rows.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = bool(before), has_more
+    return rows, has_newer, has_older
+
+
+# --- Strumieniowe czytanie kart (wydruk zbiorczy) ---
+def iter_cards(satznummers=None, filters=None, chunk_size=500):
+    # zwraca (satznummer, machine, zestaw, operator, [(code, diameter), ...])
+    # dla kart z listy albo pasujących do filtrów /history, od najnowszej;
+    # wiersze pobierane porcjami, więc pamięć nie rośnie z liczbą kart
+    if satznummers is not None and not satznummers:
+        return
+
+    def arm(db):
+        where, params = _card_list_filter(satznummers, filters, db)
+        return f"""
+            SELECT h.satznummer, h.machine, h.zestaw, h.operator, d.code, d.diameter,
+                   h.id AS card_id, d.id AS stone_id
+            FROM {db}.history h
+            LEFT JOIN {db}.details d ON d.satznummer = h.satznummer AND d.deleted_at IS NULL
+            WHERE 1=1{where}
+        """, params
+
+    with connection() as conn, partitions(conn, filters, satznummers) as schemas:
+        cursor = conn.execute(*union_partitions(arm, schemas, order_by="card_id DESC, stone_id"))
+        try:
+            current = None
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for satznummer, machine, zestaw, operator, code, diameter, _, _ in rows:
+                    if current is None or current[0] != satznummer:
+                        if current is not None:
+                            yield current
+                        current = (satznummer, machine, zestaw, operator, [])
+                    if code is not None or diameter is not None:
+                        current[4].append((code, diameter))
+            if current is not None:
+                yield current
+        finally:
+            cursor.close()
+
+
+def _card_list_filter(satznummers, filters, db):
+    where, params = card_stone_filter(filters or {}, db=db)
+    if satznummers is not None:
+        where += f" AND h.satznummer IN ({', '.join('?' * len(satznummers))})"
+        params = params + list(satznummers)
+    return where, params
+
+
+def count_cards(satznummers=None, filters=None):
+    if satznummers is not None and not satznummers:
+        return 0
+    with connection() as conn, partitions(conn, filters, satznummers) as schemas:
+        total = 0
+        for db in schemas:
+            where, params = _card_list_filter(satznummers, filters, db)
+            total += conn.execute(f"SELECT COUNT(*) FROM {db}.history h WHERE 1=1{where}", params).fetchone()[0]
+        return total
+
+
+# --- Statystyki (z tabeli stone_stats, bez skanowania details) ---
+STATS_DIMENSIONS = ("month", "machine", "zestaw", "status", "diameter")
+STATS_FILTERS = ("month_from", "month_to", "machine", "zestaw", "status")
+
+
+def stone_stats(group_by, filters=None):
+    # group_by: wymiary z STATS_DIMENSIONS; wynik: krotki (wartości wymiarów..., liczba kamieni)
+    for dimension in group_by:
+        if dimension not in STATS_DIMENSIONS:
+            raise ValueError(f"Nieznany wymiar statystyk: {dimension}")
+    filters = filters or {}
+    where = ""
+    params = []
+    if filters.get("month_from"):
+        where += " AND month >= ?"
+        params.append(filters["month_from"])
+    if filters.get("month_to"):
+        where += " AND month <= ?"
+        params.append(filters["month_to"])
+    for name in ("machine", "zestaw", "status"):
+        if filters.get(name):
+            where += f" AND {name} = ?"
+            params.append(filters[name])
+
+    columns = ", ".join(group_by)
+    if columns:
+        query = f"""
+            SELECT {columns}, SUM(stones) FROM stone_stats
+            WHERE stones != 0{where}
+            GROUP BY {columns} HAVING SUM(stones) != 0 ORDER BY {columns}
+        """
+    else:
+        query = f"SELECT COALESCE(SUM(stones), 0) FROM stone_stats WHERE stones != 0{where}"
+    with connection() as conn:
+        return conn.execute(query, params).fetchall()
@@ -0,0 +1,113 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# --- Konfiguracja bazy (jedno miejsce dla app.py i database.py) ---
+DB_NAME = os.environ.get("SATZKARTEN_DB", "satzkarten.db")
+
+BUSY_TIMEOUT_MS = int(os.environ.get("SATZKARTEN_DB_BUSY_TIMEOUT_MS", "10000"))
+CACHE_SIZE_KIB = int(os.environ.get("SATZKARTEN_DB_CACHE_KIB", "16384"))
+POOL_SIZE = int(os.environ.get("SATZKARTEN_DB_POOL_SIZE", "8"))
+
+
+def _configure(conn):
+    # WAL: czytelnicy nie blokują piszącego, zapis = dopisanie do pliku -wal
+    conn.execute("PRAGMA journal_mode = WAL")
+    # w trybie WAL NORMAL jest bezpieczne (brak korupcji), a oszczędza fsync na każdym commicie
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    # ujemna wartość = rozmiar w KiB, a nie w stronach
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    # ON DELETE CASCADE (details -> history) działa tylko z włączonymi kluczami obcymi
+    conn.execute("PRAGMA foreign_keys = ON")
+
+
+def _new_connection():
+    # isolation_level=None -> brak niejawnych BEGIN; transakcje otwiera transaction()
+    conn = sqlite3.connect(
+        DB_NAME,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,
+        check_same_thread=False,
+    )
+    _configure(conn)
+    return conn
+
+
+# --- Pula połączeń (osobna dla każdego procesu workera) ---
+class ConnectionPool:
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _check_fork(self):
+        # po fork() (gunicorn --preload) połączeń rodzica nie wolno używać w dziecku
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._idle = queue.LifoQueue(maxsize=self.size)
+                    self._pid = os.getpid()
+
+    def acquire(self):
+        self._check_fork()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return _new_connection()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            # niedokończona transakcja nie może wrócić do puli
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                # statystyki planera dla tabel, z których to połączenie korzystało
+                conn.execute("PRAGMA optimize")
+            except sqlite3.Error:
+                pass
+            conn.close()
+
+
+_pool = ConnectionPool()
+
+
+@contextmanager
+def connection():
+    conn = _pool.acquire()
+    try:
+        yield conn
+    finally:
+        _pool.release(conn)
+
+
+@contextmanager
+def transaction():
+    # BEGIN IMMEDIATE bierze blokadę zapisu od razu, więc busy_timeout działa,
+    # zamiast "database is locked" przy próbie podniesienia blokady w trakcie
+    with connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def close_all():
+    _pool.close_all()
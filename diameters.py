@@ -0,0 +1,75 @@
+import math
+import os
+from bisect import bisect_left
+
+from data import DIAMETERS_BY_SET, ZESTAWY
+
+# --- Katalog średnic (jedno źródło: data.DIAMETERS_BY_SET) ---
+# Zmierzona/zeskanowana średnica trafia do najbliższego rozmiaru z katalogu,
+# jeśli różnica mieści się w tolerancji (np. 0.705 -> 0.7049 z Grundsatz).
+# Najmniejszy odstęp między sąsiednimi rozmiarami to ~0.008 mm, więc domyślna
+# tolerancja nie może przypisać pomiaru do dwóch rozmiarów naraz.
+
+DIAMETER_TOLERANCE = float(os.environ.get("DIAMETER_TOLERANCE", "0.002"))
+
+# (średnica, zestaw, pozycja w zestawie), posortowane po średnicy
+CATALOG = sorted(
+    (diameter, zestaw, position)
+    for zestaw, diameters in DIAMETERS_BY_SET.items()
+    for position, diameter in enumerate(diameters)
+)
+_KEYS = [entry[0] for entry in CATALOG]
+
+
+def nearest_diameter(value, tolerance=DIAMETER_TOLERANCE):
+    # -> (średnica z katalogu, zestaw, pozycja) albo None, gdy nic nie jest dość blisko
+    # (także dla nan/inf - NaN przechodzi przez każde porównanie z tolerancją)
+    if not math.isfinite(value):
+        return None
+    i = bisect_left(_KEYS, value)
+    candidates = [CATALOG[j] for j in (i - 1, i) if 0 <= j < len(CATALOG)]
+    if not candidates:
+        return None
+    best = min(candidates, key=lambda entry: abs(entry[0] - value))
+    if abs(best[0] - value) > tolerance:
+        return None
+    return best
+
+
+def snap_diameter(value, tolerance=DIAMETER_TOLERANCE):
+    # zapis kamienia: średnica z katalogu, jeśli pomiar mieści się w tolerancji
+    match = nearest_diameter(value, tolerance)
+    return match[0] if match else value
+
+
+def diameter_bounds(text, tolerance=DIAMETER_TOLERANCE):
+    # filtr /history: "0.705" -> 0.705 ± tolerancja, "0.5-0.7" -> zakres domknięty;
+    # None, gdy tekstu nie da się odczytać jako liczby/zakresu
+    text = text.strip().replace(",", ".")
+    low, sep, high = text.partition("-")
+    try:
+        if sep and low:
+            low, high = float(low), float(high)
+            return (min(low, high), max(low, high))
+        value = float(text)
+    except ValueError:
+        return None
+    return (value - tolerance, value + tolerance)
+
+
+def match_payload(value):
+    # odpowiedź /api/diameters/match (None, gdy brak rozmiaru w tolerancji)
+    match = nearest_diameter(value)
+    if match is None:
+        return None
+    diameter, zestaw, position = match
+    return {"diameter": diameter, "zestaw": zestaw, "name": ZESTAWY.get(zestaw, ""), "position": position}
+
+
+def catalog_payload():
+    # dane dla frontendu (/api/diameters)
+    return {
+        "sets": DIAMETERS_BY_SET,
+        "names": ZESTAWY,
+        "tolerance": DIAMETER_TOLERANCE,
+    }
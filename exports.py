@@ -0,0 +1,161 @@
+"""Eksport danych kamieni (CSV, Parquet, Arrow) dla analityki.
+
+Wszystkie formaty czytają bazę porcjami po CHUNK_SIZE wierszy, więc zużycie
+pamięci nie zależy od wielkości tabel. Filtry są te same co w /history
+(także dołączanie roczników archiwum według filtra dat).
+
+Nocny zrzut z crona, np.:
+    python exports.py --format parquet --out "dumps/kamienie_%Y-%m-%d.parquet"
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+from datetime import datetime
+
+from database import HISTORY_FILTERS, partitions, stone_filter, union_partitions
+from db_pool import connection
+from metrics import timed
+
+CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", "5000"))
+
+COLUMNS = ("satznummer", "machine", "zestaw", "data", "stone_id", "code", "diameter", "status")
+
+# typy kolumn dla Parquet/Arrow (nazwy typów pyarrow)
+COLUMN_TYPES = ("string", "string", "string", "string", "int64", "string", "float64", "string")
+
+
+def iter_chunks(filters=None, chunk_size=CHUNK_SIZE):
+    def arm(db):
+        where, params = stone_filter(filters or {}, db=db)
+        return f"""
+            SELECT h.satznummer, h.machine, h.zestaw, h.data,
+                   d.id AS stone_id, d.code, d.diameter, d.status
+            FROM {db}.details d
+            JOIN {db}.history h ON d.satznummer = h.satznummer
+            WHERE 1=1{where}
+        """, params
+
+    # roczniki archiwum dołączane według filtra dat (archive.py)
+    with connection() as conn, partitions(conn, filters) as schemas:
+        cursor = conn.execute(*union_partitions(arm, schemas, order_by="stone_id"))
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+
+# --- CSV (generator, do odpowiedzi strumieniowej) ---
+def iter_csv(filters=None, chunk_size=CHUNK_SIZE):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue()
+    for rows in iter_chunks(filters, chunk_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+def write_csv(output, filters=None, chunk_size=CHUNK_SIZE):
+    with open(output, "w", newline="", encoding="utf-8") as f:
+        for part in iter_csv(filters, chunk_size):
+            f.write(part)
+
+
+# --- Parquet / Arrow (pyarrow jest zależnością opcjonalną) ---
+class ExportFormatUnavailable(Exception):
+    pass
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ExportFormatUnavailable("Eksport Parquet/Arrow wymaga pakietu pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def _schema(pa):
+    return pa.schema([(name, getattr(pa, type_name)()) for name, type_name in zip(COLUMNS, COLUMN_TYPES)])
+
+
+def _iter_batches(pa, schema, filters, chunk_size):
+    for rows in iter_chunks(filters, chunk_size):
+        columns = list(zip(*rows))
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+            schema=schema,
+        )
+
+
+@timed("export_write")
+def write_parquet(output, filters=None, chunk_size=CHUNK_SIZE):
+    pa = _pyarrow()
+    import pyarrow.parquet as pq
+
+    schema = _schema(pa)
+    # każda porcja to osobna grupa wierszy, więc w pamięci jest tylko jedna naraz
+    with pq.ParquetWriter(output, schema, compression="zstd") as writer:
+        for batch in _iter_batches(pa, schema, filters, chunk_size):
+            writer.write_batch(batch)
+
+
+@timed("export_write")
+def write_arrow(output, filters=None, chunk_size=CHUNK_SIZE):
+    pa = _pyarrow()
+
+    schema = _schema(pa)
+    with pa.OSFile(output, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        for batch in _iter_batches(pa, schema, filters, chunk_size):
+            writer.write_batch(batch)
+
+
+WRITERS = {
+    "csv": write_csv,
+    "parquet": write_parquet,
+    "arrow": write_arrow,
+}
+
+
+# --- CLI (nocne zrzuty) ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Eksport danych kamieni do CSV/Parquet/Arrow")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv")
+    parser.add_argument("--out", required=True,
+                        help="plik wyjściowy; obsługuje znaczniki strftime, np. dumps/kamienie_%%Y-%%m-%%d.parquet")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    for name in HISTORY_FILTERS:
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name, default="")
+    args = parser.parse_args(argv)
+
+    output = datetime.now().strftime(args.out)
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    filters = {name: getattr(args, name) for name in HISTORY_FILTERS}
+    # zapis do pliku tymczasowego i podmiana: przerwany zrzut nie nadpisze poprzedniego
+    tmp_output = output + ".tmp"
+    try:
+        WRITERS[args.format](tmp_output, filters, args.chunk_size)
+    except ExportFormatUnavailable as e:
+        print(e, file=sys.stderr)
+        return 2
+    except BaseException:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+        raise
+    os.replace(tmp_output, output)
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
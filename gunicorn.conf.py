@@ -0,0 +1,25 @@
+import os
+
+# --- Konfiguracja gunicorn (wczytywana automatycznie z katalogu repozytorium) ---
+
+# metryki wszystkich workerów zbierane w jednym katalogu (metrics.py, /metrics);
+# ustawiane przed importem aplikacji, który przy preload następuje po tym pliku
+os.environ.setdefault(
+    "METRICS_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "metrics"),
+)
+
+wsgi_app = "app:create_app()"
+
+# preload: app.py importowany i baza migrowana raz w masterze, workery
+# dostają gotowy moduł przez fork i startują bez ponownego importu Flask/Jinja
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+
+
+def on_starting(server):
+    # liczniki od zera przy każdym starcie mastera
+    from metrics import reset_dir
+    reset_dir()
@@ -0,0 +1,211 @@
+"""Kompaktowanie bazy: fizyczne usuwanie kart/kamieni usuniętych miękko.
+
+Usunięcie w aplikacji to tylko UPDATE deleted_at. Właściwe DELETE robi
+compact() - w wątku w tle procesów aplikacji co COMPACT_INTERVAL sekund
+(blokada pliku obok bazy: naraz tylko jeden proces) albo z crona:
+    python maintenance.py [--retention-days 7] [--full-vacuum]
+
+Kolejno: usunięcie porcjami wierszy starszych niż SOFT_DELETE_RETENTION_DAYS
+(każda porcja w osobnej, krótkiej transakcji) i wpisów dziennika zmian
+starszych niż CHANGE_LOG_RETENTION_HOURS, optymalizacja indeksów FTS,
+statystyki planera (ANALYZE / PRAGMA optimize) i zwolnienie pustych stron
+(PRAGMA incremental_vacuum; pełny VACUUM, gdy wolne strony przekroczą
+VACUUM_FREE_RATIO - przy okazji przełącza bazę na auto_vacuum=INCREMENTAL).
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # bez flock (Windows): zakładamy jeden proces aplikacji
+    fcntl = None
+
+from db_pool import DB_NAME, connection, transaction
+
+SOFT_DELETE_RETENTION_DAYS = float(os.environ.get("SOFT_DELETE_RETENTION_DAYS", "7"))
+# strona /history otwarta dłużej niż tyle godzin przeładuje się zamiast dociągać zmiany
+CHANGE_LOG_RETENTION_HOURS = float(os.environ.get("CHANGE_LOG_RETENTION_HOURS", "24"))
+PURGE_BATCH_SIZE = int(os.environ.get("PURGE_BATCH_SIZE", "500"))
+# 0 = bez wątku w tle (tylko cron / ręcznie)
+COMPACT_INTERVAL = float(os.environ.get("COMPACT_INTERVAL", "3600"))
+VACUUM_FREE_RATIO = float(os.environ.get("VACUUM_FREE_RATIO", "0.2"))
+VACUUM_STEP_PAGES = 1000
+# liczba wierszy próbkowanych na indeks przez ANALYZE (0 = wszystkie)
+ANALYZE_LIMIT = 1000
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+logger = logging.getLogger("satzkarten.maintenance")
+
+
+# --- Usuwanie porcjami ---
+def purge_deleted(retention_days=SOFT_DELETE_RETENTION_DAYS, batch_size=PURGE_BATCH_SIZE):
+    # -> {"cards": n, "stones": n}; kamienie usuwanych kart znikają kaskadowo
+    # (liczone są tylko kamienie usunięte pojedynczo)
+    cutoff = f"-{retention_days} days"
+    purged = {}
+    for table, key in (("history", "cards"), ("details", "stones")):
+        purged[key] = 0
+        while True:
+            with transaction() as conn:
+                count = conn.execute(
+                    f"""DELETE FROM {table} WHERE id IN (
+                            SELECT id FROM {table}
+                            WHERE deleted_at IS NOT NULL AND deleted_at <= datetime('now', ?)
+                            LIMIT ?
+                        )""",
+                    (cutoff, batch_size)
+                ).rowcount
+            purged[key] += count
+            if count < batch_size:
+                break
+    return purged
+
+
+def purge_change_log(retention_hours=CHANGE_LOG_RETENTION_HOURS, batch_size=PURGE_BATCH_SIZE):
+    # dziennik zmian rośnie z każdą zmianą; id rosną razem z czasem, więc
+    # każda porcja czyta tylko batch_size najstarszych wpisów (bez indeksu na at)
+    cutoff = f"-{retention_hours} hours"
+    purged = 0
+    while True:
+        with transaction() as conn:
+            count = conn.execute(
+                """DELETE FROM change_log WHERE id IN (
+                        SELECT id FROM (SELECT id, at FROM change_log ORDER BY id LIMIT ?)
+                        WHERE at <= datetime('now', ?)
+                    )""",
+                (batch_size, cutoff)
+            ).rowcount
+        purged += count
+        if count < batch_size:
+            break
+    return purged
+
+
+# --- Indeksy i statystyki planera ---
+def optimize_indexes(conn, purged):
+    if purged:
+        # scalenie segmentów FTS po większej liczbie usunięć
+        with transaction() as write_conn:
+            write_conn.execute("INSERT INTO history_fts(history_fts) VALUES ('optimize')")
+            write_conn.execute("INSERT INTO details_fts(details_fts) VALUES ('optimize')")
+    analyzed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+    if purged or analyzed is None:
+        conn.execute(f"PRAGMA analysis_limit = {ANALYZE_LIMIT}")
+        conn.execute("ANALYZE")
+    else:
+        conn.execute("PRAGMA optimize")
+
+
+# --- Odzyskiwanie miejsca ---
+def reclaim_space(conn, full=False):
+    # -> "vacuum", "incremental" albo None
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    incremental = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+
+    if full or (not incremental and page_count and free_pages / page_count >= VACUUM_FREE_RATIO):
+        # przepisuje cały plik (blokuje zapisy na czas trwania) - rzadko
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return "vacuum"
+    if not incremental or not free_pages:
+        return None
+    # krótkie transakcje po VACUUM_STEP_PAGES stron zamiast jednej długiej
+    while free_pages:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})").fetchall()
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if remaining >= free_pages:
+            break
+        free_pages = remaining
+    return "incremental"
+
+
+def compact(retention_days=SOFT_DELETE_RETENTION_DAYS, batch_size=PURGE_BATCH_SIZE, full_vacuum=False):
+    start = time.perf_counter()
+    purged = purge_deleted(retention_days, batch_size)
+    purged["changes"] = purge_change_log(batch_size=batch_size)
+    # archiwizacji starych kart tu nie ma: tylko z crona (archive.py)
+    with connection() as conn:
+        optimize_indexes(conn, purged["cards"] or purged["stones"])
+        vacuum = reclaim_space(conn, full=full_vacuum)
+        # w trybie WAL plik bazy maleje dopiero po checkpoincie
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    result = dict(purged, vacuum=vacuum, seconds=round(time.perf_counter() - start, 3))
+    logger.info("Kompaktowanie bazy: %s", result)
+    return result
+
+
+# --- Wątek w tle (każdy proces aplikacji, wykonuje jeden naraz) ---
+_started_pid = None
+_start_lock = threading.Lock()
+
+
+def _run_if_due(interval):
+    # plik blokady obok bazy; w środku czas ostatniego przebiegu (dowolnego procesu)
+    with open(DB_NAME + ".compact", "a+") as lock_file:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return  # inny proces właśnie kompaktuje
+        lock_file.seek(0)
+        try:
+            last_run = float(lock_file.read() or 0)
+        except ValueError:
+            last_run = 0
+        if time.time() - last_run < interval / 2:
+            return
+        compact()
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(time.time()))
+
+
+def _loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            _run_if_due(interval)
+        except Exception:
+            logger.exception("Kompaktowanie bazy nie powiodło się")
+
+
+def start_background(interval=COMPACT_INTERVAL):
+    # wywoływane przy żądaniu (po fork workera); raz na proces
+    global _started_pid
+    if interval <= 0 or _started_pid == os.getpid():
+        return
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+    threading.Thread(target=_loop, args=(interval,), name="satzkarten-compact", daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--retention-days", type=float, default=SOFT_DELETE_RETENTION_DAYS,
+                        help="usuń fizycznie wiersze oznaczone deleted_at starsze niż tyle dni")
+    parser.add_argument("--batch-size", type=int, default=PURGE_BATCH_SIZE)
+    parser.add_argument("--full-vacuum", action="store_true", help="pełny VACUUM niezależnie od VACUUM_FREE_RATIO")
+    args = parser.parse_args()
+
+    from database import init_db
+
+    init_db()
+    print(compact(args.retention_days, args.batch_size, args.full_vacuum))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# --- Pomiary czasu: histogramy żądań i etapów, eksport w formacie Prometheus ---
+# Moduł bez zależności od Flask - spany zbierane są także w procesach
+# render_pool (fpdf, kody kreskowe, openpyxl) i odsyłane razem z wynikiem.
+# Przy kilku workerach gunicorn każdy zapisuje swój stan do METRICS_DIR,
+# a /metrics sumuje pliki wszystkich procesów.
+
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))
+SLOW_SQL_MS = float(os.environ.get("SLOW_SQL_MS", "200"))
+
+# górne granice kubełków w sekundach
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = logging.getLogger("satzkarten.metrics")
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        # etykiety -> [liczniki kubełków..., suma, liczba]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(labels): list(series) for labels, series in self._series.items()}
+
+
+REQUEST_LATENCY = Histogram(
+    "satzkarten_request_duration_seconds", "Czas obsługi żądania HTTP",
+    ("route", "method", "status"),
+)
+STAGE_LATENCY = Histogram(
+    "satzkarten_stage_duration_seconds",
+    "Czas etapów (db, pdf_layout, barcode, excel_write, render_pool)",
+    ("stage",),
+)
+HISTOGRAMS = (REQUEST_LATENCY, STAGE_LATENCY)
+
+
+# --- Spany etapów ---
+_collector = threading.local()
+
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.observe(elapsed, stage)
+        collected = getattr(_collector, "spans", None)
+        if collected is not None:
+            collected.append((stage, elapsed))
+
+
+def timed(stage):
+    # dekorator: całe wywołanie funkcji jako jeden span
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def call_collecting_spans(fn, args, kwargs):
+    # uruchamiane w procesie render_pool: wynik + spany do przeniesienia do workera HTTP
+    _collector.spans = []
+    try:
+        return fn(*args, **kwargs), _collector.spans
+    finally:
+        _collector.spans = None
+
+
+def record_spans(spans):
+    for stage, elapsed in spans:
+        STAGE_LATENCY.observe(elapsed, stage)
+
+
+@contextmanager
+def sql_span(query, params=()):
+    # czas zapytania jako etap "db"; wolne zapytania trafiają do logu z parametrami
+    start = time.perf_counter()
+    with span("db"):
+        yield
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if elapsed_ms >= SLOW_SQL_MS:
+        logger.warning("Wolne zapytanie SQL (%.0f ms): %s params=%r", elapsed_ms, " ".join(query.split()), list(params))
+
+
+# --- Stan wielu procesów (METRICS_DIR) ---
+_last_flush = 0.0
+
+
+def flush(force=False):
+    # zapis stanu tego procesu; wywoływane po żądaniu, najwyżej co METRICS_FLUSH_INTERVAL
+    global _last_flush
+    if not METRICS_DIR:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < METRICS_FLUSH_INTERVAL:
+        return
+    _last_flush = now
+    state = {h.name: h.snapshot() for h in HISTOGRAMS}
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        logger.exception("Nie udało się zapisać metryk do %s", METRICS_DIR)
+
+
+def _merged_state():
+    if not METRICS_DIR:
+        return {h.name: h.snapshot() for h in HISTOGRAMS}
+    flush(force=True)
+    merged = {h.name: {} for h in HISTOGRAMS}
+    try:
+        names = [n for n in os.listdir(METRICS_DIR) if n.endswith(".json")]
+    except OSError:
+        names = []
+    for name in names:
+        try:
+            with open(os.path.join(METRICS_DIR, name)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for metric, series in state.items():
+            target = merged.setdefault(metric, {})
+            for labels, values in series.items():
+                if labels in target:
+                    target[labels] = [a + b for a, b in zip(target[labels], values)]
+                else:
+                    target[labels] = values
+    return merged
+
+
+def reset_dir():
+    # start mastera gunicorn: liczniki od zera, bez plików po poprzednim uruchomieniu
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return
+    for name in os.listdir(METRICS_DIR):
+        if name.endswith((".json", ".tmp")):
+            try:
+                os.remove(os.path.join(METRICS_DIR, name))
+            except OSError:
+                pass
+
+
+def _label_text(names, values):
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return ",".join(f'{n}="{v}"' for n, v in zip(names, escaped))
+
+
+def prometheus_text():
+    state = _merged_state()
+    lines = []
+    for h in HISTOGRAMS:
+        lines.append(f"# HELP {h.name} {h.help_text}")
+        lines.append(f"# TYPE {h.name} histogram")
+        for labels_json, series in sorted(state.get(h.name, {}).items()):
+            labels = _label_text(h.label_names, json.loads(labels_json))
+            prefix = labels + "," if labels else ""
+            for bound, count in zip(h.buckets, series):
+                lines.append(f'{h.name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f'{h.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}')
+            lines.append(f"{h.name}_sum{{{labels}}} {series[-2]:.6f}")
+            lines.append(f"{h.name}_count{{{labels}}} {series[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Profilowanie pojedynczych żądań (cProfile) ---
+# Nagłówek X-Profile z wartością PROFILE_TOKEN albo losowa próbka
+# PROFILE_SAMPLE_RATE żądań; bez PROFILE_TOKEN i próbkowania - wyłączone.
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.environ.get(
+    "PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "profiles"),
+)
+
+
+def should_profile(header_value):
+    if PROFILE_TOKEN and header_value == PROFILE_TOKEN:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def start_profile():
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # inny profiler już działa w tym wątku
+        return None
+    return profiler
+
+
+def finish_profile(profiler, name):
+    # zapis .prof (do snakeviz/pstats) + 25 najdroższych funkcji w logu; zwraca ścieżkę
+    profiler.disable()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{name}.prof")
+    profiler.dump_stats(path)
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(25)
+    logger.info("Profil żądania %s zapisany w %s\n%s", name, path, summary.getvalue())
+    return path
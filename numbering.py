@@ -0,0 +1,105 @@
+import os
+import threading
+
+from db_pool import connection, transaction
+
+# --- Numery kart (Satznummer) z sekwencji w bazie ---
+# Numer to same cyfry o parzystej długości: Code128 (zestaw C) koduje pary
+# cyfr, więc 8 cyfr to 4 znaki kodu - krótszy kod kreskowy niż 8 znaków hex
+# z uuid4. Numery rosną, więc nowe karty trafiają na koniec indeksu
+# history(satznummer) zamiast w losowe miejsca.
+# Proces rezerwuje w tabeli satznummer_sequence blok SATZNUMMER_BLOCK_SIZE
+# numerów jedną krótką transakcją i wydaje je z pamięci, bez zapytania na
+# każdą kartę. Numery niewydane do restartu procesu przepadają (luki, ale
+# nigdy duplikaty); kilka procesów wydaje numery z różnych bloków, więc
+# kolejność jest tylko w przybliżeniu rosnąca.
+# Formularz tylko podgląda kolejny numer (peek_satznummer) - wolny numer z
+# sekwencji, ponad blokami procesów. Karta zapisana z tym numerem przesuwa
+# sekwencję (advance_past), więc numer zużywa dopiero utworzenie karty.
+
+SATZNUMMER_BLOCK_SIZE = int(os.environ.get("SATZNUMMER_BLOCK_SIZE", "20"))
+SEQUENCE_NAME = "satznummer"
+FIRST_NUMBER = 10_000_000  # 8 cyfr
+# dłuższe numery cyfrowe nie mieszczą się w INTEGER SQLite - poza sekwencją
+MAX_DIGITS = 18
+
+
+def compact_number(value):
+    # najmniejszy numer >= value o parzystej liczbie cyfr (100000000 -> 1000000000)
+    digits = len(str(value))
+    if digits % 2:
+        return 10 ** digits
+    return value
+
+
+def sequence_number(satznummer):
+    # numer wpisany ręcznie -> liczba, jeśli mieści się w przestrzeni sekwencji
+    if satznummer.isdigit() and not satznummer.startswith("0") and len(satznummer) <= MAX_DIGITS:
+        return int(satznummer)
+    return None
+
+
+def advance_past(conn, satznummer):
+    # ręcznie wpisany numer cyfrowy: sekwencja nie wyda go drugi raz
+    # (bloki zarezerwowane wcześniej przez inne procesy łapie unikalny indeks)
+    number = sequence_number(satznummer)
+    if number is not None:
+        conn.execute(
+            "UPDATE satznummer_sequence SET next = ? WHERE name = ? AND next <= ?",
+            (number + 1, SEQUENCE_NAME, number)
+        )
+
+
+def reserve_block(size=SATZNUMMER_BLOCK_SIZE):
+    # -> (pierwszy, za ostatnim) numer zarezerwowanego bloku
+    with transaction() as conn:
+        row = conn.execute("SELECT next FROM satznummer_sequence WHERE name = ?", (SEQUENCE_NAME,)).fetchone()
+        start = compact_number(max(row[0] if row else FIRST_NUMBER, FIRST_NUMBER))
+        # blok nie przechodzi na numery o nieparzystej liczbie cyfr
+        end = min(start + size, 10 ** len(str(start)))
+        conn.execute(
+            "INSERT INTO satznummer_sequence (name, next) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET next = excluded.next",
+            (SEQUENCE_NAME, end)
+        )
+    return start, end
+
+
+# --- Blok numerów procesu ---
+class SatznummerAllocator:
+    def __init__(self, block_size=SATZNUMMER_BLOCK_SIZE):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._next = self._end = 0
+
+    def allocate(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # po fork() (gunicorn --preload) blok należy do procesu master
+                self._next = self._end = 0
+                self._pid = os.getpid()
+            if self._next >= self._end:
+                self._next, self._end = reserve_block(self.block_size)
+            number = self._next
+            self._next += 1
+        return str(number)
+
+
+_allocator = SatznummerAllocator()
+
+
+def next_satznummer():
+    return _allocator.allocate()
+
+
+def peek_satznummer(after=""):
+    # -> kolejny wolny numer bez rezerwacji; after: numer właśnie wysłanej karty,
+    # której zapis mógł jeszcze nie przesunąć sekwencji
+    with connection() as conn:
+        row = conn.execute("SELECT next FROM satznummer_sequence WHERE name = ?", (SEQUENCE_NAME,)).fetchone()
+    number = max(row[0] if row else FIRST_NUMBER, FIRST_NUMBER)
+    after = sequence_number(after)
+    if after is not None:
+        number = max(number, after + 1)
+    return str(compact_number(number))
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import date
+
+# --- Cache wygenerowanych PDF (ponowne wydruki z /download_pdf) ---
+# Klucz = satznummer + skrót treści karty (wiersz history, wiersze details,
+# data w stopce, wersja układu). Zmiana karty daje nowy skrót, więc stary wpis
+# nigdy nie zostanie wydany; invalidate() tylko szybciej zwalnia miejsce.
+# Warstwa w pamięci jest osobna w każdym workerze, warstwa dyskowa wspólna.
+
+PDF_LAYOUT_VERSION = "2"
+
+CACHE_DIR = os.environ.get(
+    "PDF_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "pdf"),
+)
+MEMORY_LIMIT_BYTES = int(os.environ.get("PDF_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+DISK_LIMIT_BYTES = int(os.environ.get("PDF_CACHE_DISK_BYTES", str(512 * 1024 * 1024)))
+
+
+def content_digest(satznummer, history_row, detail_rows):
+    h = hashlib.sha256()
+    h.update(PDF_LAYOUT_VERSION.encode())
+    # data drukowana jest w stopce, więc PDF z wczoraj jest inny niż dzisiejszy
+    h.update(str(date.today()).encode())
+    h.update(repr((satznummer, tuple(history_row), [tuple(r) for r in detail_rows])).encode())
+    return h.hexdigest()[:32]
+
+
+def _file_prefix(satznummer):
+    # satznummer może pochodzić z ręcznego wpisu, więc nie trafia wprost do nazwy pliku
+    return hashlib.sha1(satznummer.encode()).hexdigest()[:16]
+
+
+class PdfCache:
+    def __init__(self, directory=CACHE_DIR, memory_limit=MEMORY_LIMIT_BYTES, disk_limit=DISK_LIMIT_BYTES):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+    def _path(self, satznummer, digest):
+        return os.path.join(self.directory, f"{_file_prefix(satznummer)}-{digest}.pdf")
+
+    # --- warstwa w pamięci ---
+    def _remember(self, key, data):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            if len(data) > self.memory_limit:
+                return
+            self._memory[key] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.memory_limit:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def get(self, satznummer, digest):
+        key = (satznummer, digest)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+
+        path = self._path(satznummer, digest)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # mtime służy jako znacznik ostatniego użycia przy usuwaniu z dysku
+            os.utime(path)
+        except OSError:
+            return None
+        self._remember(key, data)
+        return data
+
+    def put(self, satznummer, digest, data):
+        self._remember((satznummer, digest), data)
+        if not self.disk_limit:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(satznummer, digest)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._evict_disk()
+        except OSError:
+            # cache jest tylko przyspieszeniem; błąd dysku nie może zepsuć wydruku
+            pass
+
+    def _evict_disk(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".pdf"):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        if total <= self.disk_limit:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.disk_limit:
+                break
+
+    def invalidate(self, satznummer):
+        self.invalidate_many([satznummer])
+
+    def invalidate_many(self, satznummers):
+        # wiele kart (usuwanie/zmiana statusów paczką): jeden przebieg po
+        # katalogu zamiast osobnego skanowania dla każdej karty
+        satznummers = set(satznummers)
+        if not satznummers:
+            return
+        with self._lock:
+            for key in [k for k in self._memory if k[0] in satznummers]:
+                self._memory_bytes -= len(self._memory.pop(key))
+        prefixes = {_file_prefix(satznummer) for satznummer in satznummers}
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.name.partition("-")[0] in prefixes:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+
+pdf_cache = PdfCache()
@@ -0,0 +1,126 @@
+import copy
+import os
+import threading
+from functools import lru_cache
+from io import BytesIO
+
+from fontTools import subset as ftsubset
+from fontTools import ttLib
+from fpdf import FPDF, FPDF_VERSION
+from fpdf.fonts import SubsetMap, TTFFont
+
+# --- Fonty Unicode dla PDF (DejaVu z static/) ---
+# Wbudowana Helvetica w fpdf zna tylko latin-1 (bez ą, ł, ż, ś...).
+# Plik TTF parsowany jest raz na proces (fontTools, ~30 ms na plik), a każdy
+# dokument dostaje płytką kopię z własnym numerem /F i własną mapą użytych
+# znaków. Przy zapisie fpdf przycina font w miejscu do użytych glifów, więc
+# dokument dostaje osobny TTFont - przycięty wcześniej do tych samych glifów
+# i trzymany w LRU (te same znaki = te same bajty), żeby kolejna karta nie
+# przycinała od nowa całego fontu. W PDF osadzany jest tylko ten podzbiór.
+
+FONT_FAMILY = "DejaVu"
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# wersja Condensed: szerokości znaków zbliżone do Helvetiki, układ kart bez zmian
+FONT_FILES = {
+    "": "DejaVuSansCondensed.ttf",
+    "B": "DejaVuSansCondensed-Bold.ttf",
+    "I": "DejaVuSansCondensed-Oblique.ttf",
+    "BI": "DejaVuSansCondensed-BoldOblique.ttf",
+}
+FONT_SUBSET_CACHE_SIZE = int(os.environ.get("FONT_SUBSET_CACHE_SIZE", "256"))
+
+# Skróty tutaj i w szablonie karty (pdf_utils) korzystają z wnętrza fpdf
+# (TTFFont, SubsetMap, image_cache, pages[...].contents). Sprawdzone tylko na
+# tej wersji (przypiętej w requirements.txt, testy w tests/test_pdf_*.py);
+# przy innej wersji używane jest wyłącznie publiczne API fpdf.
+FPDF_TESTED_VERSION = "2.7.9"
+FPDF_INTERNALS = FPDF_VERSION == FPDF_TESTED_VERSION
+
+_parsed = {}
+_lock = threading.Lock()
+
+
+def _prototype(style):
+    font = _parsed.get(style)
+    if font is None:
+        with _lock:
+            font = _parsed.get(style)
+            if font is None:
+                path = os.path.join(FONT_DIR, FONT_FILES[style])
+                font = TTFFont(FPDF(), path, f"{FONT_FAMILY.lower()}{style}", style)
+                _parsed[style] = font
+    return font
+
+
+@lru_cache(maxsize=None)
+def _font_data(style):
+    with open(os.path.join(FONT_DIR, FONT_FILES[style]), "rb") as f:
+        return f.read()
+
+
+@lru_cache(maxsize=FONT_SUBSET_CACHE_SIZE)
+def _subset_data(style, glyph_names):
+    # opcje jak w fpdf + nazwy glifów (fpdf szuka ich w podzbiorze); bez hintingu
+    # i tabel, których PDF nie używa - mniejszy plik i szybsze ponowne przycięcie
+    font = ttLib.TTFont(BytesIO(_font_data(style)), recalcTimestamp=False)
+    options = ftsubset.Options(notdef_outline=True, recommended_glyphs=True, glyph_names=True, hinting=False)
+    options.drop_tables += ["FFTM", "GDEF", "GPOS", "GSUB", "MATH", "hdmx", "meta", "kern", "gasp"]
+    subsetter = ftsubset.Subsetter(options)
+    subsetter.populate(glyphs=list(glyph_names))
+    subsetter.subset(font)
+    output = BytesIO()
+    font.save(output)
+    return output.getvalue()
+
+
+def _reserved_chars(pdf):
+    # jak w TTFFont.__init__: znaki mapowane na własny kod w podzbiorze
+    chars = "\x00 \r\n"
+    if pdf.str_alias_nb_pages:
+        chars += "0123456789" + pdf.str_alias_nb_pages
+    return [ord(c) for c in chars]
+
+
+def install_fonts(pdf, styles=("", "B")):
+    # kolejność styles wyznacza numery /F1, /F2, ... (szablon karty na tym polega)
+    for style in styles:
+        if not FPDF_INTERNALS:
+            pdf.add_font(FONT_FAMILY, style, os.path.join(FONT_DIR, FONT_FILES[style]))
+            continue
+        prototype = _prototype(style)
+        font = copy.copy(prototype)
+        font.i = len(pdf.fonts) + 1
+        # fpdf przy zapisie uzupełnia deskryptor i zamyka ttfont - własne kopie
+        font.desc = copy.copy(prototype.desc)
+        font.ttfont = None
+        font.hbfont = None
+        font.missing_glyphs = []
+        font.subset = SubsetMap(font, _reserved_chars(pdf))
+        pdf.fonts[font.fontkey] = font
+
+
+def reserve_chars(pdf, text):
+    # przydziela znakom kody w podzbiorach wszystkich fontów dokumentu w stałej
+    # kolejności - tekst nagrany w jednym dokumencie pasuje do każdego kolejnego
+    if not FPDF_INTERNALS:
+        return
+    for font in pdf.fonts.values():
+        if isinstance(font, TTFFont):
+            for char in text:
+                # znaki bez glifu (np. \n w etykietach multi_cell) nie są rysowane
+                if ord(char) in font.cmap:
+                    font.subset.pick(ord(char))
+
+
+def output_bytes(pdf):
+    # zamiast pdf.output(): fonty z install_fonts dostają przycięty TTFont z LRU
+    for font in pdf.fonts.values():
+        if isinstance(font, TTFFont) and font.ttfont is None:
+            style = font.fontkey[len(FONT_FAMILY):]
+            glyph_names = tuple(sorted(set(font.subset.get_all_glyph_names())))
+            # ramki glifów policzone już przy przycinaniu; bez ich przeliczania
+            # ponowne przycięcie przez fpdf nie rozpakowuje konturów
+            font.ttfont = ttLib.TTFont(
+                BytesIO(_subset_data(style, glyph_names)), recalcTimestamp=False, recalcBBoxes=False
+            )
+    return bytes(pdf.output())
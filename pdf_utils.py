@@ -1,140 +1,281 @@
 from fpdf import FPDF
+from fpdf.image_parsing import get_img_info
 from barcode import Code128
 from barcode.writer import ImageWriter
 from io import BytesIO
-import tempfile
+from functools import lru_cache
+import copy
 import os
 from datetime import date
-from flask import current_app
 
-# --- Funkcja pomocnicza: generowanie kodu kreskowego ---
-def generate_barcode_file(text):
+from metrics import timed
+from pdf_fonts import FONT_FAMILY, FPDF_INTERNALS, install_fonts, output_bytes, reserve_chars
+
+BARCODE_CACHE_SIZE = int(os.environ.get("BARCODE_CACHE_SIZE", "512"))
+
+# --- Funkcja pomocnicza: generowanie kodu kreskowego (PNG w pamięci) ---
+@lru_cache(maxsize=BARCODE_CACHE_SIZE)
+@timed("barcode")
+def generate_barcode_png(text):
+    # ponowny wydruk tej samej karty nie koduje kodu kreskowego od nowa
     options = {
         "write_text": False,
         "font_size": 0,
         "quiet_zone": 1
     }
-    barcode = Code128(text, writer=ImageWriter())
-    tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-    barcode.write(tmp_file, options=options)
-    tmp_file.close()
-    return tmp_file.name
+    buffer = BytesIO()
+    Code128(text, writer=ImageWriter()).write(buffer, options=options)
+    return buffer.getvalue()
 
 # --- Generowanie naklejki ---
+LABEL_WIDTH = 60
+LABEL_HEIGHT = 25
+
+
+def _draw_label(pdf, x, y, set_name, stone_count, uuid_code):
+    pdf.set_fill_color(240, 240, 240)
+    pdf.rect(x, y, LABEL_WIDTH, LABEL_HEIGHT, style='F')
+    pdf.set_draw_color(0, 0, 0)
+    pdf.rect(x, y, LABEL_WIDTH, LABEL_HEIGHT)
+
+    pdf.set_font(FONT_FAMILY, "B", 12)
+    pdf.set_xy(x, y + 6)
+    pdf.cell(LABEL_WIDTH, 6, f"{set_name} / {stone_count}", align="C")
+
+    pdf.set_xy(x, y + 13)
+    pdf.cell(LABEL_WIDTH, 6, uuid_code, align="C")
+
+
+@timed("pdf_layout")
 def generate_label_pdf(set_name, stone_count, uuid_code):
     pdf = FPDF(format="A4", unit="mm")
+    install_fonts(pdf, ("B",))
     pdf.add_page()
     pdf.set_auto_page_break(False)
 
-    label_width = 60
-    label_height = 25
     page_width = 210
     page_height = 297
-    x = (page_width - label_width) / 2
-    y = (page_height - label_height) / 2
+    x = (page_width - LABEL_WIDTH) / 2
+    y = (page_height - LABEL_HEIGHT) / 2
+    _draw_label(pdf, x, y, set_name, stone_count, uuid_code)
 
-    pdf.set_fill_color(240, 240, 240)
-    pdf.rect(x, y, label_width, label_height, style='F')
-    pdf.set_draw_color(0, 0, 0)
-    pdf.rect(x, y, label_width, label_height)
+    return BytesIO(output_bytes(pdf))
 
-    pdf.set_font("Helvetica", "B", 12)
-    pdf.set_xy(x, y + 6)
-    pdf.cell(label_width, 6, f"{set_name} / {stone_count}", align="C")
 
-    pdf.set_xy(x, y + 13)
-    pdf.cell(label_width, 6, uuid_code, align="C")
+# --- Arkusz naklejek A4 (3 x 9 naklejek na stronę) ---
+SHEET_MARGIN = 10
+SHEET_GAP = 5
+SHEET_COLUMNS = 3
+SHEET_ROWS = 9
+
+
+@timed("pdf_layout")
+def generate_label_sheet(labels):
+    # labels: iterowalne (set_name, stone_count, uuid_code) - może to być generator
+    pdf = FPDF(format="A4", unit="mm")
+    install_fonts(pdf, ("B",))
+    pdf.set_auto_page_break(False)
+    per_page = SHEET_COLUMNS * SHEET_ROWS
+    for n, (set_name, stone_count, uuid_code) in enumerate(labels):
+        slot = n % per_page
+        if slot == 0:
+            pdf.add_page()
+        x = SHEET_MARGIN + (slot % SHEET_COLUMNS) * (LABEL_WIDTH + SHEET_GAP)
+        y = SHEET_MARGIN + (slot // SHEET_COLUMNS) * (LABEL_HEIGHT + SHEET_GAP)
+        _draw_label(pdf, x, y, set_name, stone_count, uuid_code)
+    if not pdf.page:
+        pdf.add_page()
+
+    return BytesIO(output_bytes(pdf))
+
+
+# --- Szablon Satz-Karte ---
+# Statyczna część karty (nagłówek, nagłówki tabeli, ramki opisów po prawej,
+# logo) jest rysowana raz na proces do osobnego dokumentu, a jej strumień
+# treści PDF jest potem wklejany (w q ... Q, żeby nie zmieniać stanu grafiki)
+# do każdej nowej karty. Fonty są rejestrowane zawsze w tej samej kolejności,
+# a logo zawsze jako pierwszy obraz, więc odwołania /F.. i /I1 w skopiowanym
+# strumieniu pasują do każdego dokumentu zbudowanego przez new_document().
+# Tekst w fontach TTF zapisywany jest kodami z podzbioru fontu, dlatego
+# new_document() rezerwuje znaki STATIC_TEXT zawsze na tych samych kodach.
+# Przy innej wersji fpdf niż sprawdzona (FPDF_INTERNALS) część statyczna
+# rysowana jest zwyczajnie na każdej stronie.
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+LOGO_PATH = os.path.join(STATIC_DIR, "logo.jpg")
+
+
+class SatzKarteTemplate:
+    FONT_STYLES = ("B", "")
+    TITLE = "SATZ-KARTE"
+    COL_WIDTHS = (28, 28, 18, 18)
+    HEADERS = ("Drawing die", "Durchmesser", "Info", "Typ")
+    RIGHT_X = 98
+    FIELD_LABELS = ("Satzkartennummer\nSet card number", "Bearbeiter\nOperator", "Maschine\nMaszyna")
+    STATIC_TEXT = TITLE + "".join(HEADERS) + "".join(FIELD_LABELS)
+    LOGO_KEY = "satzkarte-logo"
+
+    def __init__(self, logo_path=LOGO_PATH):
+        self.logo_path = logo_path
+        self.logo_info = None
+        if os.path.exists(logo_path):
+            self.logo_info = get_img_info(logo_path)
+        # strumienie statyczne wg tego, które pola po prawej mają wartość
+        self._static_streams = {}
+
+    def new_document(self):
+        pdf = FPDF(format="A5", unit="mm")
+        pdf.set_auto_page_break(False)
+        install_fonts(pdf, self.FONT_STYLES)
+        reserve_chars(pdf, self.STATIC_TEXT)
+        if self.logo_info and FPDF_INTERNALS:
+            # kopia, bo FPDF liczy w niej użycia obrazu w danym dokumencie
+            info = copy.copy(self.logo_info)
+            info.update(i=1, usages=0, iccp_i=None)
+            pdf.image_cache.images[self.LOGO_KEY] = info
+        return pdf
+
+    def _draw_static(self, pdf, filled, logo):
+        # Nagłówek
+        pdf.set_font(FONT_FAMILY, "B", 14)
+        pdf.set_xy(5, 10)
+        pdf.cell(92, 10, self.TITLE, ln=0, align="C")
+
+        # Nagłówki tabeli
+        pdf.set_font(FONT_FAMILY, "B", 8)
+        pdf.set_xy(5, 20)
+        pdf.set_fill_color(200, 200, 200)
+        for width, header in zip(self.COL_WIDTHS, self.HEADERS):
+            pdf.cell(width, 6, header, border=1, align="C", fill=True)
+
+        # Ramki opisów po prawej
+        pdf.set_font(FONT_FAMILY, "", 8)
+        for label, y in zip(self.FIELD_LABELS, self.field_rows(filled)):
+            pdf.set_xy(self.RIGHT_X, y)
+            pdf.multi_cell(45, 5, label, border=1)
+
+        # Logo
+        if self.logo_info:
+            pdf.image(logo, x=15, y=200, w=25)
+
+    def field_rows(self, filled):
+        # pozycje y etykiet; pole z wartością zajmuje dodatkowe 6 mm
+        rows = []
+        y = 20
+        for has_value in filled:
+            rows.append(y)
+            y += 16 if has_value else 10
+        rows.append(y)
+        return rows
+
+    def static_stream(self, filled):
+        stream = self._static_streams.get(filled)
+        if stream is None:
+            pdf = self.new_document()
+            pdf.add_page()
+            start = len(pdf.pages[pdf.page].contents)
+            self._draw_static(pdf, filled, self.LOGO_KEY)
+            stream = bytes(pdf.pages[pdf.page].contents[start:])
+            self._static_streams[filled] = stream
+        return stream
+
+    def add_card(self, pdf, codes, satznummer, diameters, machine_number,
+                 stone_type="ND", set_name="", operator="", stone_count=None):
+        values = (satznummer, operator, machine_number if machine_number else "")
+        filled = tuple(bool(v) for v in values)
+
+        pdf.add_page()
+        if FPDF_INTERNALS:
+            # strumień nagrano przy czarnym kolorze wypełnienia i linii (domyślne w FPDF);
+            # poprzednia karta w tym samym dokumencie mogła je zmienić
+            pdf._out(b"q 0 G 0 g\n" + self.static_stream(filled) + b"Q")
+            if self.logo_info:
+                pdf.image_cache.images[self.LOGO_KEY]["usages"] += 1
+        else:
+            self._draw_static(pdf, filled, self.logo_path)
+
+        if set_name:
+            # jeśli stone_count nie podano, policz z diameters
+            count = stone_count if stone_count is not None else len(diameters)
+            pdf.set_font(FONT_FAMILY, "B", 14)
+            pdf.set_xy(98, 10)
+            pdf.cell(45, 10, f"{set_name} ({count})", ln=1, align="C")
+
+        # Tabela po lewej
+        col_widths = self.COL_WIDTHS
+        pdf.set_font(FONT_FAMILY, "", 8)
+        pdf.set_xy(5, 26)
+        for i, dia in enumerate(diameters):
+            pdf.set_x(5)
+            pdf.set_fill_color(245, 245, 245) if i % 2 == 0 else pdf.set_fill_color(255, 255, 255)
+            pdf.cell(col_widths[0], 6, codes[i] if i < len(codes) else "", border=1, fill=True)
+            pdf.cell(col_widths[1], 6, f"{dia:.4f}", border=1, align="C", fill=True)
+            pdf.cell(col_widths[2], 6, "", border=1, align="C", fill=True)
+            pdf.cell(col_widths[3], 6, stone_type, border=1, align="C", fill=True)
+            pdf.ln()
+
+        # Wartości pól po prawej
+        rows = self.field_rows(filled)
+        pdf.set_font(FONT_FAMILY, "B", 9)
+        for value, y in zip(values, rows):
+            if value:
+                pdf.set_xy(self.RIGHT_X, y + 10)
+                pdf.cell(45, 6, value, border=1)
+
+        # dodatkowe pole z liczbą kamieni
+        if stone_count is not None:
+            pdf.set_xy(self.RIGHT_X, rows[-1])
+            pdf.set_font(FONT_FAMILY, "", 8)
+            pdf.cell(45, 6, f"Steine: {stone_count}", border=1)
+
+        # Stopka
+        pdf.set_font(FONT_FAMILY, "", 8)
+        pdf.set_xy(0, 200)
+        pdf.cell(148, 5, str(date.today()), align="C")
+
+        # Kod kreskowy
+        pdf.image(BytesIO(generate_barcode_png(satznummer)), x=110, y=185, w=35)
+        pdf.set_xy(110, 190)
+        pdf.set_font(FONT_FAMILY, "", 7)
+        pdf.cell(35, 5, satznummer, align="C")
+
+
+_template = None
+
+
+def get_template():
+    # szablon budowany leniwie, raz na proces (każdy worker ma własny)
+    global _template
+    if _template is None:
+        _template = SatzKarteTemplate()
+    return _template
 
-    output = pdf.output(dest="S")
-    if isinstance(output, str):
-        output = output.encode("latin1")
-    return BytesIO(output)
 
 # --- Generowanie głównego PDF ---
+@timed("pdf_layout")
 def generate_pdf_bytes(codes, satznummer, diameters, machine_number,
                        stone_type="ND", set_name="", operator="", stone_count=None):
-    pdf = FPDF(format="A5", unit="mm")
-    pdf.add_page()
-    pdf.set_auto_page_break(False)
+    template = get_template()
+    pdf = template.new_document()
+    template.add_card(pdf, codes, satznummer, diameters, machine_number,
+                      stone_type=stone_type, set_name=set_name,
+                      operator=operator, stone_count=stone_count)
 
-    # Nagłówek
-    pdf.set_font("Helvetica", "B", 14)
-    pdf.set_xy(5, 10)
-    pdf.cell(92, 10, "SATZ-KARTE", ln=0, align="C")
-
-    if set_name:
-        # jeśli stone_count nie podano, policz z diameters
-        count = stone_count if stone_count is not None else len(diameters)
-        pdf.set_xy(98, 10)
-        pdf.cell(45, 10, f"{set_name} ({count})", ln=1, align="C")
-    else:
-        pdf.ln(10)
-
-    # Tabela po lewej
-    pdf.set_font("Helvetica", "B", 8)
-    pdf.set_xy(5, 20)
-    col_widths = [28, 28, 18, 18]
-    headers = ["Drawing die", "Durchmesser", "Info", "Typ"]
-    for i, h in enumerate(headers):
-        pdf.set_fill_color(200, 200, 200)
-        pdf.cell(col_widths[i], 6, h, border=1, align="C", fill=True)
-    pdf.ln()
-
-    pdf.set_font("Helvetica", "", 8)
-    for i, dia in enumerate(diameters):
-        pdf.set_x(5)
-        pdf.set_fill_color(245, 245, 245) if i % 2 == 0 else pdf.set_fill_color(255, 255, 255)
-        pdf.cell(col_widths[0], 6, codes[i] if i < len(codes) else "", border=1, fill=True)
-        pdf.cell(col_widths[1], 6, f"{dia:.4f}", border=1, align="C", fill=True)
-        pdf.cell(col_widths[2], 6, "", border=1, align="C", fill=True)
-        pdf.cell(col_widths[3], 6, stone_type, border=1, align="C", fill=True)
-        pdf.ln()
-
-    # Prawa kolumna
-    right_x = 98
-    y = 20
-    fields = [
-        ("Satzkartennummer\nSet card number", satznummer),
-        ("Bearbeiter\nOperator", operator),
-        ("Maschine\nMaszyna", machine_number if machine_number else ""),
-    ]
-    for label, value in fields:
-        pdf.set_xy(right_x, y)
-        pdf.set_font("Helvetica", "", 8)
-        pdf.multi_cell(45, 5, label, border=1)
-        y += 10
-        if value:
-            pdf.set_xy(right_x, y)
-            pdf.set_font("Helvetica", "B", 9)
-            pdf.cell(45, 6, value, border=1)
-            y += 6
-
-    # dodatkowe pole z liczbą kamieni
-    if stone_count is not None:
-        pdf.set_xy(right_x, y)
-        pdf.set_font("Helvetica", "", 8)
-        pdf.cell(45, 6, f"Steine: {stone_count}", border=1)
-        y += 6
-
-    # Logo
-    logo_path = os.path.join(current_app.root_path, "static", "logo.jpg")
-    if os.path.exists(logo_path):
-        pdf.image(logo_path, x=15, y=200, w=25)
-
-    # Stopka
-    pdf.set_font("Helvetica", "", 8)
-    pdf.set_xy(0, 200)
-    pdf.cell(148, 5, str(date.today()), align="C")
-
-    # Kod kreskowy
-    barcode_path = generate_barcode_file(satznummer)
-    pdf.image(barcode_path, x=110, y=185, w=35)
-    os.remove(barcode_path)
-    pdf.set_xy(110, 190)
-    pdf.set_font("Helvetica", "", 7)
-    pdf.cell(35, 5, satznummer, align="C")
-
-    output = pdf.output(dest="S")
-    if isinstance(output, str):
-        output = output.encode("latin1")
-    return BytesIO(output)
+    return BytesIO(output_bytes(pdf))
+
+
+# --- Wiele kart w jednym PDF (jedno zadanie wydruku) ---
+@timed("pdf_layout")
+def generate_cards_pdf(cards, stone_type="ND"):
+    # cards: iterowalne (satznummer, machine, set_name, operator, codes, diameters),
+    # czytane po kolei, więc można podać generator prosto z bazy
+    template = get_template()
+    pdf = template.new_document()
+    for satznummer, machine, set_name, operator, codes, diameters in cards:
+        template.add_card(pdf, codes, satznummer, diameters, machine,
+                          stone_type=stone_type, set_name=set_name,
+                          operator=operator or "", stone_count=len(codes))
+    if not pdf.page:
+        pdf.add_page()
+
+    return BytesIO(output_bytes(pdf))
@@ -0,0 +1,237 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from metrics import call_collecting_spans, record_spans, span
+
+# --- Renderowanie PDF/Excel poza workerem HTTP ---
+# Ciężkie dokumenty (fpdf, PIL, openpyxl) liczą się w puli procesów, a worker
+# tylko czeka na wynik. Liczba zadań w toku (uruchomione + czekające) jest
+# ograniczona; po jej przekroczeniu od razu odpowiadamy 503 + Retry-After,
+# zamiast kolejkować żądania bez końca.
+
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "2"))
+RENDER_QUEUE_SIZE = int(os.environ.get("RENDER_QUEUE_SIZE", str(max(RENDER_WORKERS, 1) * 4)))
+RENDER_TIMEOUT = float(os.environ.get("RENDER_TIMEOUT", "60"))
+RENDER_RETRY_AFTER = int(os.environ.get("RENDER_RETRY_AFTER", "5"))
+
+logger = logging.getLogger("satzkarten.render")
+
+
+class RenderBusy(Exception):
+    def __init__(self, retry_after=RENDER_RETRY_AFTER):
+        super().__init__("Serwer zajęty renderowaniem dokumentów, spróbuj ponownie za chwilę")
+        self.retry_after = retry_after
+
+
+class RenderTimeout(Exception):
+    pass
+
+
+def remove_file(path):
+    # plik tymczasowy eksportu (mógł już zniknąć)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _discard_result(on_abandoned, future):
+    # wynik zadania, na które nikt już nie czeka (timeout żądania)
+    if future.cancelled() or future.exception() is not None:
+        return
+    try:
+        on_abandoned(future.result()[0])
+    except Exception:
+        logger.exception("Sprzątanie wyniku porzuconego zadania nie powiodło się")
+
+
+class RenderExecutor:
+    def __init__(self, workers=RENDER_WORKERS, queue_size=RENDER_QUEUE_SIZE, timeout=RENDER_TIMEOUT):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _get_executor(self):
+        # pula tworzona leniwie i osobno w każdym procesie workera (także po fork)
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # spawn: procesy renderujące nie dziedziczą połączeń SQLite ani wątków
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _reset_executor(self, broken):
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _count(self, name, delta=1):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + delta)
+
+    def _finished(self, future):
+        self._slots.release()
+        self._count("in_flight", -1)
+        if future.cancelled() or future.exception() is not None:
+            self._count("failed")
+        else:
+            self._count("completed")
+
+    def check_capacity(self):
+        # szybkie sprawdzenie bez rezerwacji (wyścig możliwy, run() i tak pilnuje limitu)
+        if self.workers > 0 and self.in_flight >= self.queue_size:
+            self._count("rejected")
+            raise RenderBusy()
+
+    def run(self, fn, *args, on_abandoned=None, **kwargs):
+        # on_abandoned(wynik): sprzątanie wyniku zadania, które skończy się już
+        # po timeoucie żądania (np. remove_file dla ścieżki pliku tymczasowego)
+        if self.workers <= 0:
+            # RENDER_WORKERS=0: renderowanie w procesie żądania (dev, testy)
+            return fn(*args, **kwargs)
+
+        if not self._slots.acquire(blocking=False):
+            self._count("rejected")
+            raise RenderBusy()
+
+        executor = self._get_executor()
+        try:
+            # spany zebrane w procesie puli (pdf_layout, barcode, ...) wracają z wynikiem
+            future = executor.submit(call_collecting_spans, fn, args, kwargs)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._reset_executor(executor)
+            raise
+        self._count("submitted")
+        self._count("in_flight")
+        # slot zwalniany dopiero po faktycznym końcu zadania, także po timeoucie
+        future.add_done_callback(self._finished)
+
+        try:
+            with span("render_pool"):
+                result, spans = future.result(timeout=self.timeout)
+            record_spans(spans)
+            return result
+        except FuturesTimeout:
+            if not future.cancel() and on_abandoned is not None:
+                # zadanie już działa w puli - dokończy i zostawi wynik bez odbiorcy
+                future.add_done_callback(partial(_discard_result, on_abandoned))
+            self._count("timed_out")
+            raise RenderTimeout(f"Renderowanie przekroczyło {self.timeout:.0f} s")
+        except BrokenProcessPool:
+            self._reset_executor(executor)
+            raise
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "in_flight": self.in_flight,
+                "queue_depth": max(self.in_flight - self.workers, 0),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+render_executor = RenderExecutor()
+atexit.register(render_executor.shutdown)
+
+
+# --- Zadania renderowania (wykonywane w procesach puli) ---
+# Zwracają bytes, bo wynik wraca do workera przez pickle.
+
+def render_card_pdf(**card):
+    from pdf_utils import generate_pdf_bytes
+    return generate_pdf_bytes(**card).getvalue()
+
+
+def render_label_pdf(set_name, stone_count, uuid_code):
+    from pdf_utils import generate_label_pdf
+    return generate_label_pdf(set_name=set_name, stone_count=stone_count, uuid_code=uuid_code).getvalue()
+
+
+def render_batch_pdf(satznummers, filters, mode):
+    # karty czytane z bazy już w procesie renderującym (ma własną pulę połączeń)
+    from data import ZESTAWY
+    from database import iter_cards
+    from pdf_utils import generate_cards_pdf, generate_label_sheet
+
+    cards = iter_cards(satznummers=satznummers, filters=filters)
+    if mode == "labels":
+        return generate_label_sheet(
+            (ZESTAWY.get(str(zestaw), "Zestaw"), len(stones), satznummer)
+            for satznummer, _, zestaw, _, stones in cards
+        ).getvalue()
+    return generate_cards_pdf(
+        (satznummer, machine, ZESTAWY.get(str(zestaw), ""), operator,
+         [s[0] for s in stones], [s[1] for s in stones])
+        for satznummer, machine, zestaw, operator, stones in cards
+    ).getvalue()
+
+
+def render_card_excel(satznummer):
+    from database import export_to_excel_transposed
+    return export_to_excel_transposed(satznummer=satznummer).getvalue()
+
+
+def render_excel_export(filters, directory=None):
+    # eksport wielu kart zapisywany do pliku tymczasowego; worker HTTP
+    # przesyła go potem porcjami i usuwa (zwracamy ścieżkę, a nie bajty)
+    import tempfile
+    from database import write_excel_stream
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx", prefix="export_", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write_excel_stream(f, filters=filters)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def render_data_export(fmt, filters, directory=None):
+    # Parquet/Arrow: plik budowany porcjami w procesie puli, jak eksport Excel
+    import tempfile
+    from exports import WRITERS
+
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}", prefix="export_", dir=directory)
+    os.close(fd)
+    try:
+        WRITERS[fmt](path, filters)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
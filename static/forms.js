@@ -1,19 +1,99 @@
-const diametersSet1 = [0.2011, 0.1878, 0.1749, 0.1631, 0.1521, 0.1418, 0.1323, 0.1233, 0.1150, 0.1072];
-const diametersSet2 = [0.5089, 0.4620, 0.4200, 0.3820, 0.3470, 0.3158, 0.2870, 0.2610, 0.2373, 0.2150];
-const diametersSet3 = [1.5830, 1.4100, 1.2560, 1.1190, 0.9970, 0.8880, 0.7910, 0.7049, 0.6280, 0.5590];
+// Katalog średnic pobierany z backendu (/api/diameters, źródło: data.py)
+let diameterCatalog = null;
+
+function loadDiameterCatalog() {
+    if (!diameterCatalog) {
+        diameterCatalog = fetch('/api/diameters').then(response => response.json()).then(data => {
+            // płaska, posortowana lista rozmiarów do szukania najbliższego
+            data.sorted = Object.entries(data.sets)
+                .flatMap(([set, diameters]) => diameters.map(diameter => ({ diameter, set })))
+                .sort((a, b) => a.diameter - b.diameter);
+            return data;
+        });
+    }
+    return diameterCatalog;
+}
+
+// najbliższy rozmiar z katalogu w granicach tolerancji (jak diameters.nearest_diameter)
+function nearestDiameter(catalog, value) {
+    const sorted = catalog.sorted;
+    let lo = 0, hi = sorted.length;
+    while (lo < hi) {
+        const mid = (lo + hi) >> 1;
+        if (sorted[mid].diameter < value) lo = mid + 1; else hi = mid;
+    }
+    let best = null;
+    for (const entry of [sorted[lo - 1], sorted[lo]]) {
+        if (entry && (!best || Math.abs(entry.diameter - value) < Math.abs(best.diameter - value))) best = entry;
+    }
+    return best && Math.abs(best.diameter - value) <= catalog.tolerance ? best : null;
+}
 
 document.addEventListener("DOMContentLoaded", () => {
     const select = document.getElementById('diameter_set');
+    if (!select) return;
+
     select.addEventListener('change', function() {
-        let diameters = diametersSet3;
-        if (this.value === '1') diameters = diametersSet1;
-        else if (this.value === '2') diameters = diametersSet2;
-
-        const cells = document.querySelectorAll('.diam-cell');
-        cells.forEach((cell, index) => {
-            if (diameters[index] !== undefined) {
-                cell.textContent = diameters[index].toFixed(4);
-            }
+        loadDiameterCatalog().then(catalog => {
+            const diameters = catalog.sets[this.value] || [];
+            const cells = document.querySelectorAll('.diam-cell');
+            cells.forEach((cell, index) => {
+                if (diameters[index] !== undefined) {
+                    cell.value = diameters[index].toFixed(4);
+                    cell.classList.remove('is-invalid', 'border-warning');
+                }
+            });
+        });
+    });
+
+    // wpisana/zeskanowana średnica: dociągnięcie do rozmiaru z katalogu
+    document.addEventListener('change', event => {
+        const input = event.target;
+        if (!input.classList || !input.classList.contains('diam-cell') || input.value === '') return;
+        const value = parseFloat(input.value.replace(',', '.'));
+        loadDiameterCatalog().then(catalog => {
+            const match = isNaN(value) ? null : nearestDiameter(catalog, value);
+            input.classList.toggle('is-invalid', !match);
+            // rozmiar z innego zestawu niż wybrany
+            input.classList.toggle('border-warning', !!match && match.set !== select.value);
+            input.title = match ? `${catalog.names[match.set]}: ${match.diameter.toFixed(4)}` : 'Brak w katalogu średnic';
+            if (match) input.value = match.diameter.toFixed(4);
         });
     });
 });
+
+// numer karty: duplikat przy ręcznym wpisie, nowy numer po wydaniu karty
+document.addEventListener("DOMContentLoaded", () => {
+    const input = document.getElementById('satznummer');
+    if (!input) return;
+
+    input.addEventListener('input', () => input.classList.remove('is-invalid'));
+    input.addEventListener('change', () => {
+        const value = input.value.trim();
+        if (!value) return;
+        fetch('/api/satznummer/check?satznummer=' + encodeURIComponent(value))
+            .then(response => response.json())
+            .then(data => {
+                // odpowiedź dla numeru, który jest nadal w polu
+                if (data.satznummer === input.value.trim()) input.classList.toggle('is-invalid', data.exists);
+            });
+    });
+
+    input.form.addEventListener('submit', event => {
+        if (input.classList.contains('is-invalid')) {
+            event.preventDefault();
+            return;
+        }
+        // naklejka (formaction) jest dla tej samej karty - numer bez zmian
+        if (event.submitter && event.submitter.hasAttribute('formaction')) return;
+        // PDF pobiera się bez przeładowania strony: kolejna karta dostaje nowy numer
+        // (dane formularza są już zebrane, zmiana pola ich nie dotyczy);
+        // after - wysłana karta mogła jeszcze nie zostać zapisana
+        const submitted = input.value.trim();
+        setTimeout(() => {
+            fetch('/api/satznummer/next?after=' + encodeURIComponent(submitted))
+                .then(response => response.json())
+                .then(data => { input.value = data.satznummer; });
+        }, 0);
+    });
+});
@@ -0,0 +1,34 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# konfiguracja czytana przy imporcie modułów aplikacji: osobna baza i katalogi
+_TMP = tempfile.mkdtemp(prefix="satz-test-")
+os.environ.update({
+    "SATZKARTEN_DB": os.path.join(_TMP, "test.db"),
+    "RENDER_WORKERS": "0",
+    "PDF_CACHE_DIR": os.path.join(_TMP, "pdf"),
+    "ARCHIVE_DIR": os.path.join(_TMP, "archive"),
+    "METRICS_DIR": "",
+    "COMPACT_INTERVAL": "0",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app():
+    from app import create_app
+    from db_pool import transaction
+
+    flask_app = create_app()
+    yield flask_app
+    with transaction() as conn:
+        # kamienie kaskadowo
+        conn.execute("DELETE FROM history")
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,42 @@
+from database import count_cards, create_card
+
+
+def test_compaction_does_not_archive_old_cards(app):
+    import maintenance
+
+    create_card("80000001", "M01", "3", "", [("ND-OLD", 0.7049)], data="2015-01-01 08:00:00")
+    result = maintenance.compact()
+    assert "archived" not in result
+    assert count_cards() == 1
+
+
+def test_archive_cli_requires_explicit_age(monkeypatch):
+    import pytest
+
+    import archive
+
+    monkeypatch.setattr("sys.argv", ["archive.py"])
+    with pytest.raises(SystemExit):
+        archive.main()
+
+
+def test_partial_satznummer_filter_finds_archived_cards(client):
+    import os
+    import shutil
+
+    import archive
+    from db_pool import transaction
+
+    create_card("81234567", "M01", "3", "", [("ND-ARCH", 0.7049)], data="2015-03-01 08:00:00")
+    try:
+        assert archive.archive_cards(older_than_days=365) == {2015: 1}
+        page = client.get("/history?satznummer=1234").get_data(as_text=True)
+        assert 'data-satznummer="81234567"' in page
+        # znaki LIKE w filtrze są dosłowne
+        page = client.get("/history?satznummer=12_4").get_data(as_text=True)
+        assert 'data-satznummer="81234567"' not in page
+    finally:
+        with transaction() as conn:
+            conn.execute("DELETE FROM archived_cards")
+        shutil.rmtree(archive.ARCHIVE_DIR, ignore_errors=True)
+        assert not os.path.exists(archive.ARCHIVE_DIR)
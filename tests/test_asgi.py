@@ -0,0 +1,35 @@
+import asyncio
+import sqlite3
+
+import asgi
+
+
+async def _request(path, query=b""):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": query, "headers": []}
+    await asgi.app(scope, receive, send)
+    return messages[0]["status"]
+
+
+def test_native_route_runs_migrations_without_lifespan(monkeypatch, tmp_path):
+    import app as flask_app
+    import db_pool
+
+    # świeża baza bez tabel: migracje musi uruchomić pierwsze żądanie natywne
+    monkeypatch.setattr(db_pool, "DB_NAME", str(tmp_path / "fresh.db"))
+    monkeypatch.setattr(flask_app, "_db_ready", False)
+    monkeypatch.setattr(asgi, "_flask_asgi", None)
+    db_pool.close_all()
+    try:
+        assert asyncio.run(_request("/history/changes", b"since=0")) == 200
+        with sqlite3.connect(tmp_path / "fresh.db") as conn:
+            assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'change_log'").fetchone()
+    finally:
+        db_pool.close_all()
@@ -0,0 +1,34 @@
+from database import count_cards, create_card, iter_cards
+
+
+def _seed():
+    create_card("30000001", "M01", "3", "", [("ND-AAA-1", 0.7049)])
+    create_card("30000002", "M01", "3", "", [("ND-BBB-1", 0.7910)])
+
+
+def test_count_and_print_selection_use_stone_filters(app):
+    _seed()
+    assert count_cards(filters={"code": "BBB"}) == 1
+    assert count_cards(filters={"diameter": "0.705"}) == 1
+    assert [card[0] for card in iter_cards(filters={"code": "BBB"})] == ["30000002"]
+
+
+def test_batch_pdf_with_code_filter_prints_matching_cards(client):
+    _seed()
+    response = client.get("/batch_pdf?code=BBB")
+    assert response.status_code == 200
+    assert response.headers["Content-Disposition"].endswith("Satzkarten_1.pdf")
+
+
+def test_batch_pdf_rejects_malformed_json(client):
+    _seed()
+    for body in (["30000001"], {"satznummers": "30000001"}, {"satznummers": [None, ["x"]]}):
+        response = client.post("/batch_pdf", json=body)
+        assert response.status_code == 400, body
+
+
+def test_batch_pdf_json_list(client):
+    _seed()
+    response = client.post("/batch_pdf", json={"satznummers": ["30000001", 30000002]})
+    assert response.status_code == 200
+    assert response.headers["Content-Disposition"].endswith("Satzkarten_2.pdf")
@@ -0,0 +1,40 @@
+import pytest
+
+from card_import import normalize, rows_from_cards
+from database import card_exists
+
+# średnice z JSON jako liczby (nie tekst), numer karty też liczbą
+CARDS = [
+    {"satznummer": 50000001, "zestaw": 3, "machine": "M01",
+     "stones": [{"code": "ND-AAA-1", "diameter": 0.705}, {"code": "ND-AAA-2", "diameter": 0.628}]},
+    {"satznummer": 50000002, "zestaw": "3", "stones": [{"code": "ND-BBB-1", "diameter": 12.5}]},
+]
+
+
+@pytest.mark.filterwarnings("error::FutureWarning")
+def test_numeric_json_diameters_snap_to_catalog(app):
+    cards, errors = normalize(rows_from_cards(CARDS))
+    assert [card["satznummer"] for card in cards] == ["50000001"]
+    assert cards[0]["stones"] == [("ND-AAA-1", 0.7049, "Nowy"), ("ND-AAA-2", 0.628, "Nowy")]
+    assert [(error["row"], error["field"]) for error in errors] == [(2, "diameter")]
+    assert "12.5 spoza katalogu" in errors[0]["error"]
+
+
+@pytest.mark.filterwarnings("error::FutureWarning")
+def test_api_cards_imports_valid_cards(client):
+    response = client.post("/api/cards", json=CARDS)
+    assert response.status_code == 200
+    assert response.json["created"] == ["50000001"]
+    assert response.json["error_count"] == 1
+    assert card_exists("50000001") and not card_exists("50000002")
+
+
+def test_csv_upload_with_semicolons(client):
+    csv = "satznummer;zestaw;code;diameter\n50000003;3;ND-CCC-1;0,705\n50000003;3;ND-CCC-2;\n"
+    response = client.post("/import", data=csv.encode(), content_type="text/csv")
+    assert response.status_code == 422
+    assert response.json["errors"][0]["field"] == "diameter"
+
+    response = client.post("/import", data=csv.replace(";\n", ";0,628\n").encode(), content_type="text/csv")
+    assert response.status_code == 201
+    assert response.json["created"] == ["50000003"]
@@ -0,0 +1,57 @@
+from database import count_cards, create_card
+
+
+def _live_cards():
+    from db_pool import connection
+
+    with connection() as conn:
+        return sorted(row[0] for row in conn.execute("SELECT satznummer FROM history WHERE deleted_at IS NULL"))
+
+
+def _seed():
+    create_card("20000001", "M01", "3", "", [("ND-AAA-1", 0.7049), ("ND-AAA-2", 0.6280)])
+    create_card("20000002", "M01", "3", "", [("ND-BBB-1", 0.7910)])
+    create_card("20000003", "M02", "2", "", [("ND-CCC-1", 0.5089)])
+
+
+def test_delete_by_code_filter_removes_only_matching_cards(client):
+    _seed()
+    response = client.post("/delete_cards", json={"filters": {"code": "BBB"}})
+    assert response.status_code == 200
+    assert response.json["cards"] == ["20000002"]
+    assert _live_cards() == ["20000001", "20000003"]
+
+
+def test_delete_by_diameter_filter_form(client):
+    _seed()
+    client.post("/delete_cards", data={"diameter": "0.705"})
+    assert _live_cards() == ["20000002", "20000003"]
+
+
+def test_delete_ignores_soft_deleted_stones(client):
+    from database import soft_delete_stone
+    from db_pool import connection
+
+    _seed()
+    with connection() as conn:
+        stone_id = conn.execute("SELECT id FROM details WHERE code = 'ND-BBB-1'").fetchone()[0]
+    soft_delete_stone(stone_id)
+    response = client.post("/delete_cards", json={"filters": {"code": "BBB"}})
+    assert response.json["deleted"] == 0
+    assert count_cards() == 3
+
+
+def test_history_lists_the_cards_a_filtered_delete_removes(client):
+    _seed()
+    page = client.get("/history?code=BBB").get_data(as_text=True)
+    assert 'data-satznummer="20000002"' in page
+    assert 'data-satznummer="20000001"' not in page
+
+
+def test_delete_rejects_malformed_json(client):
+    _seed()
+    for body in (["20000001"], "20000001", {"satznummers": "20000001"}, {"satznummers": [{"a": 1}]}):
+        response = client.post("/delete_cards", json=body)
+        assert response.status_code == 400, body
+        assert "error" in response.json
+    assert count_cards() == 3
@@ -0,0 +1,21 @@
+from diameters import match_payload, nearest_diameter, snap_diameter
+
+
+def test_non_finite_values_do_not_match_catalog():
+    for value in (float("nan"), float("inf"), float("-inf")):
+        assert nearest_diameter(value) is None
+        assert match_payload(value) is None
+    assert snap_diameter(0.705) == 0.7049
+
+
+def test_match_endpoint_rejects_nan(client):
+    assert client.get("/api/diameters/match?d=nan").status_code == 400
+    assert client.get("/api/diameters/match?d=0.705").json["match"]["diameter"] == 0.7049
+
+
+def test_card_form_stores_nan_diameter_as_invalid(client):
+    from db_pool import connection
+
+    client.post("/", data={"satznummer": "50000001", "diameter_set": "1", "code0": "ND-NAN", "diameter0": "nan"})
+    with connection() as conn:
+        assert conn.execute("SELECT diameter FROM details WHERE code = 'ND-NAN'").fetchone()[0] == 0.0
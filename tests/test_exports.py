@@ -0,0 +1,25 @@
+import os
+import tempfile
+
+from database import create_card
+
+
+def test_export_file_removed_when_client_leaves_before_first_chunk(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    create_card("60000001", "M01", "3", "", [("ND-A", 0.7049)])
+    response = client.get("/export", buffered=False)
+    assert response.status_code == 200
+    assert len(os.listdir(tmp_path)) == 1
+    # rozłączenie bez czytania treści
+    response.close()
+    assert os.listdir(tmp_path) == []
+
+
+def test_export_file_removed_after_download(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    create_card("60000002", "M01", "3", "", [("ND-B", 0.7049)])
+    response = client.get("/export")
+    assert response.data[:2] == b"PK"
+    assert int(response.headers["Content-Length"]) == len(response.data)
+    response.close()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,27 @@
+import app as app_module
+from database import card_exists
+from render_pool import RenderTimeout
+
+FORM = {"satznummer": "30000001", "machine_number": "M01", "diameter_set": "3",
+        "code1": "ND-AAA-1", "diameter1": "0.7049"}
+
+
+def test_new_card_returns_pdf(client):
+    response = client.post("/", data=FORM)
+    assert response.status_code == 200
+    assert response.mimetype == "application/pdf"
+    assert card_exists("30000001")
+
+
+def test_render_failure_after_save_redirects_to_history(client, monkeypatch):
+    def timeout(*args, **kwargs):
+        raise RenderTimeout("timeout")
+
+    monkeypatch.setattr(app_module.render_executor, "run", timeout)
+    response = client.post("/", data=FORM)
+    assert response.status_code == 302
+    assert "/history?satznummer=30000001" in response.location
+    assert card_exists("30000001")
+
+    page = client.get(response.location)
+    assert "30000001 została zapisana" in page.get_data(as_text=True)
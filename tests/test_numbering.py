@@ -0,0 +1,30 @@
+import re
+
+from numbering import peek_satznummer
+
+
+def _form_number(client):
+    page = client.get("/").get_data(as_text=True)
+    return re.search(r'name="satznummer" id="satznummer" class="form-control" value="(\d+)"', page).group(1)
+
+
+def test_form_and_label_do_not_consume_numbers(client):
+    number = _form_number(client)
+    assert _form_number(client) == number
+    assert client.post("/generate_label_direct", data={"diameter_set": "3"}).status_code == 400
+    assert client.get("/api/satznummer/next").json["satznummer"] == number
+
+
+def test_created_card_advances_peeked_number(client):
+    number = _form_number(client)
+    response = client.post("/", data={"satznummer": number, "code1": "ND-AAA-1", "diameter1": "0.7049"})
+    assert response.status_code == 200
+    assert int(_form_number(client)) > int(number)
+
+
+def test_peek_after_submitted_number():
+    number = int(peek_satznummer())
+    assert peek_satznummer(after=str(number + 5)) == str(number + 6)
+    assert peek_satznummer(after="ABC-1") == str(number)
+    # numery o nieparzystej liczbie cyfr są pomijane
+    assert peek_satznummer(after="9" * 16) == str(10 ** 17)
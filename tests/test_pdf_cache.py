@@ -0,0 +1,19 @@
+import os
+
+from pdf_cache import PdfCache
+
+
+def test_invalidate_many_removes_only_given_cards(tmp_path, monkeypatch):
+    cache = PdfCache(directory=str(tmp_path), disk_limit=10 ** 6)
+    for satznummer in ("70000001", "70000002", "70000003"):
+        cache.put(satznummer, "digest", b"%PDF")
+    scans = []
+    real_scandir = os.scandir
+    monkeypatch.setattr(os, "scandir", lambda path: scans.append(path) or real_scandir(path))
+
+    cache.invalidate_many(["70000001", "70000002"])
+
+    assert len(scans) == 1
+    assert cache.get("70000001", "digest") is None
+    assert cache.get("70000002", "digest") is None
+    assert cache.get("70000003", "digest") == b"%PDF"
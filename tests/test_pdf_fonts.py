@@ -0,0 +1,38 @@
+import pytest
+
+import pdf_fonts
+import pdf_utils
+from pdf_utils import generate_label_pdf, generate_pdf_bytes
+
+pymupdf = pytest.importorskip("pymupdf")
+
+OPERATOR = "Łukasz Żółć-Gęśla"
+
+
+def _render(satznummer):
+    data = generate_pdf_bytes(["ĄŚ-1", "C2"], satznummer, [1.0, 2.5], "Maszyna 7", operator=OPERATOR).getvalue()
+    return pymupdf.open(stream=data, filetype="pdf")[0]
+
+
+def _check_card(page, satznummer):
+    text = page.get_text()
+    assert OPERATOR in text
+    assert "ĄŚ-1" in text and satznummer in text
+    # tekst statyczny zapisany kodami zarezerwowanymi w podzbiorze fontu
+    assert "Satzkartennummer" in text and "Maszyna" in text
+    fonts = page.get_fonts()
+    assert fonts and all("+DejaVuSansCondensed" in font[3] for font in fonts)
+
+
+def test_patched_fonts_extract_unicode_text():
+    # drugi dokument z tymi samymi znakami bierze przycięty font z LRU
+    for satznummer in ("70000011", "70000011", "70000012"):
+        _check_card(_render(satznummer), satznummer)
+    label = pymupdf.open(stream=generate_label_pdf("Zestaw ż", 3, "ŁÓDŹ-1").getvalue(), filetype="pdf")[0]
+    assert "Zestaw ż / 3" in label.get_text() and "ŁÓDŹ-1" in label.get_text()
+
+
+def test_fonts_without_fpdf_internals(monkeypatch):
+    monkeypatch.setattr(pdf_fonts, "FPDF_INTERNALS", False)
+    monkeypatch.setattr(pdf_utils, "FPDF_INTERNALS", False)
+    _check_card(_render("70000013"), "70000013")
@@ -0,0 +1,42 @@
+import pytest
+
+import pdf_utils
+from pdf_utils import generate_cards_pdf
+
+pymupdf = pytest.importorskip("pymupdf")
+
+CARDS = [
+    ("70000001", "M1", "SET-A", "Operator A", ["C1", "C2"], [1.0, 2.5]),
+    ("70000002", "", None, "", ["X9"], [3.25]),
+]
+HEADER_GREY = round(200 / 255, 2)
+
+
+def _pages(data):
+    return list(pymupdf.open(stream=data, filetype="pdf"))
+
+
+def _check_two_cards(data):
+    first, second = _pages(data)
+    first_text, second_text = first.get_text(), second.get_text()
+    for page_text in (first_text, second_text):
+        for static in ("SATZ-KARTE", "Drawing die", "Durchmesser", "Satzkartennummer", "Maschine"):
+            assert static in page_text
+    assert "70000001" in first_text and "SET-A (2)" in first_text and "2.5000" in first_text
+    assert "70000002" in second_text and "X9" in second_text and "3.2500" in second_text
+    assert "70000001" not in second_text and "SET-A" not in second_text
+    # wypełnienie wierszy poprzedniej karty nie może przejść na nagłówki następnej
+    for page in (first, second):
+        fills = [d["fill"] for d in page.get_drawings() if d.get("fill")]
+        assert [round(c, 2) for c in fills[0]] == [HEADER_GREY] * 3
+        # logo i kod kreskowy
+        assert len(page.get_image_info()) == 2
+
+
+def test_two_cards_in_one_document():
+    _check_two_cards(generate_cards_pdf(CARDS).getvalue())
+
+
+def test_two_cards_without_fpdf_internals(monkeypatch):
+    monkeypatch.setattr(pdf_utils, "FPDF_INTERNALS", False)
+    _check_two_cards(generate_cards_pdf(CARDS).getvalue())